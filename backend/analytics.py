@@ -0,0 +1,267 @@
+from collections import defaultdict
+from datetime import date, datetime, time
+from sqlalchemy import event, func, inspect, insert, update
+from sqlalchemy.orm import Session
+from models import Todo as TodoModel, DailyRollup as DailyRollupModel, OccurrenceOverride as OccurrenceOverrideModel
+
+# Todo columns that feed the rollups
+TRACKED_FIELDS = ("user_id", "calendar_id", "created_at", "completed_at", "is_completed", "estimated_time")
+COUNTERS = ("created_count", "completed_count", "estimated_count", "estimated_minutes", "lead_time_minutes")
+# Occurrence override columns that feed the rollups; a missing calendar or estimate comes from the series
+OCCURRENCE_FIELDS = ("user_id", "todo_id", "occurrence_date", "calendar_id", "completed_at", "is_completed", "estimated_time")
+
+def contributions(values: dict, count_created: bool = True):
+    """The (bucket, counters) a todo with these field values adds to its user's rollups"""
+    calendar_id = values["calendar_id"] or ""
+    created_at = values["created_at"]
+    completed_at = values["completed_at"]
+    result = []
+    if created_at and count_created:
+        result.append(((values["user_id"], created_at.date(), created_at.hour, calendar_id), {"created_count": 1}))
+    if values["is_completed"] and completed_at:
+        counters = {"completed_count": 1}
+        if created_at:
+            counters["lead_time_minutes"] = max(0, int((completed_at - created_at).total_seconds() // 60))
+        if values["estimated_time"]:
+            counters["estimated_count"] = 1
+            counters["estimated_minutes"] = values["estimated_time"]
+        result.append(((values["user_id"], completed_at.date(), completed_at.hour, calendar_id), counters))
+    return result
+
+def _current_values(todo, fields=TRACKED_FIELDS) -> dict:
+    return {field: getattr(todo, field) for field in fields}
+
+def _previous_values(todo, fields=TRACKED_FIELDS) -> dict:
+    state = inspect(todo)
+    values = {}
+    for field in fields:
+        history = state.attrs[field].history
+        values[field] = history.deleted[0] if history.deleted else getattr(todo, field)
+    return values
+
+def _add(deltas, values: dict, sign: int, count_created: bool = True):
+    for bucket, counters in contributions(values, count_created):
+        for name, amount in counters.items():
+            deltas[bucket][name] += sign * amount
+
+def occurrence_values(values: dict, series) -> dict:
+    """The TRACKED_FIELDS of an occurrence, from its override's OCCURRENCE_FIELDS and its series' (calendar_id, estimated_time)"""
+    calendar_id, estimated_time = series
+    # Lead time runs from the start of the occurrence's day. It is not counted as created:
+    # occurrences nobody touched have no row to count.
+    return {
+        "user_id": values["user_id"],
+        "calendar_id": values["calendar_id"] or calendar_id,
+        "created_at": datetime.combine(values["occurrence_date"], time.min),
+        "completed_at": values["completed_at"],
+        "is_completed": values["is_completed"],
+        "estimated_time": values["estimated_time"] or estimated_time
+    }
+
+def _add_occurrence(deltas, values: dict, series, sign: int):
+    if series is not None and values["is_completed"]:
+        _add(deltas, occurrence_values(values, series), sign, count_created=False)
+
+def _series_fields(session: Session, todo_ids) -> dict:
+    if not todo_ids:
+        return {}
+    rows = session.query(TodoModel.id, TodoModel.calendar_id, TodoModel.estimated_time).filter(TodoModel.id.in_(todo_ids))
+    return {todo_id: (calendar_id, estimated_time) for todo_id, calendar_id, estimated_time in rows}
+
+def _occurrence_rows(query, series=None):
+    """Completed occurrences matched by an override query, as (override values, series fields).
+
+    `series` gives the (calendar_id, estimated_time) of a query's one series, saving the join.
+    """
+    columns = [getattr(OccurrenceOverrideModel, field) for field in OCCURRENCE_FIELDS]
+    if series is None:
+        query = query.with_entities(*columns, TodoModel.calendar_id, TodoModel.estimated_time).join(
+            TodoModel, TodoModel.id == OccurrenceOverrideModel.todo_id
+        )
+    else:
+        query = query.with_entities(*columns)
+    for row in query.filter(OccurrenceOverrideModel.is_completed.is_(True)).yield_per(1000):
+        yield dict(zip(OCCURRENCE_FIELDS, row)), series or tuple(row[len(OCCURRENCE_FIELDS):])
+
+def _upsert_increment(dialect_name: str, values: dict, counters: dict):
+    table = DailyRollupModel.__table__
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(table).values(**values).on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.day, table.c.hour, table.c.calendar_id],
+        set_={name: table.c[name] + amount for name, amount in counters.items()}
+    )
+
+def apply_deltas(session: Session, deltas):
+    """Add counter deltas to their rollup rows, creating rows as needed"""
+    table = DailyRollupModel.__table__
+    # Core statements on the connection, so this is safe to call while flushing
+    conn = session.connection()
+    for (user_id, day, hour, calendar_id), counters in deltas.items():
+        counters = {name: amount for name, amount in counters.items() if amount}
+        if not counters:
+            continue
+        values = {"user_id": user_id, "day": day, "hour": hour, "calendar_id": calendar_id}
+        values.update({name: counters.get(name, 0) for name in COUNTERS})
+        statement = _upsert_increment(conn.dialect.name, values, counters)
+        if statement is not None:
+            conn.execute(statement)
+            continue
+        key = (table.c.user_id == user_id) & (table.c.day == day) & (table.c.hour == hour) & (table.c.calendar_id == calendar_id)
+        increments = {name: table.c[name] + amount for name, amount in counters.items()}
+        if conn.execute(update(table).where(key).values(**increments)).rowcount == 0:
+            conn.execute(insert(table).values(**values))
+
+def forget_todos(session: Session, query):
+    """Take the todos matched by `query` out of the rollups before a bulk delete, which bypasses the flush hook"""
+    deltas = defaultdict(lambda: defaultdict(int))
+    columns = [getattr(TodoModel, field) for field in TRACKED_FIELDS]
+    for row in query.with_entities(*columns):
+        _add(deltas, dict(zip(TRACKED_FIELDS, row)), -1)
+    apply_deltas(session, deltas)
+
+def forget_occurrences(session: Session, query, series=None):
+    """Take the occurrence overrides matched by `query` out of the rollups before a bulk delete"""
+    deltas = defaultdict(lambda: defaultdict(int))
+    for values, series in _occurrence_rows(query, series):
+        _add_occurrence(deltas, values, series, -1)
+    apply_deltas(session, deltas)
+
+def record_todos(session: Session, rows):
+    """Add todos written by a bulk insert or update (dicts of column values) to the rollups"""
+    deltas = defaultdict(lambda: defaultdict(int))
+    for row in rows:
+        _add(deltas, {field: row.get(field) for field in TRACKED_FIELDS}, 1)
+    apply_deltas(session, deltas)
+
+def record_change(session: Session, previous: dict = None, current: dict = None):
+    """Move a todo changed by a Core update or delete (mappings of column values, before and after) between rollups"""
+    deltas = defaultdict(lambda: defaultdict(int))
+    if previous is not None:
+        _add(deltas, {field: previous[field] for field in TRACKED_FIELDS}, -1)
+    if current is not None:
+        _add(deltas, {field: current[field] for field in TRACKED_FIELDS}, 1)
+    apply_deltas(session, deltas)
+
+def rebuild_rollups(session: Session, username: str = None):
+    """Recompute rollups from the todos table, for one user or everyone"""
+    rollups = session.query(DailyRollupModel)
+    todos = session.query(TodoModel)
+    overrides = session.query(OccurrenceOverrideModel)
+    if username:
+        rollups = rollups.filter(DailyRollupModel.user_id == username)
+        todos = todos.filter(TodoModel.user_id == username)
+        overrides = overrides.filter(OccurrenceOverrideModel.user_id == username)
+    rollups.delete(synchronize_session=False)
+
+    deltas = defaultdict(lambda: defaultdict(int))
+    columns = [getattr(TodoModel, field) for field in TRACKED_FIELDS]
+    for row in todos.with_entities(*columns).yield_per(1000):
+        _add(deltas, dict(zip(TRACKED_FIELDS, row)), 1)
+    for values, series in _occurrence_rows(overrides):
+        _add_occurrence(deltas, values, series, 1)
+    apply_deltas(session, deltas)
+
+def _track_occurrence_changes(session, deltas):
+    new = [obj for obj in session.new if isinstance(obj, OccurrenceOverrideModel)]
+    dirty = [obj for obj in session.dirty if isinstance(obj, OccurrenceOverrideModel) and session.is_modified(obj)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, OccurrenceOverrideModel)]
+    if not (new or dirty or deleted):
+        return
+    series = _series_fields(session, {obj.todo_id for obj in new + dirty + deleted})
+    for obj in new:
+        _add_occurrence(deltas, _current_values(obj, OCCURRENCE_FIELDS), series.get(obj.todo_id), 1)
+    for obj in dirty:
+        _add_occurrence(deltas, _previous_values(obj, OCCURRENCE_FIELDS), series.get(obj.todo_id), -1)
+        _add_occurrence(deltas, _current_values(obj, OCCURRENCE_FIELDS), series.get(obj.todo_id), 1)
+    for obj in deleted:
+        _add_occurrence(deltas, _previous_values(obj, OCCURRENCE_FIELDS), series.get(obj.todo_id), -1)
+
+@event.listens_for(Session, "before_flush")
+def track_todo_changes(session, flush_context, instances):
+    deltas = defaultdict(lambda: defaultdict(int))
+    for obj in session.new:
+        if isinstance(obj, TodoModel):
+            _add(deltas, _current_values(obj), 1)
+    for obj in session.dirty:
+        if isinstance(obj, TodoModel) and session.is_modified(obj):
+            _add(deltas, _previous_values(obj), -1)
+            _add(deltas, _current_values(obj), 1)
+    for obj in session.deleted:
+        if isinstance(obj, TodoModel):
+            _add(deltas, _previous_values(obj), -1)
+    _track_occurrence_changes(session, deltas)
+    if deltas:
+        apply_deltas(session, deltas)
+
+# ================= QUERIES =================
+
+def _range(session: Session, username: str, date_from: date, date_to: date):
+    return session.query(DailyRollupModel).filter(
+        DailyRollupModel.user_id == username,
+        DailyRollupModel.day >= date_from,
+        DailyRollupModel.day <= date_to
+    )
+
+def _rate(completed, created):
+    return round(completed / created, 4) if created else None
+
+def summary(session: Session, username: str, date_from: date, date_to: date) -> dict:
+    rows = _range(session, username, date_from, date_to).with_entities(
+        DailyRollupModel.day,
+        func.sum(DailyRollupModel.created_count),
+        func.sum(DailyRollupModel.completed_count)
+    ).group_by(DailyRollupModel.day).order_by(DailyRollupModel.day).all()
+    created = sum(row[1] for row in rows)
+    completed = sum(row[2] for row in rows)
+    return {
+        "created": created,
+        "completed": completed,
+        "completion_rate": _rate(completed, created),
+        "days": [{"day": day, "created": day_created, "completed": day_completed} for day, day_created, day_completed in rows]
+    }
+
+def by_calendar(session: Session, username: str, date_from: date, date_to: date) -> list:
+    rows = _range(session, username, date_from, date_to).with_entities(
+        DailyRollupModel.calendar_id,
+        func.sum(DailyRollupModel.created_count),
+        func.sum(DailyRollupModel.completed_count)
+    ).group_by(DailyRollupModel.calendar_id).all()
+    return [
+        {"calendar_id": calendar_id or None, "created": created, "completed": completed, "completion_rate": _rate(completed, created)}
+        for calendar_id, created, completed in rows if created or completed
+    ]
+
+def activity(session: Session, username: str, date_from: date, date_to: date) -> dict:
+    by_hour = [0] * 24
+    for hour, completed in _range(session, username, date_from, date_to).with_entities(
+        DailyRollupModel.hour, func.sum(DailyRollupModel.completed_count)
+    ).group_by(DailyRollupModel.hour):
+        by_hour[hour] = completed
+
+    # Weekday extraction differs per database, so fold the per-day sums here instead
+    by_weekday = [0] * 7
+    for day, completed in _range(session, username, date_from, date_to).with_entities(
+        DailyRollupModel.day, func.sum(DailyRollupModel.completed_count)
+    ).group_by(DailyRollupModel.day):
+        by_weekday[day.weekday()] += completed
+    return {"completions_by_weekday": by_weekday, "completions_by_hour": by_hour}
+
+def time_estimates(session: Session, username: str, date_from: date, date_to: date) -> dict:
+    completed, estimated_count, estimated_minutes, lead_time_minutes = _range(session, username, date_from, date_to).with_entities(
+        func.coalesce(func.sum(DailyRollupModel.completed_count), 0),
+        func.coalesce(func.sum(DailyRollupModel.estimated_count), 0),
+        func.coalesce(func.sum(DailyRollupModel.estimated_minutes), 0),
+        func.coalesce(func.sum(DailyRollupModel.lead_time_minutes), 0)
+    ).one()
+    return {
+        "completed": completed,
+        "completed_with_estimate": estimated_count,
+        "estimated_minutes": estimated_minutes,
+        "average_estimated_minutes": round(estimated_minutes / estimated_count, 1) if estimated_count else None,
+        "average_lead_time_minutes": round(lead_time_minutes / completed, 1) if completed else None
+    }
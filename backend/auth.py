@@ -1,22 +1,34 @@
+import asyncio
+import contextvars
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from cache import TTLCache
 from config import settings
-from database import SessionLocal
+from database import AsyncSessionLocal, SessionLocal, bootstrap_lock, route_to_user
 from models import User as UserModel
+import metrics
+import ratelimit
 
 # Configuration
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing. passlib, bcrypt and python-jose (which loads its cryptography
+# backends) are imported on first use rather than at worker startup.
+@functools.lru_cache(maxsize=None)
+def password_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Token model
 class Token(BaseModel):
@@ -33,17 +45,61 @@ class UserCreate(BaseModel):
     username: str
     password: str
 
+class Registration(User):
+    job_id: str  # Background job that sets up the new account's default data
+
 class UserInDB(User):
     hashed_password: str
 
 # Security
 security = HTTPBearer()
 
+# Verified principals by username
+principal_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS)
+metrics.registry.track_cache("auth_principal", principal_cache)
+
+def invalidate_user(username: str):
+    principal_cache.pop(username)
+
+# Drop a cached principal whenever its row changes (e.g. password change) or is deleted
+@event.listens_for(UserModel, "after_update")
+@event.listens_for(UserModel, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.username)
+
+# bcrypt releases the GIL, so a small dedicated pool hashes in parallel without
+# tying up the event loop or the threadpool that serves regular endpoints
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+_pending_password_tasks = 0
+
+async def run_password_task(func, *args):
+    """Run bcrypt-bound auth work (hashing plus its user lookups) in the password pool"""
+    global _pending_password_tasks
+    # Only touched from the event loop thread, so no lock is needed
+    if _pending_password_tasks >= settings.PASSWORD_HASH_MAX_PENDING:
+        metrics.registry.observe_shed("password_capacity")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests in progress, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _pending_password_tasks += 1
+    try:
+        loop = asyncio.get_running_loop()
+        # In the caller's context, so the task's queries are counted against its request
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(password_executor, functools.partial(context.run, func, *args))
+    finally:
+        _pending_password_tasks -= 1
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return password_context().hash(password)
 
 def get_user(username: str):
     db = SessionLocal()
@@ -55,6 +111,16 @@ def get_user(username: str):
     finally:
         db.close()
 
+async def lookup_user(username: str):
+    """get_user without blocking the event loop"""
+    if AsyncSessionLocal is None:
+        return await run_in_threadpool(get_user, username)
+    async with AsyncSessionLocal() as db:
+        user = await db.get(UserModel, username)
+        if user:
+            return UserInDB(username=user.username, hashed_password=user.hashed_password)
+        return None
+
 def create_user(user_create: UserCreate):
     db = SessionLocal()
     try:
@@ -75,10 +141,6 @@ def create_user(user_create: UserCreate):
         db.add(db_user)
         db.commit()
         
-        # Initialize default data for the new user
-        from database import init_user_data
-        init_user_data(user_create.username)
-        
         return User(username=user_create.username)
     finally:
         db.close()
@@ -92,6 +154,7 @@ def authenticate_user(username: str, password: str):
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -101,43 +164,99 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def create_stream_ticket(username: str) -> str:
+    """A token valid only for /api/stream, short-lived as it travels in the URL"""
+    return create_access_token(
+        {"sub": username, "scope": "stream"},
+        expires_delta=timedelta(seconds=settings.STREAM_TICKET_SECONDS)
+    )
+
+async def user_from_token(token: str, scope: Optional[str] = None) -> User:
+    """The user a token was issued to; `scope` must match the token's, None for access tokens"""
+    from jose import JWTError, jwt
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("scope") != scope:
             raise credentials_exception
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(username=token_data.username)
+    
+    if settings.AUTH_STATELESS:
+        return User(username=token_data.username)
+    
+    user = principal_cache.get(token_data.username)
     if user is None:
-        raise credentials_exception
+        user_in_db = await lookup_user(token_data.username)
+        if user_in_db is None:
+            raise credentials_exception
+        user = User(username=user_in_db.username)
+        principal_cache.set(user.username, user)
     return user
 
-# Create default admin user if it doesn't exist
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """The authenticated user, once the request is within their rate limits and write capacity"""
+    user = await user_from_token(credentials.credentials)
+    route_to_user(user.username)
+    async with ratelimit.admit(request, user.username):
+        yield user
+
+async def get_stream_user(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
+    ticket: Optional[str] = None
+):
+    """get_current_user that also takes a stream ticket as ?ticket=, as browsers' EventSource
+    can't send headers. Access tokens are never accepted in the URL, where logs keep them."""
+    if credentials is not None:
+        user = await user_from_token(credentials.credentials)
+    elif ticket is not None:
+        user = await user_from_token(ticket, scope="stream")
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    route_to_user(user.username)
+    async with ratelimit.admit(request, user.username):
+        yield user
+
+def admin_user_exists(db) -> bool:
+    return db.query(UserModel.username).filter(UserModel.username == settings.DEFAULT_USERNAME).first() is not None
+
+# Create default admin user if it doesn't exist. Starting workers only look it up; creating
+# it (and paying for the bcrypt hash) happens once, under the bootstrap lock.
 def ensure_admin_user():
     db = SessionLocal()
     try:
-        admin_user = db.query(UserModel).filter(UserModel.username == settings.DEFAULT_USERNAME).first()
-        if not admin_user:
+        if admin_user_exists(db):
+            return
+        with bootstrap_lock():
+            if admin_user_exists(db):
+                return
             print(f"Creating default admin user: {settings.DEFAULT_USERNAME}")
             db_user = UserModel(
                 username=settings.DEFAULT_USERNAME,
                 hashed_password=get_password_hash(settings.DEFAULT_PASSWORD)
             )
             db.add(db_user)
-            db.commit()
+            try:
+                db.commit()
+            except IntegrityError:
+                # Created meanwhile by a process the lock doesn't cover
+                db.rollback()
+                return
             
             # Initialize default data for admin
             from database import init_user_data
             init_user_data(settings.DEFAULT_USERNAME)
             print("Default admin user created with default calendars!")
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
@@ -0,0 +1,705 @@
+#!/usr/bin/env python3
+"""
+Load-test the API route by route and compare the results against a stored baseline.
+
+Seeds a throwaway SQLite database (or --database-url) with --users users, each owning
+--todos todos, --calendars calendars and --templates templates, then runs each workload
+mix for --duration seconds with --concurrency clients against each transport:
+
+  asgi     the app called in-process, without sockets, so only the app is measured
+  uvicorn  a uvicorn worker in a subprocess, over keep-alive HTTP/1.1 connections
+
+Mixes:
+
+  read-heavy   lists, date windows, pages, streams, revalidations, search, sync,
+               bootstrap and analytics
+  drag-storm   calendar drag-and-drop: date moves, completions, batch moves and
+               occurrence edits, with the occasional create/delete
+  login-burst  logins and registrations alongside profile and todo reads
+  migration    /api/migrate uploads and streamed /api/migrate/stream imports
+
+The JSON report has throughput, status counts and p50/p95/p99 latency per endpoint and
+lists any route in main.py that no mix exercised. Nothing leaves the machine. From the
+backend/ directory:
+
+    python benchmarks/api_load.py --output report.json
+    python benchmarks/api_load.py --save-baseline     # record a known-good run
+    python benchmarks/api_load.py                     # exits 1 on a regression
+
+Latency depends on the machine, so record the baseline where it will be compared.
+"""
+
+import argparse
+import asyncio
+import http.client
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from login_storm import free_port, percentile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api_load_baseline.json")
+
+PASSWORD = "bench-password"
+TODAY = date.today()
+WORDS = (
+    "groceries", "report", "dentist", "invoice", "workout", "meeting", "laundry",
+    "budget", "garden", "review", "taxes", "birthday", "flight", "homework", "call",
+)
+SEED_CHUNK_ROWS = 500
+SERIES_EVERY = 50  # One todo in this many is a weekly series
+SERIES_WEEKS = 260
+MIGRATE_TODOS = 100
+STREAM_LINES = 1000
+
+# Regressions are only flagged past both the relative tolerance and this absolute floor,
+# and only for endpoints with enough samples for their percentiles to mean something
+NOISE_FLOOR_MS = 5.0
+MIN_SAMPLES = 30
+
+# ================= SEEDING =================
+
+class BenchUser:
+    def __init__(self, username):
+        self.username = username
+        self.token = None
+        self.todo_ids = []
+        self.calendar_ids = []
+        self.template_ids = []
+        self.series = []  # (todo id, first occurrence)
+        self.skipped = set()  # (todo id, occurrence date) removed by DELETE
+        self.created = defaultdict(list)  # resource -> ids created during the run
+        self.etags = {}
+        self.version = 0
+        self.job_ids = []
+
+def calendar_row(username, index):
+    return {
+        "id": f"{username}-cal{index}",
+        "name": f"Calendar {index}",
+        "color": ("#3B82F6", "#10B981", "#F59E0B", "#EF4444")[index % 4],
+        "is_default": index == 0,
+    }
+
+def template_row(username, index, rng, calendar_ids):
+    return {
+        "id": f"{username}-tpl{index}",
+        "name": f"{rng.choice(WORDS).title()} template {index}",
+        "title": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)}",
+        "description": f"Remember the {rng.choice(WORDS)}",
+        "start_date": None,
+        "end_date": None,
+        "estimated_time": rng.choice((None, 15, 30, 60)),
+        "priority": rng.choice(("low", "medium", "high")),
+        "calendar_id": rng.choice(calendar_ids) if calendar_ids else None,
+    }
+
+def todo_row(username, index, rng, calendar_ids):
+    recurring = index % SERIES_EVERY == 0
+    if recurring:
+        start = TODAY - timedelta(weeks=SERIES_WEEKS // 5)
+    else:
+        start = TODAY + timedelta(days=rng.randint(-180, 180)) if rng.random() < 0.9 else None
+    created_at = datetime.utcnow() - timedelta(days=rng.randint(0, 365), minutes=rng.randint(0, 1440))
+    completed = not recurring and rng.random() < 0.4
+    return {
+        "id": f"{username}-todo{index}",
+        "title": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} #{index}",
+        "description": f"Follow up on the {rng.choice(WORDS)} and the {rng.choice(WORDS)}" if rng.random() < 0.5 else None,
+        "start_date": start,
+        "end_date": start + timedelta(days=rng.randint(0, 2)) if start and rng.random() < 0.3 else None,
+        "estimated_time": rng.choice((None, 15, 30, 45, 60, 120)),
+        "priority": rng.choice(("low", "medium", "high")),
+        "calendar_id": rng.choice(calendar_ids) if calendar_ids else None,
+        "is_completed": completed,
+        "created_at": created_at,
+        "completed_at": created_at + timedelta(minutes=rng.randint(5, 7 * 1440)) if completed else None,
+        "is_recurring": recurring,
+        "recurring_pattern": "weekly" if recurring else None,
+        "recurring_count": SERIES_WEEKS if recurring else None,
+    }
+
+def seed(args):
+    """Create the users and their data through the bulk importer, so sync versions,
+    rollups and search indexes are maintained as in production"""
+    from auth import create_access_token, get_password_hash
+    from database import SessionLocal, init_db
+    from importer import write_rows
+    from models import User as UserModel, Todo as TodoModel, Calendar as CalendarModel, Template as TemplateModel
+
+    init_db()
+    # One hash shared by every user; bcrypt would otherwise dominate seeding
+    hashed_password = get_password_hash(PASSWORD)
+    rng = random.Random(args.seed)
+    users = []
+    db = SessionLocal()
+    try:
+        for number in range(args.users):
+            user = BenchUser(f"bench{number}")
+            db.add(UserModel(username=user.username, hashed_password=hashed_password))
+            db.flush()
+
+            calendars = [calendar_row(user.username, i) for i in range(args.calendars)]
+            user.calendar_ids = [row["id"] for row in calendars]
+            templates = [template_row(user.username, i, rng, user.calendar_ids) for i in range(args.templates)]
+            user.template_ids = [row["id"] for row in templates]
+            todos = [todo_row(user.username, i, rng, user.calendar_ids) for i in range(args.todos)]
+            user.todo_ids = [row["id"] for row in todos if not row["is_recurring"]]
+            user.series = [(row["id"], row["start_date"]) for row in todos if row["is_recurring"]]
+
+            for model, rows in ((CalendarModel, calendars), (TemplateModel, templates), (TodoModel, todos)):
+                for start in range(0, len(rows), SEED_CHUNK_ROWS):
+                    write_rows(db, user.username, model, rows[start:start + SEED_CHUNK_ROWS])
+            db.commit()
+            user.token = create_access_token({"sub": user.username}, expires_delta=timedelta(days=1))
+            users.append(user)
+    finally:
+        db.close()
+    return users
+
+# ================= WORKLOAD =================
+
+class Call:
+    """One request of a mix. `route` is the path template from main.py; `label` tells
+    apart variants of the same route in the report"""
+
+    def __init__(self, route, path, body=None, label=None, headers=None, content_type="application/json", after=None):
+        self.method, _ = route.split(" ", 1)
+        self.route = route
+        self.path = path
+        self.key = f"{route} ({label})" if label else route
+        self.headers = headers or {}
+        self.body = body if body is None or isinstance(body, bytes) else json.dumps(body).encode()
+        if self.body is not None:
+            self.headers["Content-Type"] = content_type
+        self.after = after  # Called with (response headers, body) on success
+
+def random_window(rng, days):
+    start = TODAY + timedelta(days=rng.randint(-60, 60))
+    return start, start + timedelta(days=days - 1)
+
+def remember_etag(user, path):
+    def after(headers, body):
+        user.etags[path] = headers.get("etag")
+    return after
+
+def remember_created(user, resource):
+    def after(headers, body):
+        user.created[resource].append(json.loads(body)["id"])
+    return after
+
+def remember_version(user):
+    def after(headers, body):
+        user.version = json.loads(body)["version"]
+    return after
+
+def open_occurrence(user, rng):
+    """A (series id, date) occurrence that hasn't been deleted"""
+    while True:
+        todo_id, first = rng.choice(user.series)
+        occurrence = first + timedelta(weeks=rng.randrange(SERIES_WEEKS))
+        if (todo_id, occurrence) not in user.skipped:
+            return todo_id, occurrence
+
+# Read-heavy
+
+def health(user, rng):
+    return Call("GET /", "/")
+
+def list_todos(user, rng):
+    return Call("GET /api/todos", "/api/todos")
+
+def window_todos(user, rng):
+    start, end = random_window(rng, 35)
+    return Call("GET /api/todos", f"/api/todos?from={start}&to={end}", label="window")
+
+def page_todos(user, rng):
+    return Call("GET /api/todos", "/api/todos?limit=100", label="page")
+
+def stream_todos(user, rng):
+    return Call("GET /api/todos", "/api/todos?stream=true", label="stream")
+
+def revalidate_todos(user, rng):
+    path = "/api/todos"
+    etag = user.etags.get(path)
+    return Call("GET /api/todos", path, label="If-None-Match", after=remember_etag(user, path),
+                headers={"If-None-Match": etag} if etag else None)
+
+def get_todo(user, rng):
+    return Call("GET /api/todos/{todo_id}", f"/api/todos/{rng.choice(user.todo_ids)}")
+
+def occurrences(user, rng):
+    start, end = random_window(rng, 35)
+    return Call("GET /api/occurrences", f"/api/occurrences?from={start}&to={end}")
+
+def search_todos(user, rng):
+    return Call("GET /api/todos/search", f"/api/todos/search?q={rng.choice(WORDS)[:4]}")
+
+def search_templates(user, rng):
+    return Call("GET /api/templates/search", f"/api/templates/search?q={rng.choice(WORDS)[:4]}")
+
+def list_calendars(user, rng):
+    return Call("GET /api/calendars", "/api/calendars")
+
+def list_templates(user, rng):
+    return Call("GET /api/templates", "/api/templates")
+
+def bootstrap(user, rng):
+    start, end = random_window(rng, 35)
+    return Call("GET /api/bootstrap", f"/api/bootstrap?from={start}&to={end}", after=remember_version(user))
+
+def sync(user, rng):
+    return Call("GET /api/sync", f"/api/sync?since={user.version}", after=remember_version(user))
+
+def analytics(name):
+    def call(user, rng):
+        return Call(f"GET /api/analytics/{name}", f"/api/analytics/{name}")
+    call.__name__ = f"analytics_{name}"
+    return call
+
+def scrape_metrics(user, rng):
+    return Call("GET /metrics", "/metrics")
+
+def me(user, rng):
+    return Call("GET /api/users/me", "/api/users/me")
+
+# Drag-update storm
+
+def move_todo(user, rng):
+    start, end = random_window(rng, rng.randint(1, 3))
+    return Call("PUT /api/todos/{todo_id}", f"/api/todos/{rng.choice(user.todo_ids)}",
+                {"start_date": str(start), "end_date": str(end)}, label="move")
+
+def complete_todo(user, rng):
+    return Call("PUT /api/todos/{todo_id}", f"/api/todos/{rng.choice(user.todo_ids)}",
+                {"is_completed": rng.random() < 0.5}, label="complete")
+
+def batch_move(user, rng):
+    start, _ = random_window(rng, 1)
+    operations = [
+        {"resource": "todo", "op": "update", "id": todo_id, "data": {"start_date": str(start)}}
+        for todo_id in rng.sample(user.todo_ids, min(10, len(user.todo_ids)))
+    ]
+    return Call("POST /api/batch", "/api/batch", {"operations": operations})
+
+def edit_occurrence(user, rng):
+    todo_id, occurrence = open_occurrence(user, rng)
+    return Call("PUT /api/todos/{todo_id}/occurrences/{occurrence_date}", f"/api/todos/{todo_id}/occurrences/{occurrence}",
+                {"is_completed": rng.random() < 0.5})
+
+def skip_occurrence(user, rng):
+    todo_id, occurrence = open_occurrence(user, rng)
+    user.skipped.add((todo_id, occurrence))
+    return Call("DELETE /api/todos/{todo_id}/occurrences/{occurrence_date}", f"/api/todos/{todo_id}/occurrences/{occurrence}")
+
+def create_todo(user, rng):
+    start, _ = random_window(rng, 1)
+    return Call("POST /api/todos", "/api/todos", {"title": f"New {rng.choice(WORDS)}", "start_date": str(start)},
+                after=remember_created(user, "todo"))
+
+def delete_todo(user, rng):
+    if not user.created["todo"]:
+        return create_todo(user, rng)
+    return Call("DELETE /api/todos/{todo_id}", f"/api/todos/{user.created['todo'].pop()}")
+
+def create_calendar(user, rng):
+    return Call("POST /api/calendars", "/api/calendars", {"name": f"{rng.choice(WORDS).title()}", "color": "#8B5CF6"},
+                after=remember_created(user, "calendar"))
+
+def update_calendar(user, rng):
+    return Call("PUT /api/calendars/{calendar_id}", f"/api/calendars/{rng.choice(user.calendar_ids)}",
+                {"color": rng.choice(("#3B82F6", "#10B981", "#F59E0B"))})
+
+def remember_job(user):
+    def after(headers, body):
+        user.job_ids.append(json.loads(body)["id"])
+    return after
+
+def delete_calendar(user, rng):
+    if not user.created["calendar"]:
+        return create_calendar(user, rng)
+    return Call("DELETE /api/calendars/{calendar_id}", f"/api/calendars/{user.created['calendar'].pop()}",
+                after=remember_job(user))
+
+def job_status(user, rng):
+    if not user.job_ids:
+        return delete_calendar(user, rng)
+    return Call("GET /api/jobs/{job_id}", f"/api/jobs/{rng.choice(user.job_ids[-20:])}")
+
+def create_template(user, rng):
+    return Call("POST /api/templates", "/api/templates", {"name": f"{rng.choice(WORDS).title()}", "title": "From template"},
+                after=remember_created(user, "template"))
+
+def delete_template(user, rng):
+    if not user.created["template"]:
+        return create_template(user, rng)
+    return Call("DELETE /api/templates/{template_id}", f"/api/templates/{user.created['template'].pop()}")
+
+# Login burst
+
+def login(user, rng):
+    return Call("POST /api/token", "/api/token", {"username": user.username, "password": PASSWORD})
+
+registrations = itertools.count()
+
+def register(user, rng):
+    username = f"bench-new-{os.getpid()}-{next(registrations)}"
+    return Call("POST /api/register", "/api/register", {"username": username, "password": PASSWORD})
+
+# Migration
+
+def migrate(user, rng):
+    # Re-imports of the user's own todos, so the data set keeps its size whatever ran before
+    todos = [
+        {"id": todo_id, "title": f"Imported {WORDS[i % len(WORDS)]} #{i}",
+         "startDate": str(TODAY + timedelta(days=i % 60)), "priority": "medium",
+         "isCompleted": i % 3 == 0, "createdAt": "2024-01-01T09:00:00.000Z"}
+        for i, todo_id in enumerate(user.todo_ids[:MIGRATE_TODOS])
+    ]
+    calendars = [{"id": calendar_id, "name": f"Calendar {i}", "color": "#6B7280"} for i, calendar_id in enumerate(user.calendar_ids)]
+    return Call("POST /api/migrate", "/api/migrate", {"todos": todos, "calendars": calendars, "templates": []})
+
+def migrate_stream(user, rng):
+    lines = (
+        json.dumps({"type": "todo", "id": todo_id, "title": f"Streamed {WORDS[i % len(WORDS)]} #{i}",
+                    "startDate": str(TODAY + timedelta(days=i % 90)), "createdAt": "2024-01-01T09:00:00.000Z"})
+        for i, todo_id in enumerate(user.todo_ids[:STREAM_LINES])
+    )
+    return Call("POST /api/migrate/stream", "/api/migrate/stream", "\n".join(lines).encode(),
+                content_type="application/x-ndjson")
+
+# Mix name -> (operation, weight)
+MIXES = {
+    "read-heavy": [
+        (health, 1), (list_todos, 3), (window_todos, 4), (page_todos, 2), (stream_todos, 1),
+        (revalidate_todos, 3), (get_todo, 2), (occurrences, 3), (search_todos, 2), (search_templates, 1),
+        (list_calendars, 2), (list_templates, 2), (bootstrap, 1), (sync, 2), (me, 1),
+        (analytics("summary"), 1), (analytics("calendars"), 1), (analytics("activity"), 1), (analytics("time"), 1),
+        (scrape_metrics, 1),
+    ],
+    "drag-storm": [
+        (move_todo, 8), (complete_todo, 3), (batch_move, 2), (edit_occurrence, 2), (skip_occurrence, 1),
+        (window_todos, 3), (occurrences, 2), (create_todo, 1), (delete_todo, 1),
+        (create_calendar, 1), (update_calendar, 1), (delete_calendar, 1), (create_template, 1), (delete_template, 1), (job_status, 1),
+    ],
+    "login-burst": [
+        (login, 8), (register, 1), (me, 2), (list_todos, 2),
+    ],
+    "migration": [
+        (migrate, 3), (migrate_stream, 1), (window_todos, 2),
+    ],
+}
+
+# ================= TRANSPORTS =================
+
+class ASGITransport:
+    """Calls the app directly on this event loop"""
+
+    name = "asgi"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method, path, headers, body):
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+        }
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body or b"", "more_body": False}
+            # The client never disconnects; the app stops listening once it has responded
+            await asyncio.get_running_loop().create_future()
+
+        response = {"status": None, "headers": {}, "body": []}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = {name.decode().lower(): value.decode() for name, value in message.get("headers", [])}
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            # Starlette re-raises after sending its 500, for the server to log
+            traceback.print_exc()
+            if response["status"] is None:
+                response["status"] = 500
+        return response["status"], response["headers"], b"".join(response["body"])
+
+    async def shutdown(self):
+        # No server runs the lifespan here; the app's shutdown handlers close the async pool
+        await self.app.router.shutdown()
+
+    def close(self):
+        pass
+
+class HTTPTransport:
+    """Blocking keep-alive connections, one per client thread"""
+
+    name = "uvicorn"
+
+    def __init__(self, port, concurrency):
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.local = threading.local()
+
+    def _request(self, method, path, headers, body):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+        return response.status, {name.lower(): value for name, value in response.getheaders()}, content
+
+    async def request(self, method, path, headers, body):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._request, method, path, headers, body)
+
+    def close(self):
+        self.executor.shutdown()
+
+def start_uvicorn(port):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR,
+    )
+    deadline = time.time() + 30
+    while True:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit("uvicorn exited during startup")
+            if time.time() > deadline:
+                process.terminate()
+                raise SystemExit("uvicorn did not start within 30 seconds")
+            time.sleep(0.1)
+
+# ================= RUNNING =================
+
+def summarize(latencies, statuses, seconds):
+    errors = sum(count for status, count in statuses.items() if status == "exception" or int(status) >= 400)
+    requests = sum(statuses.values())
+    return {
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+        "throughput_rps": round(requests / seconds, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+async def run_mix(transport, users, mix, args):
+    operations, weights = zip(*MIXES[mix])
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    routes = set()
+    measure_from = time.perf_counter() + args.warmup
+    stop_at = measure_from + args.duration
+
+    async def client(number):
+        rng = random.Random(f"{args.seed}-{mix}-{number}")
+        while time.perf_counter() < stop_at:
+            user = users[rng.randrange(len(users))]
+            call = rng.choices(operations, weights)[0](user, rng)
+            headers = dict(call.headers, Authorization=f"Bearer {user.token}")
+            started = time.perf_counter()
+            try:
+                status, response_headers, body = await transport.request(call.method, call.path, headers, call.body)
+            except (OSError, http.client.HTTPException):
+                status = "exception"
+            elapsed = time.perf_counter() - started
+            if started >= measure_from:
+                latencies[call.key].append(elapsed)
+                statuses[call.key][str(status)] += 1
+                routes.add(call.route)
+            if status != "exception" and status < 400 and call.after:
+                call.after(response_headers, body)
+
+    await asyncio.gather(*(client(number) for number in range(args.concurrency)))
+    total_statuses = sum(statuses.values(), Counter())
+    total_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "total": summarize(total_latencies, total_statuses, args.duration),
+        "endpoints": {key: summarize(latencies[key], statuses[key], args.duration) for key in sorted(latencies)},
+    }, routes
+
+async def run_transport(transport, users, args):
+    results = {}
+    routes = set()
+    for mix in args.mixes:
+        results[mix], mix_routes = await run_mix(transport, users, mix, args)
+        routes |= mix_routes
+    if hasattr(transport, "shutdown"):
+        await transport.shutdown()
+    return results, routes
+
+def app_routes(app):
+    from fastapi.routing import APIRoute
+    return {
+        f"{method} {route.path}"
+        for route in app.routes if isinstance(route, APIRoute)
+        for method in route.methods
+    }
+
+# ================= BASELINE =================
+
+def compare(report, baseline, tolerance):
+    """Where this run is worse than the baseline: each endpoint's median latency and error
+    rate, and each mix's throughput and p95. Endpoint tails are too noisy to compare."""
+    regressions = []
+
+    def check(transport, mix, endpoint, metric, was, now, worse):
+        if worse:
+            regressions.append({"transport": transport, "mix": mix, "endpoint": endpoint, "metric": metric,
+                                "baseline": was, "current": now})
+
+    def slower(was, now):
+        return now > was * (1 + tolerance) and now - was > NOISE_FLOOR_MS
+
+    for transport, mixes in report["results"].items():
+        for mix, result in mixes.items():
+            base_mix = baseline.get("results", {}).get(transport, {}).get(mix)
+            if not base_mix:
+                continue
+            was, now = base_mix["total"]["throughput_rps"], result["total"]["throughput_rps"]
+            check(transport, mix, "total", "throughput_rps", was, now, now < was * (1 - tolerance))
+            was, now = base_mix["total"]["p95_ms"], result["total"]["p95_ms"]
+            check(transport, mix, "total", "p95_ms", was, now, slower(was, now))
+            for endpoint, stats in result["endpoints"].items():
+                base = base_mix["endpoints"].get(endpoint)
+                if not base or min(base["requests"], stats["requests"]) < MIN_SAMPLES:
+                    continue
+                was, now = base["p50_ms"], stats["p50_ms"]
+                check(transport, mix, endpoint, "p50_ms", was, now, slower(was, now))
+                was, now = base["error_rate"], stats["error_rate"]
+                check(transport, mix, endpoint, "error_rate", was, now, now > was + 0.01)
+    return regressions
+
+# ================= MAIN =================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5, help="seeded users")
+    parser.add_argument("--todos", type=int, default=1000, help="todos per user")
+    parser.add_argument("--calendars", type=int, default=4, help="calendars per user")
+    parser.add_argument("--templates", type=int, default=20, help="templates per user")
+    parser.add_argument("--transports", default="asgi,uvicorn", help="comma-separated: asgi, uvicorn")
+    parser.add_argument("--mixes", default=",".join(MIXES), help="comma-separated: " + ", ".join(MIXES))
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="measured seconds per mix and transport")
+    parser.add_argument("--warmup", type=float, default=1, help="unmeasured seconds before each mix")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the data and the request sequence")
+    parser.add_argument("--database-url", help="database to seed instead of a throwaway SQLite file; it must be empty")
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline report to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slowdown before flagging")
+    args = parser.parse_args()
+    args.transports = args.transports.split(",")
+    args.mixes = args.mixes.split(",")
+    for mix in args.mixes:
+        if mix not in MIXES:
+            parser.error(f"unknown mix {mix!r}")
+
+    workdir = tempfile.mkdtemp(prefix="good-vibes-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # Few users make many requests here, so the per-user rate limits are off unless set
+    os.environ.setdefault("RATE_LIMIT_READS_PER_SECOND", "0")
+    os.environ.setdefault("RATE_LIMIT_WRITES_PER_SECOND", "0")
+    sys.path.insert(0, BACKEND_DIR)
+
+    users = seed(args)
+    from main import app
+
+    results = {}
+    exercised = set()
+    for name in args.transports:
+        if name == "asgi":
+            transport = ASGITransport(app)
+            server = None
+        elif name == "uvicorn":
+            port = free_port()
+            server = start_uvicorn(port)
+            transport = HTTPTransport(port, args.concurrency)
+        else:
+            parser.error(f"unknown transport {name!r}")
+        try:
+            results[name], routes = asyncio.run(run_transport(transport, users, args))
+            exercised |= routes
+        finally:
+            transport.close()
+            if server:
+                server.terminate()
+                server.wait()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "save_baseline")}
+    report = {
+        "config": config,
+        "results": results,
+        "unexercised_routes": sorted(app_routes(app) - exercised),
+    }
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+            baseline_file.write("\n")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("config") != config:
+            print("Warning: the baseline was recorded with different settings", file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance)
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+    if regressions:
+        raise SystemExit(f"{len(regressions)} regression(s) against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Measure GET /api/todos latency on its own and during a burst of logins.
+
+Runs against a throwaway SQLite database and an in-process uvicorn server, so it
+needs no network access. From the backend/ directory:
+
+    python benchmarks/login_storm.py --readers 8 --logins 32 --duration 10
+
+Pass --inline-hashing to run bcrypt on the event loop as the login endpoint used to,
+for a before/after comparison.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def summarize(latencies):
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+def call(base_url, method, path, body=None, token=None):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(base_url + path, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(app, port):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+def run_phase(base_url, token, readers, logins, duration, password):
+    stop = threading.Event()
+    latencies = []
+    login_statuses = []
+
+    def read_loop():
+        while not stop.is_set():
+            started = time.perf_counter()
+            call(base_url, "GET", "/api/todos", token=token)
+            latencies.append(time.perf_counter() - started)
+
+    def login_loop():
+        while not stop.is_set():
+            status, _ = call(base_url, "POST", "/api/token", {"username": "bench", "password": password})
+            login_statuses.append(status)
+
+    threads = [threading.Thread(target=read_loop) for _ in range(readers)]
+    threads += [threading.Thread(target=login_loop) for _ in range(logins)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    result = {"todos": summarize(latencies)}
+    if logins:
+        result["logins"] = {
+            "completed": login_statuses.count(200),
+            "shed_503": login_statuses.count(503),
+        }
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=8, help="concurrent GET /api/todos clients")
+    parser.add_argument("--logins", type=int, default=32, help="concurrent login clients during the storm")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per phase")
+    parser.add_argument("--todos", type=int, default=200, help="todos seeded for the reading user")
+    parser.add_argument("--inline-hashing", action="store_true", help="hash on the event loop (old behaviour)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="good-vibes-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # Few users make many requests here, so the per-user rate limits are off unless set
+    os.environ.setdefault("RATE_LIMIT_READS_PER_SECOND", "0")
+    os.environ.setdefault("RATE_LIMIT_WRITES_PER_SECOND", "0")
+    sys.path.insert(0, BACKEND_DIR)
+
+    import main as app_module
+    from auth import UserCreate, create_user
+    from database import SessionLocal, init_db
+    from ids import generate_id
+    from models import Todo as TodoModel
+
+    init_db()
+    password = "bench-password"
+    create_user(UserCreate(username="bench", password=password))
+    db = SessionLocal()
+    try:
+        for i in range(args.todos):
+            db.add(TodoModel(id=generate_id(), user_id="bench", title=f"Todo {i}"))
+        db.commit()
+    finally:
+        db.close()
+
+    if args.inline_hashing:
+        async def run_inline(func, *func_args):
+            return func(*func_args)
+        app_module.run_password_task = run_inline
+
+    port = free_port()
+    server = start_server(app_module.app, port)
+    base_url = f"http://127.0.0.1:{port}"
+    _, body = call(base_url, "POST", "/api/token", {"username": "bench", "password": password})
+    token = json.loads(body)["access_token"]
+
+    report = {
+        "config": vars(args),
+        "baseline": run_phase(base_url, token, args.readers, 0, args.duration, password),
+        "login_storm": run_phase(base_url, token, args.readers, args.logins, args.duration, password),
+    }
+    server.should_exit = True
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Compare the two ways of answering GET /api/todos with N todos:
+
+  orm:  load ORM objects, validate them through response_model=List[Todo] and
+        jsonable_encoder, then render a JSONResponse (how list endpoints used to work)
+  rows: select column tuples and encode them with serialization.RowSerializer
+
+Both run against a throwaway SQLite database and must produce identical bytes.
+Then the same rows are encoded in each wire format the list endpoints negotiate
+(JSON or MessagePack, as rows or ?format=columnar, plain, gzip or brotli when
+installed), reporting body size and the server's encode and a client's decode time.
+From the backend/ directory:
+
+    python benchmarks/serialization.py --sizes 1000,10000,100000 --repeat 3
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def seed(engine, todo_table, count):
+    started = datetime(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        recurring = i % 10 == 0
+        completed = i % 3 == 0
+        rows.append({
+            "id": str(i).zfill(19),
+            "user_id": "bench",
+            "title": f"Todo {i} – ünïcode ✓" if i % 7 == 0 else f"Todo {i}",
+            "description": "Line one\nline \"two\"" if i % 5 == 0 else None,
+            "start_date": date(2024, 1, 1) + timedelta(days=i % 365) if i % 2 else None,
+            "end_date": date(2024, 1, 2) + timedelta(days=i % 365) if i % 4 == 1 else None,
+            "estimated_time": 30 if i % 2 else None,
+            "priority": ("low", "medium", "high")[i % 3],
+            "calendar_id": "cal-1",
+            "is_completed": completed,
+            "created_at": started + timedelta(seconds=i, microseconds=i % 1000),
+            "completed_at": started + timedelta(days=1, seconds=i) if completed else None,
+            "is_recurring": recurring,
+            "recurring_pattern": "weekly" if recurring else None,
+            "recurring_count": 10 if recurring else None,
+            "recurring_until": None,
+            "recurring_exceptions": "2024-01-08,2024-01-15" if recurring else None,
+            "version": i + 1,
+        })
+    with engine.begin() as conn:
+        conn.execute(todo_table.delete())
+        conn.execute(todo_table.insert(), rows)
+
+def orm_path(db, query_factory, response_field, serialize_response, json_response_class):
+    todos = query_factory(db).all()
+    content = asyncio.run(serialize_response(field=response_field, response_content=todos))
+    return json_response_class(content).body
+
+def rows_path(db, query_factory, serializer, json_response):
+    return json_response(serializer.to_list(serializer.query(query_factory(db)))).body
+
+def wire_formats(serializer, rows, repeat):
+    import serialization
+    codings = {"identity": (lambda body: body, lambda body: body)}
+    codings["gzip"] = (lambda body: gzip.compress(body, serialization.GZIP_LEVEL), gzip.decompress)
+    if serialization.brotli is not None:
+        brotli = serialization.brotli
+        codings["br"] = (lambda body: brotli.compress(body, quality=serialization.BROTLI_QUALITY), brotli.decompress)
+    media = {"json": (serialization.dumps, json.loads)}
+    if serialization.msgpack is not None:
+        media["msgpack"] = (serialization.msgpack.packb, serialization.msgpack.unpackb)
+    shapes = {"rows": serializer.to_list, "columnar": serializer.to_columns}
+
+    results = {}
+    for media_name, (encode, decode) in media.items():
+        for shape, to_content in shapes.items():
+            for coding, (compress, decompress) in codings.items():
+                body, encode_seconds = timed(lambda: compress(encode(to_content(rows))), repeat)
+                _, decode_seconds = timed(lambda: decode(decompress(body)), repeat)
+                results[f"{media_name}/{shape}/{coding}"] = {
+                    "bytes": len(body),
+                    "encode_ms": round(encode_seconds * 1000, 1),
+                    "decode_ms": round(decode_seconds * 1000, 1),
+                }
+    return results
+
+def timed(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return result, statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated todo counts")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path and size; the median is reported")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="good-vibes-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sys.path.insert(0, BACKEND_DIR)
+
+    from typing import List
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    from database import SessionLocal, engine, init_db
+    from main import TODO_ROWS
+    from models import Todo as TodoModel
+    from schemas import Todo
+    from serialization import json_response
+
+    init_db()
+    response_field = create_response_field(name="Response_get_todos", type_=List[Todo])
+
+    def query_factory(db):
+        return db.query(TodoModel).filter(TodoModel.user_id == "bench").order_by(TodoModel.created_at, TodoModel.id)
+
+    report = []
+    for size in (int(value) for value in args.sizes.split(",")):
+        seed(engine, TodoModel.__table__, size)
+        db = SessionLocal()
+        try:
+            # Each path starts from an empty identity map, as a request would
+            def run_orm():
+                db.expunge_all()
+                return orm_path(db, query_factory, response_field, serialize_response, JSONResponse)
+
+            def run_rows():
+                db.expunge_all()
+                return rows_path(db, query_factory, TODO_ROWS, json_response)
+
+            orm_body, orm_seconds = timed(run_orm, args.repeat)
+            rows_body, rows_seconds = timed(run_rows, args.repeat)
+            formats = wire_formats(TODO_ROWS, TODO_ROWS.query(query_factory(db)).all(), args.repeat)
+        finally:
+            db.close()
+        if orm_body != rows_body:
+            raise SystemExit(f"Bodies differ at {size} rows")
+        report.append({
+            "rows": size,
+            "bytes": len(rows_body),
+            "orm_ms": round(orm_seconds * 1000, 1),
+            "rows_ms": round(rows_seconds * 1000, 1),
+            "speedup": round(orm_seconds / rows_seconds, 1),
+            "formats": formats,
+        })
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Measure write throughput with user data in one SQLite file against sharded files.
+
+--writers processes (as several workers would be) each commit small changes for their
+own user for --duration seconds: insert a todo, then update it, one commit each, through
+the same session and sync-version bookkeeping as the API. With SHARDING=off they all
+queue for the one file's write lock; with "hash" and "user" they only queue behind
+writers whose user shares their file. Each mode uses a fresh throwaway directory.
+From the backend/ directory:
+
+    python benchmarks/sharding.py --writers 8 --duration 5 --profile durable
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("off", "hash", "user")
+
+def probe(username, duration):
+    """Runs in the child process: commit changes as the user until the time is up"""
+    sys.path.insert(0, BACKEND_DIR)
+    with contextlib.redirect_stdout(sys.stderr):
+        from database import init_db, user_session
+        from ids import generate_id
+        from models import Todo as TodoModel
+        import writes
+        init_db()
+    latencies = []
+    session = user_session(username)
+    try:
+        # Open (and if new, create) the user's shard before the clock starts
+        session.query(TodoModel.id).first()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            todo = TodoModel(id=generate_id(), user_id=username, title="Benchmark", priority="medium")
+            session.add(todo)
+            session.commit()
+            latencies.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            writes.update_todo(session, username, todo.id, {"is_completed": True}, [TodoModel.__table__.c.version])
+            session.commit()
+            latencies.append(time.perf_counter() - started)
+    finally:
+        session.close()
+    print(json.dumps({"commits": len(latencies), "latencies_ms": [round(l * 1000, 2) for l in latencies]}))
+
+def run_mode(mode, args):
+    workdir = tempfile.mkdtemp(prefix=f"good-vibes-bench-{mode}-")
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        SHARDING=mode,
+        SHARD_COUNT=str(args.shards),
+        SHARD_DIRECTORY=os.path.join(workdir, "shards"),
+        STORAGE_PROFILE=args.profile,
+    )
+    # Create the main database first, so the writers don't all wait on its migration
+    subprocess.run([sys.executable, "-c", "from database import init_db; init_db()"],
+                   cwd=BACKEND_DIR, env=env, check=True, capture_output=True)
+    processes = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--probe", f"writer{i}", "--duration", str(args.duration)],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        for i in range(args.writers)
+    ]
+    commits, latencies = 0, []
+    for process in processes:
+        out, err = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"Writer failed:\n{err}")
+        report = json.loads(out.strip().splitlines()[-1])
+        commits += report["commits"]
+        latencies += report["latencies_ms"]
+    latencies.sort()
+    shard_files = [name for name in os.listdir(env["SHARD_DIRECTORY"]) if name.endswith(".db")] if mode != "off" else []
+    return {
+        "files": len(shard_files) or 1,
+        "commits_per_second": round(commits / args.duration, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p99_ms": latencies[int(len(latencies) * 0.99)],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=8, help="writer processes, one user each")
+    parser.add_argument("--duration", type=float, default=5, help="seconds each writer commits for")
+    parser.add_argument("--shards", type=int, default=16, help="SHARD_COUNT for the hash mode")
+    parser.add_argument("--profile", default="balanced", help="STORAGE_PROFILE; durable fsyncs every commit")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated SHARDING modes to run")
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        probe(args.probe, args.duration)
+        return
+
+    results = {mode: run_mode(mode, args) for mode in args.modes.split(",")}
+    print(json.dumps({
+        "config": {"writers": args.writers, "duration": args.duration, "shards": args.shards, "profile": args.profile},
+        "results": results,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
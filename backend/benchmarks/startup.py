@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Measure how long a worker takes from a fresh interpreter to ready to serve.
+
+Each start is a new Python process against a throwaway SQLite database, timed in
+phases: importing the app, then its startup work (schema check or migrations, the
+default admin, resuming jobs). Scenarios:
+
+  first_boot:  an empty database, so the tables are created and the admin hashed
+  restart:     a current database, as after a deploy or a serverless cold start;
+               "legacy" reruns every migration on each start, as startup used to
+  concurrent:  --workers processes starting together on an empty database; exactly
+               one should migrate and one admin should exist afterwards
+
+From the backend/ directory:
+
+    python benchmarks/startup.py --repeat 5 --workers 4
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def probe(mode):
+    """Runs in the child process: start the app the given way and report the phases"""
+    started = time.perf_counter()
+    sys.path.insert(0, BACKEND_DIR)
+    # Startup messages go to stderr, so stdout carries only the report
+    with contextlib.redirect_stdout(sys.stderr):
+        if mode == "legacy":
+            import jose.jwt, passlib.context  # noqa: F401  Imported with auth before
+        import main
+        imported = time.perf_counter()
+        if mode == "legacy":
+            from database import log_storage_settings, migrate_schema
+            migrate_schema()
+            log_storage_settings()
+            main.ensure_admin_user()
+            main.jobs.resume_jobs()
+            migrated = True
+        else:
+            migrated = main.init_db()
+            main.ensure_admin_user()
+            main.jobs.resume_jobs()
+        ready = time.perf_counter()
+    print(json.dumps({
+        "import_ms": round((imported - started) * 1000, 1),
+        "startup_ms": round((ready - imported) * 1000, 1),
+        "migrated": migrated,
+    }))
+
+def spawn(database_url, mode):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--probe", mode],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    ), time.perf_counter()
+
+def finish(process, started):
+    out, err = process.communicate()
+    wall = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"Worker failed:\n{err}")
+    report = json.loads(out.strip().splitlines()[-1])
+    report["process_ms"] = round(wall * 1000, 1)  # Including interpreter startup
+    return report
+
+def start_once(database_url, mode):
+    return finish(*spawn(database_url, mode))
+
+def summarize(reports):
+    summary = {"starts": len(reports)}
+    for phase in ("import_ms", "startup_ms", "process_ms"):
+        summary[phase + "_median"] = round(statistics.median(report[phase] for report in reports), 1)
+    return summary
+
+def count_users(database_url):
+    from sqlalchemy import create_engine, text
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT COUNT(*) FROM users")).scalar()
+    finally:
+        engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="restarts timed per mode")
+    parser.add_argument("--workers", type=int, default=4, help="processes in the concurrent scenario")
+    parser.add_argument("--probe", choices=("current", "legacy"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        probe(args.probe)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="good-vibes-bench-")
+    database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    first_boot = start_once(database_url, "current")
+    restart = {}
+    # Alternate the modes so drift in the machine's load hits both alike
+    runs = {"current": [], "legacy": []}
+    for _ in range(args.repeat):
+        for mode in runs:
+            runs[mode].append(start_once(database_url, mode))
+    for mode, reports in runs.items():
+        restart[mode] = summarize(reports)
+
+    concurrent_url = f"sqlite:///{os.path.join(workdir, 'concurrent.db')}"
+    started = time.perf_counter()
+    processes = [spawn(concurrent_url, "current") for _ in range(args.workers)]
+    workers = [finish(*process) for process in processes]
+    concurrent = {
+        "workers": args.workers,
+        "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+        "migrated": sum(worker["migrated"] for worker in workers),
+        "users": count_users(concurrent_url),
+        # Imports compete for the CPU; the workers that lose the lock wait out the migration
+        "import_ms": [worker["import_ms"] for worker in workers],
+        "startup_ms": [worker["startup_ms"] for worker in workers],
+    }
+
+    print(json.dumps({
+        "config": {"repeat": args.repeat, "workers": args.workers},
+        "first_boot": first_boot,
+        "restart": restart,
+        "concurrent": concurrent,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import asyncio
+import atexit
+import contextvars
+import json
+import logging
+import os
+import socket
+import threading
+from collections import defaultdict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from config import settings
+
+# Per-user change feed behind /api/stream.
+#
+# The sync hooks record a change (entity, id, operation, version) on the session for
+# every synced row they stamp or tombstone; once the session commits, its changes are
+# published to the user's subscribers as one message, and dropped on rollback. The
+# broker fans messages out to the subscribers of this process and, with the "unix"
+# backend, to the other workers on this host. Subscribers that fall behind are told to
+# resync through /api/sync rather than buffering without bound.
+
+logger = logging.getLogger(__name__)
+
+# Beyond this many changes in one commit (e.g. an import), send a resync instead
+MAX_CHANGES_PER_MESSAGE = 100
+SUBSCRIBER_QUEUE_SIZE = 100
+RECONNECT_MS = 1000  # SSE retry hint for clients whose stream ended
+
+# Versions committed while serving the current request, when it is tracked by SyncVersionMiddleware
+_request_versions = contextvars.ContextVar("request_versions", default=None)
+
+def record(session: Session, username: str, entity: str, entity_id: str, op: str, version: int):
+    """Queue a change to publish when the session commits; op is "upsert" or "delete" """
+    session.info.setdefault("changes", []).append((username, entity, entity_id, op, version))
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    changes = session.info.pop("changes", None)
+    if not changes:
+        return
+    by_user = defaultdict(list)
+    for username, entity, entity_id, op, version in changes:
+        by_user[username].append({"entity": entity, "id": entity_id, "op": op, "version": version})
+    committed = _request_versions.get()
+    for username, user_changes in by_user.items():
+        version = max(change["version"] for change in user_changes)
+        if committed is not None:
+            committed.update(change["version"] for change in user_changes)
+        if len(user_changes) > MAX_CHANGES_PER_MESSAGE:
+            message = {"version": version, "resync": True}
+        else:
+            message = {"version": version, "changes": user_changes}
+        try:
+            get_broker().publish(username, message)
+        except Exception:
+            # The writes are committed either way; subscribers catch up at their next resync
+            logger.exception("Publishing changes for %s failed", username)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop("changes", None)
+
+class SyncVersionMiddleware:
+    """Sends the sync versions a request committed as X-Sync-Version, comma-separated.
+
+    A client has already applied the result of its own writes, so it can skip their
+    change events instead of syncing on each echo. Commits made after the response starts
+    (streams, background jobs) aren't listed, and are synced as usual.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+
+        # Shared with the threadpool, which runs the endpoint in a copy of this context
+        committed = set()
+        async def send_with_versions(message):
+            if message["type"] == "http.response.start" and committed:
+                versions = ",".join(str(version) for version in sorted(committed))
+                message["headers"] = list(message.get("headers", [])) + [(b"x-sync-version", versions.encode())]
+            await send(message)
+
+        token = _request_versions.set(committed)
+        try:
+            await self.app(scope, receive, send_with_versions)
+        finally:
+            _request_versions.reset(token)
+
+# ================= SUBSCRIPTIONS =================
+
+class Subscription:
+    """One stream's queue of messages, fed from any thread, read on its event loop"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.latest_version = 0
+
+    def deliver(self, message):
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        self.latest_version = max(self.latest_version, message["version"])
+        if self.queue.full():
+            # Replace the backlog with one resync at the newest version
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = {"version": self.latest_version, "resync": True}
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+class LocalBroker:
+    """Fans messages out to the subscribers in this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, username: str) -> Subscription:
+        subscription = Subscription(asyncio.get_running_loop())
+        with self.lock:
+            self.subscribers[username].add(subscription)
+        return subscription
+
+    def unsubscribe(self, username: str, subscription: Subscription):
+        with self.lock:
+            self.subscribers[username].discard(subscription)
+            if not self.subscribers[username]:
+                del self.subscribers[username]
+
+    def deliver(self, username: str, message: dict):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(username, ()))
+        for subscription in subscriptions:
+            subscription.deliver(message)
+
+    def publish(self, username: str, message: dict):
+        self.deliver(username, message)
+
+class UnixSocketBroker(LocalBroker):
+    """Also fans messages out to the other workers on this host.
+
+    A stand-in for a networked pub/sub server: each process binds a datagram socket in
+    a shared directory and sends every message to all the sockets there. Sockets left
+    behind by dead workers refuse delivery and are removed.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.path)
+        atexit.register(self.close)
+        threading.Thread(target=self.receive_loop, name="changefeed", daemon=True).start()
+
+    def receive_loop(self):
+        while True:
+            try:
+                data = self.socket.recv(1 << 20)
+            except OSError:
+                return  # Closed
+            envelope = json.loads(data)
+            self.deliver(envelope["user"], envelope["message"])
+
+    def publish(self, username: str, message: dict):
+        self.deliver(username, message)
+        data = json.dumps({"user": username, "message": message}).encode()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if path == self.path or not name.endswith(".sock"):
+                continue
+            try:
+                self.socket.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError:
+                logger.warning("Could not send changes to %s", path, exc_info=True)
+
+    def close(self):
+        self.socket.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+BROKERS = {
+    "local": LocalBroker,
+    "unix": lambda: UnixSocketBroker(settings.CHANGE_FEED_SOCKET_DIR),
+}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+    """The process's broker, created on first use so tools that never stream don't bind sockets"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                if settings.CHANGE_FEED_BACKEND not in BROKERS:
+                    raise ValueError(
+                        f"Unknown CHANGE_FEED_BACKEND {settings.CHANGE_FEED_BACKEND!r}, "
+                        f"expected one of {', '.join(BROKERS)}"
+                    )
+                _broker = BROKERS[settings.CHANGE_FEED_BACKEND]()
+    return _broker
+
+# ================= SERVER-SENT EVENTS =================
+
+def sse_message(message: dict, event_name: str = None) -> str:
+    event_name = event_name or ("resync" if message.get("resync") else "change")
+    return f"id: {message['version']}\nevent: {event_name}\ndata: {json.dumps(message, separators=(',', ':'))}\n\n"
+
+async def event_stream(username: str, subscription: Subscription, current_version: int, since: int = None):
+    """The SSE body: a resync if the client missed changes, then each message as it arrives.
+
+    Streams end after CHANGE_FEED_MAX_SECONDS: uvicorn waits for open responses before
+    shutting down, and EventSource reconnects by itself, sending the last version it
+    saw as Last-Event-ID.
+    """
+    broker = get_broker()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.CHANGE_FEED_MAX_SECONDS
+    try:
+        # Sent first, so the client knows the feed is live and which version it reflects
+        yield f"retry: {RECONNECT_MS}\n"
+        if since is not None and since < current_version:
+            yield sse_message({"version": current_version, "resync": True})
+        else:
+            yield sse_message({"version": current_version}, "ready")
+        while True:
+            timeout = min(settings.CHANGE_FEED_KEEPALIVE_SECONDS, deadline - loop.time())
+            if timeout <= 0:
+                return
+            try:
+                message = await asyncio.wait_for(subscription.get(), timeout)
+            except asyncio.TimeoutError:
+                # Comment lines keep proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                continue
+            if message["version"] <= current_version and not message.get("resync"):
+                continue  # Already covered by the version the stream started at
+            yield sse_message(message)
+    finally:
+        broker.unsubscribe(username, subscription)
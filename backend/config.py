@@ -1,15 +1,103 @@
 import os
+import tempfile
 from typing import List
 
+# Storage tuning presets, selected with STORAGE_PROFILE. Any single value can still be
+# overridden by setting its environment variable.
+STORAGE_PROFILES = {
+    # WAL lets readers run alongside a writer; NORMAL sync is durable across crashes of the app
+    "balanced": {
+        "SQLITE_JOURNAL_MODE": "WAL",
+        "SQLITE_SYNCHRONOUS": "NORMAL",
+        "SQLITE_BUSY_TIMEOUT_MS": 5000,
+        "SQLITE_CACHE_SIZE_KB": 65536,
+        "SQLITE_MMAP_SIZE_MB": 256,
+        "DB_POOL_SIZE": 5,
+        "DB_MAX_OVERFLOW": 10,
+        "DB_POOL_PRE_PING": True,
+        "DB_POOL_RECYCLE_SECONDS": 1800,
+    },
+    # Also survives power loss, at the cost of an fsync per commit
+    "durable": {
+        "SQLITE_JOURNAL_MODE": "WAL",
+        "SQLITE_SYNCHRONOUS": "FULL",
+        "SQLITE_BUSY_TIMEOUT_MS": 10000,
+        "SQLITE_CACHE_SIZE_KB": 16384,
+        "SQLITE_MMAP_SIZE_MB": 0,
+        "DB_POOL_SIZE": 5,
+        "DB_MAX_OVERFLOW": 10,
+        "DB_POOL_PRE_PING": True,
+        "DB_POOL_RECYCLE_SECONDS": 1800,
+    },
+    # SQLite's own defaults, as before profiles existed
+    "default": {
+        "SQLITE_JOURNAL_MODE": "",
+        "SQLITE_SYNCHRONOUS": "",
+        "SQLITE_BUSY_TIMEOUT_MS": 0,
+        "SQLITE_CACHE_SIZE_KB": 0,
+        "SQLITE_MMAP_SIZE_MB": 0,
+        "DB_POOL_SIZE": 5,
+        "DB_MAX_OVERFLOW": 10,
+        "DB_POOL_PRE_PING": False,
+        "DB_POOL_RECYCLE_SECONDS": -1,
+    },
+}
+
+def storage_setting(name: str):
+    """A storage value from its environment variable, else from the selected profile"""
+    profile = os.getenv("STORAGE_PROFILE", "balanced")
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown STORAGE_PROFILE {profile!r}, expected one of {', '.join(STORAGE_PROFILES)}")
+    default = STORAGE_PROFILES[profile][name]
+    value = os.getenv(name)
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() == "true"
+    return type(default)(value)
+
 class Settings:
     # Database Configuration
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./good_vibes.db")
     
+    # Storage tuning; 0 or "" leaves a value at the SQLite default
+    STORAGE_PROFILE: str = os.getenv("STORAGE_PROFILE", "balanced")
+    SQLITE_JOURNAL_MODE: str = storage_setting("SQLITE_JOURNAL_MODE")
+    SQLITE_SYNCHRONOUS: str = storage_setting("SQLITE_SYNCHRONOUS")
+    SQLITE_BUSY_TIMEOUT_MS: int = storage_setting("SQLITE_BUSY_TIMEOUT_MS")
+    SQLITE_CACHE_SIZE_KB: int = storage_setting("SQLITE_CACHE_SIZE_KB")
+    SQLITE_MMAP_SIZE_MB: int = storage_setting("SQLITE_MMAP_SIZE_MB")
+    # Connection pool; SQLite files are pooled too, so each connection keeps its page cache
+    DB_POOL_SIZE: int = storage_setting("DB_POOL_SIZE")
+    DB_MAX_OVERFLOW: int = storage_setting("DB_MAX_OVERFLOW")
+    DB_POOL_PRE_PING: bool = storage_setting("DB_POOL_PRE_PING")
+    DB_POOL_RECYCLE_SECONDS: int = storage_setting("DB_POOL_RECYCLE_SECONDS")
+    
     # Authentication Configuration
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production-make-it-long-and-random")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
     
+    # Verified principals are cached so authenticated requests skip the users lookup (0 disables)
+    AUTH_CACHE_TTL_SECONDS: int = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+    AUTH_CACHE_SIZE: int = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+    # Trust any validly signed, unexpired token without checking that the user still exists
+    AUTH_STATELESS: bool = os.getenv("AUTH_STATELESS", "false").lower() == "true"
+    
+    # bcrypt runs in its own bounded pool; logins beyond the pending limit get a 503
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_MAX_PENDING: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+    
+    # Per-user token buckets for authenticated reads (GET) and writes: a sustained rate per
+    # second plus a burst, beyond which requests get a 429 (a rate of 0 disables the limit)
+    RATE_LIMIT_READS_PER_SECOND: float = float(os.getenv("RATE_LIMIT_READS_PER_SECOND", "20"))
+    RATE_LIMIT_READ_BURST: int = int(os.getenv("RATE_LIMIT_READ_BURST", "100"))
+    RATE_LIMIT_WRITES_PER_SECOND: float = float(os.getenv("RATE_LIMIT_WRITES_PER_SECOND", "5"))
+    RATE_LIMIT_WRITE_BURST: int = int(os.getenv("RATE_LIMIT_WRITE_BURST", "50"))
+    RATE_LIMIT_MAX_USERS: int = int(os.getenv("RATE_LIMIT_MAX_USERS", "10000"))
+    # Authenticated writes running at once, across users; more get a 503 (0 disables)
+    MAX_CONCURRENT_WRITES: int = int(os.getenv("MAX_CONCURRENT_WRITES", "16"))
+    
     # Default User Configuration (change these!)
     DEFAULT_USERNAME: str = os.getenv("DEFAULT_USERNAME", "admin")
     DEFAULT_PASSWORD: str = os.getenv("DEFAULT_PASSWORD", "admin123")
@@ -21,6 +109,47 @@ class Settings:
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", "8000"))
     
+    # Threads that run background jobs (calendar deletes, migrations, new-user setup)
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    
+    # Tombstones of deleted rows are kept this long for delta syncs (0 keeps them forever);
+    # clients last synced before the oldest one kept get a full resync instead
+    TOMBSTONE_RETENTION_DAYS: int = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+    
+    # Request and SQL metrics at /metrics; when set, scrapers must send "Authorization: Bearer <token>"
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
+    # SQL statements at least this slow are logged with their timing (0 disables)
+    SLOW_QUERY_MS: int = int(os.getenv("SLOW_QUERY_MS", "200"))
+    
+    # Change feed at /api/stream: "local" reaches the streams of this process only, "unix" also
+    # those of the other workers on this host, through datagram sockets in CHANGE_FEED_SOCKET_DIR
+    CHANGE_FEED_BACKEND: str = os.getenv("CHANGE_FEED_BACKEND", "local")
+    CHANGE_FEED_SOCKET_DIR: str = os.getenv(
+        "CHANGE_FEED_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "good-vibes-changefeed")
+    )
+    # Idle streams get a comment line this often, so proxies keep them open
+    CHANGE_FEED_KEEPALIVE_SECONDS: int = int(os.getenv("CHANGE_FEED_KEEPALIVE_SECONDS", "15"))
+    # Streams are closed after this long for the client to reconnect, so they can't hold up a shutdown
+    CHANGE_FEED_MAX_SECONDS: int = int(os.getenv("CHANGE_FEED_MAX_SECONDS", "60"))
+    # Lifetime of the stream-only tickets EventSource passes in the URL in place of the token
+    STREAM_TICKET_SECONDS: int = int(os.getenv("STREAM_TICKET_SECONDS", "300"))
+    
+    # Optional sharding of user data across SQLite files: "off", "user" (a file per user) or
+    # "hash" (SHARD_COUNT files, by a hash of the username). Accounts stay in DATABASE_URL.
+    # Run reshard.py with the server stopped after changing either setting.
+    SHARDING: str = os.getenv("SHARDING", "off")
+    SHARD_COUNT: int = int(os.getenv("SHARD_COUNT", "16"))
+    SHARD_DIRECTORY: str = os.getenv("SHARD_DIRECTORY", "./shards")
+    # Shard engines kept open per process, least recently used closed first
+    SHARD_ENGINE_CACHE_SIZE: int = int(os.getenv("SHARD_ENGINE_CACHE_SIZE", "64"))
+    
+    # Worker ID (0-1023) embedded in generated primary keys; set a distinct value per process
+    WORKER_ID: str = os.getenv("WORKER_ID", "")
+    # Without WORKER_ID, each process leases a free ID by locking a file here. Every process
+    # writing the same database must see the same directory; empty means beside the SQLite
+    # file, or in the temp directory for other databases.
+    WORKER_ID_DIRECTORY: str = os.getenv("WORKER_ID_DIRECTORY", "")
+    
     # Production Environment Detection
     ENVIRONMENT: str = os.getenv("ENVIRONMENT", "development")
 
@@ -1,64 +1,469 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Base, Calendar as CalendarModel, User as UserModel
+import contextvars
+import functools
+import hashlib
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, inspect, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.orm import Session, sessionmaker
+from models import (
+    AccountSetup as AccountSetupModel, Base, Calendar as CalendarModel, DailyRollup as DailyRollupModel, SchemaVersion as SchemaVersionModel,
+    Todo as TodoModel, User as UserModel
+)
 from config import settings
-import time
+from ids import generate_id
+import sync  # noqa: F401  Registers the flush hook that stamps sync versions
+import search
+import metrics
+import analytics  # Registers the flush hook that keeps the activity rollups current
+import shards
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 # Database URL from configuration
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
+database_url = make_url(SQLALCHEMY_DATABASE_URL)
+
+# An async driver in DATABASE_URL (sqlite+aiosqlite://, postgresql+asyncpg://) serves
+# requests through an async engine. The sync engine on the same database's default
+# driver still handles startup, password work and streamed responses.
+ASYNC_DATABASE = database_url.get_dialect().is_async
+if ASYNC_DATABASE:
+    database_url = database_url.set(drivername=database_url.get_backend_name())
+
+IS_SQLITE = database_url.get_backend_name() == "sqlite"
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}  # Required for SQLite
+
+def engine_options(pool_class) -> dict:
+    """Pool settings from the storage profile"""
+    options = {
+        "connect_args": connect_args,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+    }
+    # An in-memory SQLite database lives in its one connection, so keep the dialect's pool for it
+    if IS_SQLITE and database_url.database in (None, "", ":memory:"):
+        return options
+    if IS_SQLITE:
+        # SQLAlchemy opens a new connection per checkout for SQLite files by default, which
+        # throws away the page cache and re-runs the pragmas on every request
+        options["poolclass"] = pool_class
+    options["pool_size"] = settings.DB_POOL_SIZE
+    options["max_overflow"] = settings.DB_MAX_OVERFLOW
+    return options
+
+def sqlite_pragmas() -> list:
+    pragmas = []
+    # First, so switching the journal mode waits for other connections too
+    if settings.SQLITE_BUSY_TIMEOUT_MS:
+        pragmas.append(f"PRAGMA busy_timeout = {settings.SQLITE_BUSY_TIMEOUT_MS}")
+    if settings.SQLITE_JOURNAL_MODE:
+        pragmas.append(f"PRAGMA journal_mode = {settings.SQLITE_JOURNAL_MODE.upper()}")
+    if settings.SQLITE_SYNCHRONOUS:
+        pragmas.append(f"PRAGMA synchronous = {settings.SQLITE_SYNCHRONOUS.upper()}")
+    if settings.SQLITE_CACHE_SIZE_KB:
+        # Negative values are in KiB rather than pages
+        pragmas.append(f"PRAGMA cache_size = -{settings.SQLITE_CACHE_SIZE_KB}")
+    if settings.SQLITE_MMAP_SIZE_MB:
+        pragmas.append(f"PRAGMA mmap_size = {settings.SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+    return pragmas
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
 
 # Create engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # Required for SQLite
-)
+engine = create_engine(database_url, **engine_options(QueuePool))
+if IS_SQLITE:
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+metrics.instrument_engine(engine)
+
+# ================= SHARDING =================
+
+# With SHARDING set, each user's rows live in a SQLite file of their own ("user") or in one
+# of SHARD_COUNT files picked by a hash of the username ("hash"), so unrelated users don't
+# queue behind one file's write lock. The main database keeps the accounts. Sessions pick
+# their database per statement: the users table from the main one, everything else from
+# the shard of the session's user, which is the authenticated user of the request unless
+# the session was opened for another with user_session().
+
+if shards.SHARDING:
+    if settings.SHARDING not in shards.SHARD_MODES:
+        raise ValueError(f"Unknown SHARDING {settings.SHARDING!r}, expected one of {', '.join(shards.SHARD_MODES)}")
+    if not IS_SQLITE or ASYNC_DATABASE:
+        raise ValueError("SHARDING needs a SQLite DATABASE_URL with the default (sync) driver")
+
+# Tables kept in the main database when sharding
+MAIN_TABLES = {"users", "schema_version"}
+
+# Set by auth for the authenticated user; sessions opened during the request route by it
+request_user = contextvars.ContextVar("request_user", default=None)
+
+def route_to_user(username: str):
+    """Send this request's sessions to the user's shard"""
+    request_user.set(username)
+
+def create_shard_engine(name: str):
+    os.makedirs(settings.SHARD_DIRECTORY, exist_ok=True)
+    shard_engine = create_engine(f"sqlite:///{shards.shard_path(name)}", **engine_options(QueuePool))
+    event.listen(shard_engine, "connect", apply_sqlite_pragmas)
+    metrics.instrument_engine(shard_engine)
+    # A new file gets its tables here, an existing one is only checked against the models
+    ensure_schema(shard_engine)
+    return shard_engine
+
+shard_engines = shards.EngineCache(settings.SHARD_ENGINE_CACHE_SIZE, create_shard_engine)
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not shards.SHARDING or (mapper is not None and mapper.local_table.name in MAIN_TABLES):
+            return super().get_bind(mapper, clause, **kw)
+        username = self.info.get("username") or request_user.get()
+        if username is None:
+            raise RuntimeError("User data accessed by a session with no user to route it to a shard")
+        return shard_engines.get(shards.shard_name(username))
 
 # Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=RoutingSession)
+
+def user_session(username: str) -> Session:
+    """A session for the user's data outside their requests (jobs, account setup)"""
+    return SessionLocal(info={"username": username})
+
+def user_data_engines():
+    """(name, engine) of every database holding user data: each shard file, or the main database"""
+    if not shards.SHARDING:
+        yield "main", engine
+        return
+    for name in shards.shard_names():
+        yield name, shard_engines.get(name)
+
+if ASYNC_DATABASE:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    async_engine = create_async_engine(SQLALCHEMY_DATABASE_URL, **engine_options(AsyncAdaptedQueuePool))
+    if IS_SQLITE:
+        event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    metrics.instrument_engine(async_engine.sync_engine)
+    # Responses are serialized after the handler returns, outside the session's greenlet,
+    # so committed rows must stay loaded rather than expire
+    AsyncSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False,
+        bind=async_engine, class_=AsyncSession
+    )
+else:
+    async_engine = None
+    AsyncSessionLocal = None
 
 # Create all tables
-def create_tables():
-    Base.metadata.create_all(bind=engine)
+def create_tables(bind=engine):
+    Base.metadata.create_all(bind=bind)
 
-# Dependency to get database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Dependency to get database session: an AsyncSession when the async engine is configured
+if ASYNC_DATABASE:
+    async def get_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+else:
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+async def run_in_session(func, *args):
+    """Await func(session, *args) in a session of its own, without blocking the event loop"""
+    if ASYNC_DATABASE:
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(func, *args)
+    
+    def call():
+        db = SessionLocal()
+        try:
+            return func(db, *args)
+        finally:
+            db.close()
+    return await run_in_threadpool(call)
+
+def session_endpoint(func):
+    """Let a sync handler taking `db` from get_db run on the async engine when one is configured.
 
-# Initialize default calendars for a new user
+    The handler body runs through AsyncSession.run_sync, so its ORM code executes on the
+    event loop and only the driver I/O is awaited, without holding a threadpool slot.
+    With a sync engine the handler is returned unchanged and runs in the threadpool.
+    """
+    if not ASYNC_DATABASE:
+        return func
+    
+    @functools.wraps(func)
+    async def endpoint(*args, **kwargs):
+        db = kwargs["db"]
+        return await db.run_sync(lambda session: func(*args, **dict(kwargs, db=session)))
+    return endpoint
+
+# Make the session's following reads see one consistent snapshot; call before any query
+def begin_snapshot(db):
+    if engine.dialect.name == "sqlite":
+        # pysqlite only opens a transaction before writes, so start one for the reads to share
+        db.connection().exec_driver_sql("BEGIN")
+    elif engine.dialect.name == "postgresql":
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+# Initialize default calendars for a new user, once. The account_setup marker is committed
+# with them, so a rerun (a resumed job, a second worker) adds nothing, and calendars the user
+# made before the setup job ran don't stop the defaults being added.
 def init_user_data(username: str):
-    db = SessionLocal()
+    db = user_session(username)
     try:
-        # Check if user already has calendars
-        existing_calendars = db.query(CalendarModel).filter(CalendarModel.user_id == username).count()
+        if db.get(AccountSetupModel, username):
+            return
+        db.add(AccountSetupModel(user_id=username))
+        
+        # Create default calendars
+        default_calendars = [
+            {"name": "Personal", "color": "#3B82F6", "is_default": True},
+            {"name": "Work", "color": "#10B981", "is_default": False},
+            {"name": "Health", "color": "#F59E0B", "is_default": False},
+        ]
         
-        if existing_calendars == 0:
-            # Create default calendars
-            default_calendars = [
-                {"name": "Personal", "color": "#3B82F6", "is_default": True},
-                {"name": "Work", "color": "#10B981", "is_default": False},
-                {"name": "Health", "color": "#F59E0B", "is_default": False},
-            ]
-            
-            for cal_data in default_calendars:
-                calendar = CalendarModel(
-                    id=str(int(time.time() * 1000)),
-                    user_id=username,
-                    name=cal_data["name"],
-                    color=cal_data["color"],
-                    is_default=cal_data["is_default"]
-                )
-                db.add(calendar)
-                # Small delay to ensure unique timestamps
-                time.sleep(0.001)
-            
+        for cal_data in default_calendars:
+            calendar = CalendarModel(
+                id=generate_id(),
+                user_id=username,
+                name=cal_data["name"],
+                color=cal_data["color"],
+                is_default=cal_data["is_default"]
+            )
+            db.add(calendar)
+        
+        try:
             db.commit()
+        except IntegrityError:
+            # Set up meanwhile by another worker
+            db.rollback()
     finally:
         db.close()
         
-# Initialize database
-def init_db():
-    create_tables() 
\ No newline at end of file
+# Convert todos.start_date/end_date from free-form strings to real dates.
+# The date index is created last, so its presence marks the migration as done.
+def migrate_todo_dates(bind=engine):
+    inspector = inspect(bind)
+    if "todos" not in inspector.get_table_names():
+        return
+    if any(index["name"] == "ix_todos_user_dates" for index in inspector.get_indexes("todos")):
+        return
+
+    with bind.begin() as conn:
+        for column in ("start_date", "end_date"):
+            if bind.dialect.name == "sqlite":
+                # SQLite keeps DATE as 'YYYY-MM-DD' text, so normalizing the values is enough
+                conn.execute(text(
+                    f"UPDATE todos SET {column} = NULL "
+                    f"WHERE {column} NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'"
+                ))
+                conn.execute(text(
+                    f"UPDATE todos SET {column} = substr({column}, 1, 10) WHERE length({column}) > 10"
+                ))
+            else:
+                conn.execute(text(
+                    f"ALTER TABLE todos ALTER COLUMN {column} TYPE DATE USING "
+                    f"CASE WHEN {column} ~ '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}' "
+                    f"THEN substring({column} from 1 for 10)::date END"
+                ))
+
+    for index in TodoModel.__table__.indexes:
+        if index.name == "ix_todos_user_dates":
+            index.create(bind=bind)
+
+# Add the recurrence rule columns to an existing todos table. Rows written before the
+# backend expanded recurrences were already one row per occurrence, so they become plain todos.
+def migrate_recurrence_columns(bind=engine):
+    inspector = inspect(bind)
+    if "todos" not in inspector.get_table_names():
+        return
+    if "recurring_until" in {column["name"] for column in inspector.get_columns("todos")}:
+        return
+
+    with bind.begin() as conn:
+        conn.execute(text("ALTER TABLE todos ADD COLUMN recurring_until DATE"))
+        conn.execute(text("ALTER TABLE todos ADD COLUMN recurring_exceptions TEXT"))
+        conn.execute(text("UPDATE todos SET is_recurring = :is_recurring"), {"is_recurring": False})
+
+# Add the moved-date and calendar columns to occurrence overrides created before occurrences could move
+def migrate_occurrence_columns(bind=engine):
+    inspector = inspect(bind)
+    if "occurrence_overrides" not in inspector.get_table_names():
+        return
+    columns = {column["name"] for column in inspector.get_columns("occurrence_overrides")}
+    with bind.begin() as conn:
+        for column, column_type in (("start_date", "DATE"), ("end_date", "DATE"), ("calendar_id", "VARCHAR")):
+            if column not in columns:
+                conn.execute(text(f"ALTER TABLE occurrence_overrides ADD COLUMN {column} {column_type}"))
+
+# Add the sync bookkeeping columns to tables created before delta sync existed
+def migrate_sync_columns(bind=engine):
+    inspector = inspect(bind)
+    tables = inspector.get_table_names()
+    with bind.begin() as conn:
+        for table in ("todos", "calendars", "templates"):
+            if table not in tables:
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table)}
+            if "version" not in columns:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+            if "updated_at" not in columns:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP"))
+        
+        if "sync_versions" in tables:
+            columns = {column["name"] for column in inspector.get_columns("sync_versions")}
+            for column in ("todos_version", "calendars_version", "templates_version", "pruned_version"):
+                if column not in columns:
+                    conn.execute(text(f"ALTER TABLE sync_versions ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+
+# create_all skips tables that already exist, so add indexes introduced since then
+def create_missing_indexes(bind=engine):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+# Fill the rollups for todos written before they existed, and rebuild those of schema versions
+# before 2, which left completed occurrences out
+def backfill_rollups(bind=engine, previous_version: str = None):
+    db = Session(bind=bind)
+    try:
+        empty = db.query(DailyRollupModel).first() is None and db.query(TodoModel.id).first() is not None
+        stale = previous_version is not None and int(previous_version.split(":")[0]) < 2
+        if empty or stale:
+            analytics.rebuild_rollups(db)
+            db.commit()
+    finally:
+        db.close()
+
+SQLITE_SYNCHRONOUS_NAMES = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+
+# The storage settings actually in effect, as read back from the database where possible
+def storage_report() -> dict:
+    report = {"profile": settings.STORAGE_PROFILE, "backend": database_url.get_backend_name(), "async": ASYNC_DATABASE}
+    if IS_SQLITE:
+        with engine.connect() as conn:
+            for pragma in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size"):
+                report[pragma] = conn.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+        report["synchronous"] = SQLITE_SYNCHRONOUS_NAMES.get(report["synchronous"], report["synchronous"])
+    # The pool requests are served from: the async engine's when there is one, beside the
+    # sync engine's that startup, password work and streamed responses use
+    serving = async_engine.sync_engine if ASYNC_DATABASE else engine
+    report["pool"] = type(serving.pool).__name__
+    if isinstance(serving.pool, QueuePool):
+        report["pool_size"] = serving.pool.size()
+        report["max_overflow"] = settings.DB_MAX_OVERFLOW
+    if ASYNC_DATABASE:
+        report["sync_pool"] = type(engine.pool).__name__
+    report["pre_ping"] = settings.DB_POOL_PRE_PING
+    report["recycle_seconds"] = settings.DB_POOL_RECYCLE_SECONDS
+    report["sharding"] = settings.SHARDING
+    if shards.SHARDING:
+        report["shard_directory"] = settings.SHARD_DIRECTORY
+        report["shard_engine_cache"] = settings.SHARD_ENGINE_CACHE_SIZE
+    return report
+
+def log_storage_settings():
+    print("Storage: " + ", ".join(f"{name}={value}" for name, value in storage_report().items()))
+
+# Bump when a migration above changes without the models changing; model changes alter
+# the fingerprint by themselves
+SCHEMA_VERSION = 2
+BOOTSTRAP_LOCK_KEY = 0x6776  # pg_advisory_lock key for startup tasks
+
+def schema_fingerprint() -> str:
+    """SCHEMA_VERSION plus a hash of the DDL the models compile to on this database"""
+    digest = hashlib.sha256()
+    for table in Base.metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=engine.dialect)).encode())
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            digest.update(str(CreateIndex(index).compile(dialect=engine.dialect)).encode())
+    return f"{SCHEMA_VERSION}:{digest.hexdigest()[:16]}"
+
+def stored_schema_version(bind=engine):
+    try:
+        with bind.connect() as conn:
+            return conn.execute(select(SchemaVersionModel.version)).scalar()
+    except SQLAlchemyError:
+        return None  # No schema_version table yet
+
+def record_schema_version(version: str, bind=engine):
+    db = Session(bind=bind)
+    try:
+        db.merge(SchemaVersionModel(id=1, version=version, applied_at=datetime.utcnow()))
+        db.commit()
+    finally:
+        db.close()
+
+@contextmanager
+def bootstrap_lock(bind=engine):
+    """Hold a lock shared by every process using this database, for one-off startup tasks"""
+    if bind.dialect.name == "postgresql":
+        with bind.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": BOOTSTRAP_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": BOOTSTRAP_LOCK_KEY})
+    elif IS_SQLITE and bind.url.database not in (None, "", ":memory:") and fcntl is not None:
+        # Processes sharing a SQLite file share its directory too, so a lock file beside it will do
+        with open(bind.url.database + ".bootstrap-lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
+# Create the tables and run every migration; each step is a no-op when already applied.
+# previous_version is the fingerprint the database was migrated to before, if any.
+def migrate_schema(bind=engine, previous_version: str = None):
+    create_tables(bind)
+    migrate_todo_dates(bind)
+    migrate_recurrence_columns(bind)
+    migrate_occurrence_columns(bind)
+    migrate_sync_columns(bind)
+    create_missing_indexes(bind)
+    search.setup_search_indexes(bind)
+    backfill_rollups(bind, previous_version)
+
+# Processes finding the schema current only read its version; otherwise the first one to
+# take the bootstrap lock migrates while the others wait.
+def ensure_schema(bind) -> bool:
+    """Bring a database's schema up to date; returns whether this process had to migrate it"""
+    version = schema_fingerprint()
+    if stored_schema_version(bind) == version:
+        return False
+    with bootstrap_lock(bind):
+        # Another worker may have migrated while this one waited for the lock
+        previous_version = stored_schema_version(bind)
+        if previous_version == version:
+            return False
+        migrate_schema(bind, previous_version)
+        record_schema_version(version, bind)
+    return True
+
+# Initialize database. Shards are brought up to date as they are first opened.
+def init_db() -> bool:
+    """Bring the main schema up to date; returns whether this process had to migrate it"""
+    migrated = ensure_schema(engine)
+    if migrated:
+        print(f"Schema migrated to version {schema_fingerprint()}")
+    log_storage_settings()
+    return migrated
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+import time
+from sqlalchemy.engine import make_url
+from config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Snowflake-style primary keys: 41 bits of milliseconds since EPOCH_MS, then a 10-bit
+# worker ID and a 12-bit per-millisecond sequence. IDs from one worker strictly increase,
+# and workers with different IDs never collide. They are zero-padded to a fixed width so
+# string order (the column type) matches creation order among them.
+#
+# Rows created before these IDs keep the client's 13-digit Date.now() IDs, which sort
+# after every 19-digit one as strings. So IDs are opaque: lists are ordered by created_at,
+# with the ID only breaking ties, never by the ID alone.
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+ID_WIDTH = 19
+
+class IdGenerator:
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"Worker ID must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self) -> str:
+        with self._lock:
+            now = int(time.time() * 1000) - EPOCH_MS
+            if now <= self._last_ms:
+                # Same millisecond, or the clock stepped back: keep counting from the last one
+                now = self._last_ms
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # Sequence exhausted: borrow the next millisecond instead of spinning
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            value = (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+            return str(value).zfill(ID_WIDTH)
+
+def worker_id_directory() -> str:
+    if settings.WORKER_ID_DIRECTORY:
+        return settings.WORKER_ID_DIRECTORY
+    url = make_url(settings.DATABASE_URL)
+    if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+        # Processes sharing a SQLite file share its directory too
+        return os.path.dirname(os.path.abspath(url.database))
+    return os.path.join(tempfile.gettempdir(), "good-vibes-worker-ids")
+
+# Lock files of the leased IDs, held open for the life of the process
+_leases = []
+
+def lease_worker_id() -> int:
+    """Lock the first free worker-<n>.lock in the worker ID directory and keep it locked"""
+    directory = worker_id_directory()
+    os.makedirs(directory, exist_ok=True)
+    for worker_id in range(MAX_WORKER_ID + 1):
+        lock_file = open(os.path.join(directory, f"worker-{worker_id}.lock"), "a")
+        try:
+            # A forked child opens the file anew, so the lock it inherits doesn't count as its own
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        _leases.append(lock_file)
+        return worker_id
+    raise RuntimeError(f"All {MAX_WORKER_ID + 1} worker IDs in {directory} are leased; set WORKER_ID")
+
+def default_worker_id() -> int:
+    # A configured WORKER_ID wins. Otherwise lease one, which holds across containers and
+    # PID namespaces as long as they share the directory; the PID is a last resort.
+    if settings.WORKER_ID:
+        return int(settings.WORKER_ID)
+    if fcntl is not None:
+        return lease_worker_id()
+    return os.getpid() & MAX_WORKER_ID
+
+_generator = None
+_generator_pid = None
+_generator_lock = threading.Lock()
+
+def generate_id() -> str:
+    global _generator, _generator_pid
+    # A forked worker must not keep issuing from its parent's generator
+    if _generator_pid != os.getpid():
+        with _generator_lock:
+            if _generator_pid != os.getpid():
+                _generator = IdGenerator(default_worker_id())
+                _generator_pid = os.getpid()
+    return _generator.next_id()
@@ -0,0 +1,216 @@
+import json
+from collections import defaultdict
+from datetime import datetime, timezone
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import Session
+from models import (
+    Todo as TodoModel, Calendar as CalendarModel, Template as TemplateModel, ImportJob as ImportJobModel
+)
+from ids import generate_id
+from schemas import parse_date
+from sync import SYNCED_ENTITIES, bump_version
+import analytics
+import changefeed
+
+# Imports take records in the frontend's localStorage format and upsert them by id in
+# bulk: one id lookup per model and chunk, then an executemany INSERT for new ids and an
+# executemany UPDATE for the user's existing ones. Core statements bypass the flush hooks,
+# so sync versions and activity rollups are maintained here.
+
+IMPORT_CHUNK_LINES = 500
+MAX_IMPORT_LINE_BYTES = 1 << 20
+MAX_ERRORS_PER_CHUNK = 20
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _required(data: dict, key: str):
+    value = data.get(key)
+    if value is None or value == "":
+        raise ValueError(f"'{key}' is required")
+    return value
+
+def _int_or_none(value):
+    return int(value) if value not in (None, "") else None
+
+def calendar_values(data: dict) -> dict:
+    return {
+        "id": str(data.get("id") or generate_id()),
+        "name": str(_required(data, "name")),
+        "color": str(_required(data, "color")),
+        "is_default": bool(data.get("isDefault", False)),
+    }
+
+def template_values(data: dict) -> dict:
+    return {
+        "id": str(data.get("id") or generate_id()),
+        "name": str(_required(data, "name")),
+        "title": str(_required(data, "title")),
+        "description": data.get("description"),
+        "start_date": data.get("startDate"),
+        "end_date": data.get("endDate"),
+        "estimated_time": _int_or_none(data.get("estimatedTime")),
+        "priority": data.get("priority") or "medium",
+        "calendar_id": data.get("calendarId"),
+    }
+
+def todo_values(data: dict) -> dict:
+    return {
+        "id": str(data.get("id") or generate_id()),
+        "title": str(_required(data, "title")),
+        "description": data.get("description"),
+        "start_date": parse_date(data.get("startDate")),
+        "end_date": parse_date(data.get("endDate")),
+        "estimated_time": _int_or_none(data.get("estimatedTime")),
+        "priority": data.get("priority") or "medium",
+        "calendar_id": data.get("calendarId"),
+        "is_completed": bool(data.get("isCompleted", False)),
+        "created_at": parse_timestamp(data.get("createdAt")) or datetime.utcnow(),
+        "completed_at": parse_timestamp(data.get("completedAt")),
+        # localStorage todos predate server-side recurrence and are already one per occurrence
+        "is_recurring": False,
+        "recurring_pattern": data.get("recurringPattern"),
+        "recurring_count": _int_or_none(data.get("recurringCount")),
+    }
+
+# Record type -> (model, converter)
+RECORD_TYPES = {
+    "calendar": (CalendarModel, calendar_values),
+    "template": (TemplateModel, template_values),
+    "todo": (TodoModel, todo_values),
+}
+
+def record_values(record_type: str, data: dict):
+    if record_type not in RECORD_TYPES:
+        raise ValueError(f"Unknown record type {record_type!r}")
+    model, convert = RECORD_TYPES[record_type]
+    return model, convert(data)
+
+def write_rows(session: Session, username: str, model, rows: list) -> list:
+    """Upsert rows (dicts of column values) of one model for the user; returns ids owned by someone else, which are skipped"""
+    table = model.__table__
+    # Later records with the same id win
+    rows = list({row["id"]: row for row in rows}.values())
+    owners = dict(session.connection().execute(
+        select(table.c.id, table.c.user_id).where(table.c.id.in_([row["id"] for row in rows]))
+    ).all())
+    foreign_ids = [row["id"] for row in rows if owners.get(row["id"], username) != username]
+    rows = [row for row in rows if owners.get(row["id"], username) == username]
+    if not rows:
+        return foreign_ids
+
+    entity = SYNCED_ENTITIES[model]
+    version = bump_version(session, username, [entity])
+    now = datetime.utcnow()
+    for row in rows:
+        row.update(user_id=username, version=version, updated_at=now)
+    new_rows = [row for row in rows if row["id"] not in owners]
+    existing_rows = [row for row in rows if row["id"] in owners]
+
+    if model is TodoModel and existing_rows:
+        analytics.forget_todos(session, session.query(TodoModel).filter(
+            TodoModel.user_id == username,
+            TodoModel.id.in_([row["id"] for row in existing_rows])
+        ))
+
+    conn = session.connection()
+    if new_rows:
+        conn.execute(insert(table), new_rows)
+    if existing_rows:
+        # Bind names must differ from the column names being set
+        columns = [name for name in existing_rows[0] if name != "id"]
+        statement = update(table).where(
+            table.c.id == bindparam("b_id"), table.c.user_id == username
+        ).values({name: bindparam(f"b_{name}") for name in columns})
+        conn.execute(statement, [{f"b_{name}": value for name, value in row.items()} for row in existing_rows])
+
+    if model is TodoModel:
+        analytics.record_todos(session, rows)
+    for row in rows:
+        changefeed.record(session, username, entity, row["id"], "upsert", version)
+    return foreign_ids
+
+def write_records(session: Session, username: str, records) -> dict:
+    """Upsert (record_type, data) pairs, raising ValueError on the first invalid one; returns counts per type"""
+    rows_by_model = defaultdict(list)
+    for record_type, data in records:
+        model, values = record_values(record_type, data)
+        rows_by_model[model].append(values)
+    counts = {}
+    for model, rows in rows_by_model.items():
+        foreign_ids = write_rows(session, username, model, rows)
+        if foreign_ids:
+            raise ValueError(f"Ids already used by another user: {', '.join(foreign_ids[:5])}")
+        counts[SYNCED_ENTITIES[model] + "s"] = len(rows)
+    return counts
+
+# ================= STREAMED IMPORTS =================
+
+async def ndjson_lines(chunks):
+    """Split a byte stream into lines, holding at most one partial line in memory"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > MAX_IMPORT_LINE_BYTES:
+            raise ValueError(f"Line longer than {MAX_IMPORT_LINE_BYTES} bytes")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+def start_job(session: Session, username: str, import_id: str) -> int:
+    """Lines of this import already committed by earlier attempts"""
+    job = session.get(ImportJobModel, import_id)
+    if job is None:
+        session.add(ImportJobModel(id=import_id, user_id=username))
+        session.commit()
+        return 0
+    if job.user_id != username:
+        raise ValueError("Import id already used by another user")
+    return job.lines_committed
+
+def import_chunk(session: Session, username: str, import_id: str, lines: list) -> dict:
+    """Validate and upsert numbered NDJSON lines in one transaction, advancing the job's progress with them"""
+    rows_by_model = defaultdict(list)
+    errors = []
+
+    def reject(line_number, detail):
+        errors.append({"line": line_number, "detail": detail})
+
+    for line_number, line in lines:
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("Expected a JSON object")
+            model, values = record_values(record.get("type"), record)
+        except (ValueError, TypeError) as e:
+            reject(line_number, str(e))
+            continue
+        rows_by_model[model].append((line_number, values))
+
+    imported = {}
+    for model, numbered_rows in rows_by_model.items():
+        foreign_ids = set(write_rows(session, username, model, [values for _, values in numbered_rows]))
+        for line_number, values in numbered_rows:
+            if values["id"] in foreign_ids:
+                reject(line_number, "Id already used by another user")
+        imported[SYNCED_ENTITIES[model] + "s"] = sum(1 for _, values in numbered_rows if values["id"] not in foreign_ids)
+
+    session.query(ImportJobModel).filter(ImportJobModel.id == import_id).update(
+        {"lines_committed": lines[-1][0], "updated_at": datetime.utcnow()}, synchronize_session=False
+    )
+    session.commit()
+    errors.sort(key=lambda error: error["line"])
+    return {
+        "first_line": lines[0][0],
+        "last_line": lines[-1][0],
+        "imported": imported,
+        "error_count": len(errors),
+        "errors": errors[:MAX_ERRORS_PER_CHUNK],
+    }
@@ -0,0 +1,219 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+from config import settings
+from database import init_user_data, user_data_engines, user_session
+from ids import generate_id
+from models import Calendar as CalendarModel, Job as JobModel, OccurrenceOverride as OccurrenceOverrideModel, Todo as TodoModel
+from sync import delete_with_tombstones, prune_tombstones
+import analytics
+import importer
+import writes
+
+# Background jobs for work too large for a request: the endpoint records a job row and
+# answers 202, and a small thread pool works through it in chunks, one transaction per
+# chunk with the job's progress committed alongside. A job whose worker died mid-way is
+# picked up again from its last committed chunk, so handlers must be safe to resume.
+
+logger = logging.getLogger(__name__)
+
+JOB_CHUNK_ROWS = 500
+# A running job with no progress for this long lost its worker
+JOB_STALE_AFTER = timedelta(minutes=5)
+FINISHED = ("succeeded", "failed")
+
+job_executor = ThreadPoolExecutor(max_workers=settings.JOB_WORKERS, thread_name_prefix="jobs")
+
+def enqueue(session: Session, username: str, kind: str, payload: dict = None, total: int = None) -> JobModel:
+    """Commit a job, along with whatever else the session has pending, and start it"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    job = JobModel(
+        id=generate_id(),
+        user_id=username,
+        kind=kind,
+        status="queued",
+        payload=json.dumps(payload or {}),
+        total=total,
+    )
+    session.add(job)
+    session.commit()
+    job_executor.submit(run_job, job.id, username)
+    return job
+
+def claim(session: Session, job_id: str) -> bool:
+    # Atomic, so two processes resuming the same job can't both run it
+    now = datetime.utcnow()
+    claimed = session.query(JobModel).filter(
+        JobModel.id == job_id,
+        or_(
+            JobModel.status == "queued",
+            (JobModel.status == "running") & (JobModel.heartbeat_at < now - JOB_STALE_AFTER)
+        )
+    ).update({"status": "running", "heartbeat_at": now}, synchronize_session=False)
+    session.commit()
+    return claimed == 1
+
+def advance(session: Session, job: JobModel, rows: int):
+    """Count a chunk's rows as done and commit them together"""
+    job.progress += rows
+    job.heartbeat_at = datetime.utcnow()
+    session.commit()
+
+def run_job(job_id: str, username: str):
+    session = user_session(username)
+    try:
+        if not claim(session, job_id):
+            return
+        job = session.get(JobModel, job_id)
+        job.started_at = job.started_at or datetime.utcnow()
+        session.commit()
+        try:
+            result = JOB_HANDLERS[job.kind](session, job, json.loads(job.payload or "{}"))
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.id, job.kind)
+            session.rollback()
+            job.status = "failed"
+            job.error = str(e)
+        else:
+            job.status = "succeeded"
+            job.result = json.dumps(result) if result is not None else None
+        job.finished_at = datetime.utcnow()
+        # Only a resumed job reads its payload, and a finished one is never resumed; a
+        # migration's can be a user's whole upload
+        job.payload = None
+        session.commit()
+    finally:
+        session.close()
+
+def resume_jobs():
+    """Start jobs left queued, or running without a worker, by an earlier process, in every shard"""
+    for _, engine in user_data_engines():
+        session = Session(bind=engine)
+        try:
+            jobs = session.execute(
+                select(JobModel.id, JobModel.user_id).where(JobModel.status.notin_(FINISHED)).order_by(JobModel.created_at)
+            ).all()
+        finally:
+            session.close()
+        for job_id, username in jobs:
+            job_executor.submit(run_job, job_id, username)
+
+# ================= MAINTENANCE =================
+
+# Every worker prunes on startup and then this often; a pass with nothing to prune is cheap
+TOMBSTONE_PRUNE_INTERVAL = timedelta(hours=6)
+
+def prune_old_tombstones() -> int:
+    """Drop tombstones past TOMBSTONE_RETENTION_DAYS in every database holding user data"""
+    if not settings.TOMBSTONE_RETENTION_DAYS:
+        return 0
+    before = datetime.utcnow() - timedelta(days=settings.TOMBSTONE_RETENTION_DAYS)
+    pruned = 0
+    for _, engine in user_data_engines():
+        session = Session(bind=engine)
+        try:
+            pruned += prune_tombstones(session, before)
+            session.commit()
+        finally:
+            session.close()
+    return pruned
+
+def schedule_tombstone_pruning():
+    """Prune in the job pool now, and again every TOMBSTONE_PRUNE_INTERVAL"""
+    def run():
+        try:
+            pruned = prune_old_tombstones()
+            if pruned:
+                logger.info("Pruned %d tombstones", pruned)
+        except Exception:
+            logger.exception("Pruning tombstones failed")
+        finally:
+            timer = threading.Timer(TOMBSTONE_PRUNE_INTERVAL.total_seconds(), job_executor.submit, (run,))
+            # Must not keep the process from exiting
+            timer.daemon = True
+            timer.start()
+    if settings.TOMBSTONE_RETENTION_DAYS:
+        job_executor.submit(run)
+
+# ================= HANDLERS =================
+
+def release_occurrences(session: Session, username: str, calendar_id: str):
+    """Send occurrences moved into the calendar back to their series' calendar"""
+    overrides = session.query(OccurrenceOverrideModel).filter(
+        OccurrenceOverrideModel.user_id == username,
+        OccurrenceOverrideModel.calendar_id == calendar_id
+    ).all()
+    for override in overrides:
+        override.calendar_id = None
+    if overrides:
+        # The series count as changed for sync, as with any occurrence edit
+        series = session.query(TodoModel).filter(TodoModel.id.in_({override.todo_id for override in overrides}))
+        for todo in series:
+            todo.updated_at = datetime.utcnow()
+
+def delete_calendar_todos(session: Session, username: str, calendar_id: str, limit: int = None) -> int:
+    """Delete up to `limit` (default: all) of the calendar's todos with their occurrence overrides; returns how many"""
+    query = session.query(TodoModel.id).filter(TodoModel.calendar_id == calendar_id, TodoModel.user_id == username)
+    if limit:
+        query = query.limit(limit)
+    release_occurrences(session, username, calendar_id)
+    todo_ids = [todo_id for (todo_id,) in query]
+    if not todo_ids:
+        return 0
+    overrides = session.query(OccurrenceOverrideModel).filter(
+        OccurrenceOverrideModel.user_id == username,
+        OccurrenceOverrideModel.todo_id.in_(todo_ids)
+    )
+    analytics.forget_occurrences(session, overrides)
+    overrides.delete(synchronize_session=False)
+    todos = session.query(TodoModel).filter(TodoModel.user_id == username, TodoModel.id.in_(todo_ids))
+    analytics.forget_todos(session, todos)
+    delete_with_tombstones(session, username, TodoModel, todos)
+    return len(todo_ids)
+
+def run_calendar_delete(session: Session, job: JobModel, payload: dict):
+    calendar_id = payload["calendar_id"]
+    while True:
+        deleted = delete_calendar_todos(session, job.user_id, calendar_id, JOB_CHUNK_ROWS)
+        if deleted < JOB_CHUNK_ROWS:
+            # Committed with the last chunk, so the calendar outlives its todos only
+            # while the job still has them to delete
+            if session.query(CalendarModel.id).filter(CalendarModel.id == calendar_id, CalendarModel.user_id == job.user_id).first():
+                writes.delete_row(session, job.user_id, CalendarModel, calendar_id, name="Calendar")
+            advance(session, job, deleted)
+            return {"todos_deleted": job.progress}
+        advance(session, job, deleted)
+
+def run_migration(session: Session, job: JobModel, payload: dict):
+    records = (
+        [("calendar", item) for item in payload.get("calendars", [])] +
+        [("template", item) for item in payload.get("templates", [])] +
+        [("todo", item) for item in payload.get("todos", [])]
+    )
+    counts = dict.fromkeys(("calendars", "templates", "todos"), 0)
+    # Progress counts records, so a resumed job skips the committed ones; their counts are
+    # rebuilt from the record types
+    for record_type, _ in records[:job.progress]:
+        counts[record_type + "s"] += 1
+    for start in range(job.progress, len(records), JOB_CHUNK_ROWS):
+        chunk = records[start:start + JOB_CHUNK_ROWS]
+        for name, count in importer.write_records(session, job.user_id, chunk).items():
+            counts[name] += count
+        advance(session, job, len(chunk))
+    return {"migrated": counts}
+
+def run_user_setup(session: Session, job: JobModel, payload: dict):
+    init_user_data(job.user_id)
+    return None
+
+# Job kind -> handler(session, job, payload), returning the job's JSON result
+JOB_HANDLERS = {
+    "calendar_delete": run_calendar_delete,
+    "migration": run_migration,
+    "user_setup": run_user_setup,
+}
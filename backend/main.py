@@ -1,38 +1,68 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from typing import List
-import time
-from datetime import datetime, timedelta
-from contextlib import asynccontextmanager
-from pydantic import BaseModel
-
-from database import get_db, init_db
-from models import Todo as TodoModel, Calendar as CalendarModel, Template as TemplateModel
+from typing import List, Optional
+from datetime import date, datetime, timedelta
+import hashlib
+import hmac
+from pydantic import BaseModel, ValidationError
+
+from database import async_engine, get_db, init_db, begin_snapshot, route_to_user, run_in_session, session_endpoint, user_session
+from models import (
+    Todo as TodoModel, Calendar as CalendarModel, Template as TemplateModel,
+    OccurrenceOverride as OccurrenceOverrideModel, Tombstone as TombstoneModel, Job as JobModel
+)
 from schemas import (
-    Todo, TodoCreate, TodoUpdate,
+    Todo, TodoCreate, TodoUpdate, TodoOccurrence, TodoSearchResult, OccurrenceUpdate,
     Calendar, CalendarCreate, CalendarUpdate,
-    Template, TemplateCreate,
-    MigrationData
+    Template, TemplateCreate, TemplateSearchResult,
+    BatchRequest, BatchResponse, BatchResult, BootstrapResponse, SyncResponse,
+    AnalyticsSummary, CalendarActivity, ActivityPattern, TimeEstimates,
+    MigrationData, Job
 )
 from auth import (
-    authenticate_user, create_access_token, get_current_user, create_user,
-    Token, User, UserCreate, ACCESS_TOKEN_EXPIRE_MINUTES
+    authenticate_user, create_access_token, create_stream_ticket, get_current_user, get_stream_user, create_user, ensure_admin_user,
+    run_password_task, Registration, Token, User, UserCreate, ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from config import settings
+from ids import generate_id
+from pagination import encode_cursor, decode_cursor, stream_json_array
+from serialization import RowSerializer, dicts_to_columns, json_response, negotiated_response, response_media_type, split_list
+from recurrence import PATTERNS, occurrence_dates, parse_exceptions, format_exceptions
+import analytics
+import changefeed
+import importer
+import jobs
+import metrics
+import search
+import writes
+from sync import collection_version, current_version, pruned_version
+
+app = FastAPI(title="Good Vibes API", version="1.0.0")
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup
+# FastAPI 0.88 has no lifespan parameter (it lands in app.extra unused), so startup
+# work hangs off the startup event. Each worker runs it; init_db and ensure_admin_user
+# only read when the schema and the admin are already in place.
+@app.on_event("startup")
+def startup():
     init_db()
     # Ensure admin user exists with default data
-    from auth import ensure_admin_user
     ensure_admin_user()
-    yield
-    # Shutdown (if needed)
+    # Pick up background jobs an earlier process didn't finish
+    jobs.resume_jobs()
+    jobs.schedule_tombstone_pruning()
 
-app = FastAPI(title="Good Vibes API", version="1.0.0", lifespan=lifespan)
+@app.on_event("shutdown")
+async def shutdown():
+    # Each pooled aiosqlite connection owns a non-daemon thread; close them or the
+    # worker hangs on exit after serving its last request
+    if async_engine is not None:
+        await async_engine.dispose()
 
 # Configure CORS
 app.add_middleware(
@@ -41,13 +71,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Retry-After", "X-Sync-Version"],
 )
+app.add_middleware(changefeed.SyncVersionMiddleware)
+
+# Added last, so it wraps CORS and counts preflight requests too
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Health check
 @app.get("/")
 def read_root():
     return {"message": "Good Vibes API is running!"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Request latency, status and SQL figures of this process, in the Prometheus text format"""
+    if settings.METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Authentication endpoints
 class LoginRequest(BaseModel):
     username: str
@@ -55,7 +99,7 @@ class LoginRequest(BaseModel):
 
 @app.post("/api/token", response_model=Token)
 async def login_for_access_token(login_data: LoginRequest):
-    user = authenticate_user(login_data.username, login_data.password)
+    user = await run_password_task(authenticate_user, login_data.username, login_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -72,24 +116,304 @@ async def login_for_access_token(login_data: LoginRequest):
 async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
 
-@app.post("/api/register", response_model=User)
+@app.post("/api/register", response_model=Registration, status_code=202)
 async def register_user(user_data: UserCreate):
-    return create_user(user_data)
+    """Create the account; its default calendars are set up by the returned background job"""
+    user = await run_password_task(create_user, user_data)
+    route_to_user(user.username)
+    job = await run_in_session(jobs.enqueue, user.username, "user_setup")
+    return Registration(username=user.username, job_id=job.id)
+
+# ================= CONDITIONAL GET =================
+
+def etag_variant(request: Request, username: str) -> str:
+    # The user, query string and media type are folded in so a browser cache shared between
+    # users, or between differently filtered or encoded lists, never matches the wrong variant
+    key = f"{username}?{request.url.query}#{response_media_type(request)}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def collection_etag(request: Request, db: Session, username: str, entity: str) -> str:
+    return f'W/"{entity}s-{collection_version(db, username, entity)}-{etag_variant(request, username)}"'
+
+def cache_headers(etag: str) -> dict:
+    # Always revalidate, but let the browser answer from its private cache on 304. The body
+    # is MessagePack or JSON, compressed or not, depending on the request's Accept headers.
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept, Accept-Encoding"}
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 response if the client's If-None-Match already names this version"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=cache_headers(etag))
+    return None
 
 # ================= TODO ENDPOINTS =================
 
+# Column-tuple serializers for the list endpoints
+TODO_ROWS = RowSerializer(Todo, TodoModel, converters={"recurring_exceptions": split_list})
+CALENDAR_ROWS = RowSerializer(Calendar, CalendarModel)
+TEMPLATE_ROWS = RowSerializer(Template, TemplateModel)
+
+# ?format=columnar sends lists as {field: [values...]}, naming each field once
+LIST_FORMAT = Query(None, alias="format", regex="^(rows|columnar)$")
+
+def serialize_rows(serializer: RowSerializer, rows, list_format: Optional[str]):
+    return serializer.to_columns(rows) if list_format == "columnar" else serializer.to_list(rows)
+
+def filter_todo_window(query, date_from: Optional[date], date_to: Optional[date], model=TodoModel, include_undated: bool = False):
+    # A todo without an end date occupies just its start date; one without a start date is
+    # in no window unless include_undated
+    undated = [model.start_date.is_(None)] if include_undated else []
+    if date_to:
+        query = query.filter(or_(model.start_date <= date_to, *undated))
+    if date_from:
+        query = query.filter(or_(
+            model.end_date >= date_from,
+            and_(model.end_date.is_(None), model.start_date >= date_from),
+            *undated
+        ))
+    return query
+
+def validate_recurrence(todo):
+    if todo.recurring_pattern not in PATTERNS:
+        raise HTTPException(status_code=400, detail=f"recurring_pattern must be one of: {', '.join(PATTERNS)}")
+    if not todo.start_date:
+        raise HTTPException(status_code=400, detail="Recurring todos need a start_date")
+
+def series_span(todo) -> timedelta:
+    if not todo.end_date or todo.end_date < todo.start_date:
+        return timedelta(0)
+    return todo.end_date - todo.start_date
+
+def series_dates(todo, date_from: date, date_to: date):
+    return occurrence_dates(
+        todo.start_date,
+        todo.recurring_pattern,
+        count=todo.recurring_count,
+        until=todo.recurring_until,
+        exceptions=parse_exceptions(todo.recurring_exceptions),
+        window_start=date_from,
+        window_end=date_to,
+        span=series_span(todo)
+    )
+
+def build_occurrence(todo, occurrence_date: date, override=None) -> TodoOccurrence:
+    values = {
+        "id": f"{todo.id}:{occurrence_date.isoformat()}",
+        "series_id": todo.id,
+        "occurrence_date": occurrence_date,
+        "start_date": occurrence_date,
+        "end_date": occurrence_date + series_span(todo) if todo.end_date else None,
+        "is_completed": False,
+        "completed_at": None
+    }
+    if override:
+        for field in ("title", "description", "estimated_time", "priority", "calendar_id"):
+            if getattr(override, field) is not None:
+                values[field] = getattr(override, field)
+        if override.start_date:
+            values["start_date"] = override.start_date
+            values["end_date"] = override.end_date
+        values["is_completed"] = bool(override.is_completed)
+        values["completed_at"] = override.completed_at
+    return TodoOccurrence.from_orm(todo).copy(update=values)
+
+def in_window(occurrence: TodoOccurrence, date_from: date, date_to: date) -> bool:
+    return occurrence.start_date <= date_to and (occurrence.end_date or occurrence.start_date) >= date_from
+
+def list_occurrences(db: Session, username: str, date_from: date, date_to: date) -> List[TodoOccurrence]:
+    query = db.query(TodoModel).filter(TodoModel.user_id == username)
+    plain = filter_todo_window(query.filter(TodoModel.is_recurring.isnot(True)), date_from, date_to).all()
+    series = {todo.id: todo for todo in query.filter(TodoModel.is_recurring.is_(True), TodoModel.start_date <= date_to)}
+    
+    occurrences = [(todo, day) for todo in series.values() for day in series_dates(todo, date_from, date_to)]
+    overrides = {}
+    if occurrences:
+        rows = db.query(OccurrenceOverrideModel).filter(
+            OccurrenceOverrideModel.user_id == username,
+            OccurrenceOverrideModel.todo_id.in_({todo.id for todo, _ in occurrences}),
+            OccurrenceOverrideModel.occurrence_date.between(
+                min(day for _, day in occurrences), max(day for _, day in occurrences)
+            )
+        )
+        overrides = {(row.todo_id, row.occurrence_date): row for row in rows}
+    
+    # Occurrences moved into the window from dates outside it
+    moved = filter_todo_window(
+        db.query(OccurrenceOverrideModel).filter(
+            OccurrenceOverrideModel.user_id == username,
+            OccurrenceOverrideModel.start_date.isnot(None)
+        ),
+        date_from, date_to, model=OccurrenceOverrideModel
+    ).all()
+    expanded = {(todo.id, day) for todo, day in occurrences}
+    moved = [row for row in moved if (row.todo_id, row.occurrence_date) not in expanded]
+    missing = {row.todo_id for row in moved} - series.keys()
+    if missing:
+        series.update((todo.id, todo) for todo in query.filter(TodoModel.is_recurring.is_(True), TodoModel.id.in_(missing)))
+    for row in moved:
+        todo = series.get(row.todo_id)
+        # The series may have been edited or cut short since the move
+        if todo and row.occurrence_date in series_dates(todo, row.occurrence_date, row.occurrence_date):
+            occurrences.append((todo, row.occurrence_date))
+            overrides[(row.todo_id, row.occurrence_date)] = row
+    
+    built = (build_occurrence(todo, day, overrides.get((todo.id, day))) for todo, day in occurrences)
+    # Drops those moved out of the window
+    return [TodoOccurrence.from_orm(todo) for todo in plain] + [
+        occurrence for occurrence in built if in_window(occurrence, date_from, date_to)
+    ]
+
+def get_series_for_occurrence(db: Session, todo_id: str, occurrence_date: date, username: str):
+    todo = db.query(TodoModel).filter(
+        TodoModel.id == todo_id,
+        TodoModel.user_id == username,
+        TodoModel.is_recurring.is_(True)
+    ).first()
+    if not todo or occurrence_date not in series_dates(todo, occurrence_date, occurrence_date):
+        raise HTTPException(status_code=404, detail="Occurrence not found")
+    return todo
+
+def stream_rows(username: str, query):
+    """The query's rows from a session of their own, as a stream outlives its handler.
+
+    The session is opened once the body is first read and closed when the rows run out or
+    the stream is closed, so a response that is never sent holds no connection.
+    """
+    db = user_session(username)
+    try:
+        yield from query.with_session(db).yield_per(500)
+    finally:
+        db.close()
+
 @app.get("/api/todos", response_model=List[Todo])
-def get_todos(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return db.query(TodoModel).filter(TodoModel.user_id == current_user.username).all()
+@session_endpoint
+def get_todos(
+    request: Request,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = None,
+    stream: bool = False,
+    list_format: Optional[str] = LIST_FORMAT,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """List todos, optionally only those whose start/end interval overlaps [from, to].
 
-@app.post("/api/todos", response_model=Todo)
-def create_todo(todo: TodoCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    # Generate ID using timestamp (matching frontend behavior)
-    todo_id = str(int(time.time() * 1000))
+    Results are ordered by (created_at, id). With `limit`, the `X-Next-Cursor` response
+    header carries the `after` value for the next page, streamed or not. With `stream=true`
+    the JSON array is written incrementally instead of being built in memory. Otherwise the list is
+    sent as MessagePack if accepted, and `format=columnar` sends it column by column.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if stream and list_format == "columnar":
+        raise HTTPException(status_code=400, detail="format=columnar can't be streamed")
+    
+    etag = collection_etag(request, db, current_user.username, "todo")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    query = db.query(TodoModel).filter(TodoModel.user_id == current_user.username)
+    query = filter_todo_window(query, date_from, date_to)
+    
+    if after:
+        created_at, todo_id = decode_cursor(after)
+        query = query.filter(or_(
+            TodoModel.created_at > created_at,
+            and_(TodoModel.created_at == created_at, TodoModel.id > todo_id)
+        ))
+    query = query.order_by(TodoModel.created_at, TodoModel.id)
+    
+    query = TODO_ROWS.query(query)
+    
+    headers = cache_headers(etag)
+    if stream:
+        if limit:
+            # The page's last row, and whether any follow. The stream stops at that row, so
+            # the cursor sent ahead of the body matches it whatever changes meanwhile.
+            keys = query.with_entities(TodoModel.created_at, TodoModel.id).offset(limit - 1).limit(2).all()
+            if keys:
+                created_at, todo_id = keys[0]
+                query = query.filter(or_(
+                    TodoModel.created_at < created_at,
+                    and_(TodoModel.created_at == created_at, TodoModel.id <= todo_id)
+                ))
+                if len(keys) > 1:
+                    headers["X-Next-Cursor"] = encode_cursor(created_at, todo_id)
+            query = query.limit(limit)
+        rows = stream_rows(current_user.username, query)
+        return StreamingResponse(
+            stream_json_array(rows, TODO_ROWS, close=rows.close),
+            media_type="application/json",
+            headers=headers
+        )
+    
+    if limit:
+        rows = query.limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = encode_cursor(rows[-1].created_at, rows[-1].id)
+        return negotiated_response(request, serialize_rows(TODO_ROWS, rows, list_format), headers)
+    return negotiated_response(request, serialize_rows(TODO_ROWS, query, list_format), headers)
+
+@app.get("/api/occurrences", response_model=List[TodoOccurrence])
+@session_endpoint
+def get_occurrences(
+    request: Request,
+    date_from: date = Query(..., alias="from"),
+    date_to: date = Query(..., alias="to"),
+    list_format: Optional[str] = LIST_FORMAT,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Todos overlapping [from, to], with each recurring todo expanded into its occurrences"""
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    
+    etag = collection_etag(request, db, current_user.username, "todo")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    occurrences = jsonable_encoder(list_occurrences(db, current_user.username, date_from, date_to))
+    if list_format == "columnar":
+        occurrences = dicts_to_columns(occurrences, list(TodoOccurrence.__fields__))
+    return negotiated_response(request, occurrences, cache_headers(etag))
+
+SEARCH_LIMIT = 20
+
+def search_terms(q: str) -> list:
+    terms = search.query_terms(q)
+    if not terms:
+        raise HTTPException(status_code=400, detail="The search query needs at least one word")
+    return terms
+
+@app.get("/api/todos/search", response_model=List[TodoSearchResult])
+@session_endpoint
+def search_todos(
+    q: str,
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Todos with a title or description word starting with every word of `q`, best match first"""
+    hits = search.search(db, TodoModel, TODO_ROWS.columns, current_user.username, search_terms(q), limit)
+    return json_response([dict(TODO_ROWS.to_dict(row), highlights=highlights) for row, highlights in hits])
+
+# The add_/apply_/remove_ helpers stage a change through the ORM without committing, for
+# create endpoints and /api/batch. Single-item updates and deletes go through writes.py as
+# one statement each, and take an If-Match of the row's ETag, "<version>", to refuse the
+# write (412) if the row has changed since the client read it.
+
+def add_todo(db: Session, username: str, todo: TodoCreate):
+    if todo.is_recurring:
+        validate_recurrence(todo)
     
     db_todo = TodoModel(
-        id=todo_id,
-        user_id=current_user.username,
+        id=generate_id(),
+        user_id=username,
         title=todo.title,
         description=todo.description,
         start_date=todo.start_date,
@@ -101,24 +425,15 @@ def create_todo(todo: TodoCreate, db: Session = Depends(get_db), current_user: U
         created_at=datetime.utcnow(),
         is_recurring=todo.is_recurring,
         recurring_pattern=todo.recurring_pattern,
-        recurring_count=todo.recurring_count
+        recurring_count=todo.recurring_count,
+        recurring_until=todo.recurring_until
     )
     
     db.add(db_todo)
-    db.commit()
-    db.refresh(db_todo)
     return db_todo
 
-@app.get("/api/todos/{todo_id}", response_model=Todo)
-def get_todo(todo_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    todo = db.query(TodoModel).filter(TodoModel.id == todo_id, TodoModel.user_id == current_user.username).first()
-    if not todo:
-        raise HTTPException(status_code=404, detail="Todo not found")
-    return todo
-
-@app.put("/api/todos/{todo_id}", response_model=Todo)
-def update_todo(todo_id: str, todo_update: TodoUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    todo = db.query(TodoModel).filter(TodoModel.id == todo_id, TodoModel.user_id == current_user.username).first()
+def apply_todo_update(db: Session, username: str, todo_id: str, todo_update: TodoUpdate):
+    todo = db.query(TodoModel).filter(TodoModel.id == todo_id, TodoModel.user_id == username).first()
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
     
@@ -133,86 +448,231 @@ def update_todo(todo_id: str, todo_update: TodoUpdate, db: Session = Depends(get
         
         setattr(todo, field, value)
     
-    db.commit()
-    db.refresh(todo)
+    if todo.is_recurring:
+        validate_recurrence(todo)
     return todo
 
-@app.delete("/api/todos/{todo_id}")
-def delete_todo(todo_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    todo = db.query(TodoModel).filter(TodoModel.id == todo_id, TodoModel.user_id == current_user.username).first()
+def remove_todo(db: Session, username: str, todo_id: str):
+    todo = db.query(TodoModel).filter(TodoModel.id == todo_id, TodoModel.user_id == username).first()
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
     
+    overrides = db.query(OccurrenceOverrideModel).filter(
+        OccurrenceOverrideModel.todo_id == todo_id,
+        OccurrenceOverrideModel.user_id == username
+    )
+    analytics.forget_occurrences(db, overrides)
+    overrides.delete()
     db.delete(todo)
+
+@app.post("/api/todos", response_model=Todo)
+@session_endpoint
+def create_todo(todo: TodoCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    db_todo = add_todo(db, current_user.username, todo)
     db.commit()
-    return {"message": "Todo deleted successfully"}
+    db.refresh(db_todo)
+    return db_todo
 
-# ================= CALENDAR ENDPOINTS =================
+@app.get("/api/todos/{todo_id}", response_model=Todo)
+@session_endpoint
+def get_todo(todo_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    row = TODO_ROWS.query(db.query(TodoModel).filter(TodoModel.id == todo_id, TodoModel.user_id == current_user.username)).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Todo not found")
+    return json_response(TODO_ROWS.to_dict(row), {"ETag": writes.row_etag(row.version)})
 
-@app.get("/api/calendars", response_model=List[Calendar])
-def get_calendars(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return db.query(CalendarModel).filter(CalendarModel.user_id == current_user.username).all()
+@app.put("/api/todos/{todo_id}", response_model=Todo)
+@session_endpoint
+def update_todo(
+    todo_id: str,
+    todo_update: TodoUpdate,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    row = writes.update_todo(
+        db, current_user.username, todo_id, todo_update.dict(exclude_unset=True),
+        TODO_ROWS.columns, writes.if_match_versions(if_match)
+    )
+    if row.is_recurring:
+        # Raising leaves the transaction uncommitted, so the update is rolled back
+        validate_recurrence(row)
+    db.commit()
+    return json_response(TODO_ROWS.to_dict(row), {"ETag": writes.row_etag(row.version)})
 
-@app.post("/api/calendars", response_model=Calendar)
-def create_calendar(calendar: CalendarCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    # Generate ID using timestamp
-    calendar_id = str(int(time.time() * 1000))
+@app.delete("/api/todos/{todo_id}")
+@session_endpoint
+def delete_todo(todo_id: str, if_match: Optional[str] = Header(None), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    writes.delete_todo(db, current_user.username, todo_id, writes.if_match_versions(if_match))
+    db.commit()
+    return {"message": "Todo deleted successfully"}
+
+@app.put("/api/todos/{todo_id}/occurrences/{occurrence_date}", response_model=TodoOccurrence)
+@session_endpoint
+def update_occurrence(todo_id: str, occurrence_date: date, occurrence_update: OccurrenceUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Edit or complete a single occurrence of a recurring todo"""
+    todo = get_series_for_occurrence(db, todo_id, occurrence_date, current_user.username)
+    
+    override = db.query(OccurrenceOverrideModel).filter(
+        OccurrenceOverrideModel.todo_id == todo_id,
+        OccurrenceOverrideModel.occurrence_date == occurrence_date
+    ).first()
+    if not override:
+        override = OccurrenceOverrideModel(
+            todo_id=todo_id,
+            occurrence_date=occurrence_date,
+            user_id=current_user.username,
+            is_completed=False
+        )
+        db.add(override)
     
+    update_data = occurrence_update.dict(exclude_unset=True)
+    start_date = update_data.pop("start_date", None)
+    end_date = update_data.pop("end_date", None)
+    for field, value in update_data.items():
+        if field == "is_completed" and value and not override.is_completed:
+            setattr(override, "completed_at", datetime.utcnow())
+        elif field == "is_completed" and not value:
+            setattr(override, "completed_at", None)
+        
+        setattr(override, field, value)
+    
+    if start_date or end_date:
+        # Moving only the start keeps the occurrence's length; resizing only the end keeps its start
+        current = build_occurrence(todo, occurrence_date, override)
+        new_start = start_date or current.start_date
+        if end_date is None and current.end_date:
+            end_date = new_start + (current.end_date - current.start_date)
+        if end_date and end_date < new_start:
+            raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+        override.start_date = new_start
+        override.end_date = end_date
+    
+    # Overrides change what the series expands to, so it counts as changed for sync
+    todo.updated_at = datetime.utcnow()
+    db.commit()
+    return build_occurrence(todo, occurrence_date, override)
+
+@app.delete("/api/todos/{todo_id}/occurrences/{occurrence_date}")
+@session_endpoint
+def delete_occurrence(todo_id: str, occurrence_date: date, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Skip a single occurrence of a recurring todo by adding it to the rule's exceptions"""
+    todo = get_series_for_occurrence(db, todo_id, occurrence_date, current_user.username)
+    
+    todo.recurring_exceptions = format_exceptions(parse_exceptions(todo.recurring_exceptions) + [occurrence_date])
+    overrides = db.query(OccurrenceOverrideModel).filter(
+        OccurrenceOverrideModel.todo_id == todo_id,
+        OccurrenceOverrideModel.occurrence_date == occurrence_date
+    )
+    analytics.forget_occurrences(db, overrides)
+    overrides.delete()
+    db.commit()
+    return {"message": "Occurrence deleted successfully"}
+
+# ================= CALENDAR ENDPOINTS =================
+
+def add_calendar(db: Session, username: str, calendar: CalendarCreate):
     # Check if this will be the first calendar for this user (make it default)
-    is_first_calendar = db.query(CalendarModel).filter(CalendarModel.user_id == current_user.username).count() == 0
+    is_first_calendar = db.query(CalendarModel).filter(CalendarModel.user_id == username).count() == 0
     
     db_calendar = CalendarModel(
-        id=calendar_id,
-        user_id=current_user.username,
+        id=generate_id(),
+        user_id=username,
         name=calendar.name,
         color=calendar.color,
         is_default=is_first_calendar or calendar.is_default
     )
     
     db.add(db_calendar)
-    db.commit()
-    db.refresh(db_calendar)
     return db_calendar
 
-@app.put("/api/calendars/{calendar_id}", response_model=Calendar)
-def update_calendar(calendar_id: str, calendar_update: CalendarUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    calendar = db.query(CalendarModel).filter(CalendarModel.id == calendar_id, CalendarModel.user_id == current_user.username).first()
+def apply_calendar_update(db: Session, username: str, calendar_id: str, calendar_update: CalendarUpdate):
+    calendar = db.query(CalendarModel).filter(CalendarModel.id == calendar_id, CalendarModel.user_id == username).first()
     if not calendar:
         raise HTTPException(status_code=404, detail="Calendar not found")
     
     for field, value in calendar_update.dict(exclude_unset=True).items():
         setattr(calendar, field, value)
-    
-    db.commit()
-    db.refresh(calendar)
     return calendar
 
-@app.delete("/api/calendars/{calendar_id}")
-def delete_calendar(calendar_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    calendar = db.query(CalendarModel).filter(CalendarModel.id == calendar_id, CalendarModel.user_id == current_user.username).first()
+def remove_calendar(db: Session, username: str, calendar_id: str):
+    calendar = db.query(CalendarModel).filter(CalendarModel.id == calendar_id, CalendarModel.user_id == username).first()
     if not calendar:
         raise HTTPException(status_code=404, detail="Calendar not found")
     
-    # Delete associated todos (only for this user)
-    db.query(TodoModel).filter(TodoModel.calendar_id == calendar_id, TodoModel.user_id == current_user.username).delete()
-    
+    # Delete associated todos and their occurrence overrides (only for this user)
+    jobs.delete_calendar_todos(db, username, calendar_id)
     db.delete(calendar)
+
+@app.get("/api/calendars", response_model=List[Calendar])
+@session_endpoint
+def get_calendars(
+    request: Request,
+    list_format: Optional[str] = LIST_FORMAT,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    etag = collection_etag(request, db, current_user.username, "calendar")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    rows = CALENDAR_ROWS.query(db.query(CalendarModel).filter(CalendarModel.user_id == current_user.username))
+    return negotiated_response(request, serialize_rows(CALENDAR_ROWS, rows, list_format), cache_headers(etag))
+
+@app.post("/api/calendars", response_model=Calendar)
+@session_endpoint
+def create_calendar(calendar: CalendarCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    db_calendar = add_calendar(db, current_user.username, calendar)
+    db.commit()
+    db.refresh(db_calendar)
+    return db_calendar
+
+@app.put("/api/calendars/{calendar_id}", response_model=Calendar)
+@session_endpoint
+def update_calendar(
+    calendar_id: str,
+    calendar_update: CalendarUpdate,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    row = writes.update_row(
+        db, current_user.username, CalendarModel, calendar_id, calendar_update.dict(exclude_unset=True),
+        CALENDAR_ROWS.columns, writes.if_match_versions(if_match), name="Calendar"
+    )
     db.commit()
-    return {"message": "Calendar and associated todos deleted successfully"}
+    return json_response(CALENDAR_ROWS.to_dict(row), {"ETag": writes.row_etag(row.version)})
 
-# ================= TEMPLATE ENDPOINTS =================
+@app.delete("/api/calendars/{calendar_id}", response_model=Job, status_code=202)
+@session_endpoint
+def delete_calendar(
+    calendar_id: str,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Delete the calendar and its todos in a background job, returned for polling.
 
-@app.get("/api/templates", response_model=List[Template])
-def get_templates(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return db.query(TemplateModel).filter(TemplateModel.user_id == current_user.username).all()
+    The calendar row goes with the job's last chunk of todos, so a job that fails part way
+    leaves the calendar in place to be deleted again. In /api/batch the calendar and its
+    todos are deleted within the batch's transaction.
+    """
+    writes.check_row(db, current_user.username, CalendarModel, calendar_id, writes.if_match_versions(if_match), name="Calendar")
+    todo_count = db.query(TodoModel).filter(
+        TodoModel.calendar_id == calendar_id,
+        TodoModel.user_id == current_user.username
+    ).count()
+    job = jobs.enqueue(db, current_user.username, "calendar_delete", {"calendar_id": calendar_id}, total=todo_count)
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return job
 
-@app.post("/api/templates", response_model=Template)
-def create_template(template: TemplateCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    template_id = str(int(time.time() * 1000))
-    
+# ================= TEMPLATE ENDPOINTS =================
+
+def add_template(db: Session, username: str, template: TemplateCreate):
     db_template = TemplateModel(
-        id=template_id,
-        user_id=current_user.username,
+        id=generate_id(),
+        user_id=username,
         name=template.name,
         title=template.title,
         description=template.description,
@@ -224,104 +684,353 @@ def create_template(template: TemplateCreate, db: Session = Depends(get_db), cur
     )
     
     db.add(db_template)
-    db.commit()
-    db.refresh(db_template)
     return db_template
 
-@app.delete("/api/templates/{template_id}")
-def delete_template(template_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    template = db.query(TemplateModel).filter(TemplateModel.id == template_id, TemplateModel.user_id == current_user.username).first()
+def remove_template(db: Session, username: str, template_id: str):
+    template = db.query(TemplateModel).filter(TemplateModel.id == template_id, TemplateModel.user_id == username).first()
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
     
     db.delete(template)
+
+@app.get("/api/templates", response_model=List[Template])
+@session_endpoint
+def get_templates(
+    request: Request,
+    list_format: Optional[str] = LIST_FORMAT,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    etag = collection_etag(request, db, current_user.username, "template")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    rows = TEMPLATE_ROWS.query(db.query(TemplateModel).filter(TemplateModel.user_id == current_user.username))
+    return negotiated_response(request, serialize_rows(TEMPLATE_ROWS, rows, list_format), cache_headers(etag))
+
+@app.get("/api/templates/search", response_model=List[TemplateSearchResult])
+@session_endpoint
+def search_templates(
+    q: str,
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Templates by name, title or description, matched like /api/todos/search"""
+    hits = search.search(db, TemplateModel, TEMPLATE_ROWS.columns, current_user.username, search_terms(q), limit)
+    return json_response([dict(TEMPLATE_ROWS.to_dict(row), highlights=highlights) for row, highlights in hits])
+
+@app.post("/api/templates", response_model=Template)
+@session_endpoint
+def create_template(template: TemplateCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    db_template = add_template(db, current_user.username, template)
+    db.commit()
+    db.refresh(db_template)
+    return db_template
+
+@app.delete("/api/templates/{template_id}")
+@session_endpoint
+def delete_template(template_id: str, if_match: Optional[str] = Header(None), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    writes.delete_row(db, current_user.username, TemplateModel, template_id, versions=writes.if_match_versions(if_match), name="Template")
     db.commit()
     return {"message": "Template deleted successfully"}
 
-# ================= DATA MIGRATION ENDPOINT =================
+# ================= BOOTSTRAP ENDPOINT =================
 
-@app.post("/api/migrate")
-def migrate_data(data: MigrationData, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    """Endpoint to migrate data from localStorage to database"""
-    try:
-        # Only clear existing data if there's actually data to migrate
-        has_data_to_migrate = (
-            len(data.todos) > 0 or 
-            len(data.calendars) > 0 or 
-            len(data.templates) > 0
+@app.get("/api/bootstrap", response_model=BootstrapResponse)
+@session_endpoint
+def bootstrap(
+    request: Request,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    list_format: Optional[str] = LIST_FORMAT,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Todos, calendars and templates in one response, read from a single snapshot.
+
+    `from`/`to` window the todos as on GET /api/todos, keeping those without a start date;
+    when both are given the window's expanded recurring occurrences are included too. `version` is a token for GET /api/sync.
+    `format=columnar` and MessagePack apply to each of the lists, as on the list endpoints.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    
+    begin_snapshot(db)
+    version = current_version(db, current_user.username)
+    etag = f'W/"bootstrap-{version}-{etag_variant(request, current_user.username)}"'
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    username = current_user.username
+    todos = filter_todo_window(db.query(TodoModel).filter(TodoModel.user_id == username), date_from, date_to, include_undated=True)
+    occurrences = None
+    if date_from and date_to:
+        occurrences = jsonable_encoder(list_occurrences(db, username, date_from, date_to))
+        if list_format == "columnar":
+            occurrences = dicts_to_columns(occurrences, list(TodoOccurrence.__fields__))
+    return negotiated_response(request, {
+        "version": version,
+        "todos": serialize_rows(TODO_ROWS, TODO_ROWS.query(todos.order_by(TodoModel.created_at, TodoModel.id)), list_format),
+        "calendars": serialize_rows(CALENDAR_ROWS, CALENDAR_ROWS.query(db.query(CalendarModel).filter(CalendarModel.user_id == username)), list_format),
+        "templates": serialize_rows(TEMPLATE_ROWS, TEMPLATE_ROWS.query(db.query(TemplateModel).filter(TemplateModel.user_id == username)), list_format),
+        "occurrences": occurrences
+    }, cache_headers(etag))
+
+# ================= SYNC ENDPOINT =================
+
+@app.get("/api/sync", response_model=SyncResponse)
+@session_endpoint
+def sync_changes(since: Optional[int] = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Rows changed and ids deleted since the `version` returned by a previous sync (everything if omitted).
+
+    When the tombstones a delta from `since` needs were pruned, everything is returned with
+    `reset` set, and the client replaces its data rather than merging.
+    """
+    # Reading the version first and capping every query at it keeps the response consistent
+    # with the token even if writes land meanwhile; those are picked up by the next sync
+    version = current_version(db, current_user.username)
+    response = SyncResponse(version=version)
+    if since and since < pruned_version(db, current_user.username):
+        since = None
+        response.reset = True
+    
+    for model, key, schema in ((TodoModel, "todos", Todo), (CalendarModel, "calendars", Calendar), (TemplateModel, "templates", Template)):
+        query = db.query(model).filter(model.user_id == current_user.username, model.version <= version)
+        if since:
+            query = query.filter(model.version > since)
+        setattr(response, key, [schema.from_orm(row) for row in query])
+    
+    if since:
+        tombstones = db.query(TombstoneModel).filter(
+            TombstoneModel.user_id == current_user.username,
+            TombstoneModel.version > since,
+            TombstoneModel.version <= version
         )
-        
-        if not has_data_to_migrate:
-            return {"message": "No data to migrate", "migrated": {
-                "todos": 0,
-                "calendars": 0,
-                "templates": 0
-            }}
-        
-        # Clear existing data for this user only (only if we have data to replace it)
-        db.query(TodoModel).filter(TodoModel.user_id == current_user.username).delete()
-        db.query(CalendarModel).filter(CalendarModel.user_id == current_user.username).delete()
-        db.query(TemplateModel).filter(TemplateModel.user_id == current_user.username).delete()
-        
-        # Migrate calendars
-        for cal_data in data.calendars:
-            calendar = CalendarModel(
-                id=cal_data.get('id', str(int(time.time() * 1000))),
-                user_id=current_user.username,
-                name=cal_data['name'],
-                color=cal_data['color'],
-                is_default=cal_data.get('isDefault', False)
-            )
-            db.add(calendar)
-        
-        # Migrate templates
-        for temp_data in data.templates:
-            template = TemplateModel(
-                id=temp_data.get('id', str(int(time.time() * 1000))),
-                user_id=current_user.username,
-                name=temp_data['name'],
-                title=temp_data['title'],
-                description=temp_data.get('description'),
-                start_date=temp_data.get('startDate'),
-                end_date=temp_data.get('endDate'),
-                estimated_time=temp_data.get('estimatedTime'),
-                priority=temp_data.get('priority', 'medium'),
-                calendar_id=temp_data.get('calendarId')
-            )
-            db.add(template)
-        
-        # Migrate todos
-        for todo_data in data.todos:
-            # Convert frontend field names to backend field names
-            todo = TodoModel(
-                id=todo_data['id'],
-                user_id=current_user.username,
-                title=todo_data['title'],
-                description=todo_data.get('description'),
-                start_date=todo_data.get('startDate'),
-                end_date=todo_data.get('endDate'),
-                estimated_time=todo_data.get('estimatedTime'),
-                priority=todo_data.get('priority', 'medium'),
-                calendar_id=todo_data.get('calendarId'),
-                is_completed=todo_data.get('isCompleted', False),
-                created_at=datetime.fromisoformat(todo_data['createdAt'].replace('Z', '+00:00')) if todo_data.get('createdAt') else datetime.utcnow(),
-                completed_at=datetime.fromisoformat(todo_data['completedAt'].replace('Z', '+00:00')) if todo_data.get('completedAt') else None,
-                is_recurring=todo_data.get('isRecurring', False),
-                recurring_pattern=todo_data.get('recurringPattern'),
-                recurring_count=todo_data.get('recurringCount')
-            )
-            db.add(todo)
-        
-        db.commit()
-        return {"message": "Data migrated successfully", "migrated": {
-            "todos": len(data.todos),
-            "calendars": len(data.calendars),
-            "templates": len(data.templates)
-        }}
-        
-    except Exception as e:
+        deleted = {"todos": [], "calendars": [], "templates": []}
+        for tombstone in tombstones:
+            deleted[tombstone.entity + "s"].append(tombstone.entity_id)
+        response.deleted = deleted
+    return response
+
+# ================= CHANGE FEED =================
+
+class StreamTicket(BaseModel):
+    ticket: str
+    expires_in: int
+
+@app.post("/api/stream/ticket", response_model=StreamTicket)
+async def stream_ticket(current_user: User = Depends(get_current_user)):
+    """A short-lived ticket for ?ticket= on /api/stream, as EventSource can't send the token"""
+    return StreamTicket(ticket=create_stream_ticket(current_user.username), expires_in=settings.STREAM_TICKET_SECONDS)
+
+@app.get("/api/stream")
+async def stream_changes(
+    request: Request,
+    since: Optional[int] = None,
+    current_user: User = Depends(get_stream_user)
+):
+    """Server-Sent Events carrying each commit's changes to the user's todos, calendars and templates.
+
+    A `change` event's data is {"version", "changes": [{"entity", "id", "op", "version"}]},
+    with op "upsert" or "delete". A `resync` event means changes were missed (the client
+    reconnected from an older version, fell behind, or a commit changed too many rows
+    to list): fetch /api/sync?since=<last version applied>. Pass the version the client's
+    data reflects as `since`. EventSource, which can't send the token, passes a ticket
+    from POST /api/stream/ticket as ?ticket= instead; once it expires, reconnects get 401.
+    """
+    # EventSource reconnects to the same URL, so a Last-Event-ID is newer than ?since=
+    if request.headers.get("last-event-id", "").isdigit():
+        since = int(request.headers["last-event-id"])
+    broker = changefeed.get_broker()
+    subscription = broker.subscribe(current_user.username)
+    try:
+        # Read after subscribing, so no commit can fall between the two
+        version = await run_in_session(current_version, current_user.username)
+    except BaseException:
+        broker.unsubscribe(current_user.username, subscription)
+        raise
+    return StreamingResponse(
+        changefeed.event_stream(current_user.username, subscription, version, since),
+        media_type="text/event-stream",
+        # Keep reverse proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ================= ANALYTICS ENDPOINTS =================
+
+ANALYTICS_DEFAULT_DAYS = 30
+
+# Analytics read the per-day rollups, so their cost depends on the range, not the number of todos
+def analytics_range(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to")
+):
+    date_to = date_to or datetime.utcnow().date()
+    date_from = date_from or date_to - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    return date_from, date_to
+
+@app.get("/api/analytics/summary", response_model=AnalyticsSummary)
+@session_endpoint
+def get_analytics_summary(date_range=Depends(analytics_range), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Todos created and completed per day in [from, to] (default: the last 30 days)"""
+    return analytics.summary(db, current_user.username, *date_range)
+
+@app.get("/api/analytics/calendars", response_model=List[CalendarActivity])
+@session_endpoint
+def get_analytics_calendars(date_range=Depends(analytics_range), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return analytics.by_calendar(db, current_user.username, *date_range)
+
+@app.get("/api/analytics/activity", response_model=ActivityPattern)
+@session_endpoint
+def get_analytics_activity(date_range=Depends(analytics_range), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return analytics.activity(db, current_user.username, *date_range)
+
+@app.get("/api/analytics/time", response_model=TimeEstimates)
+@session_endpoint
+def get_analytics_time(date_range=Depends(analytics_range), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return analytics.time_estimates(db, current_user.username, *date_range)
+
+# ================= BATCH ENDPOINT =================
+
+MAX_BATCH_OPERATIONS = 500
+
+# (resource, op) -> (payload schema, handler, response schema)
+BATCH_HANDLERS = {
+    ("todo", "create"): (TodoCreate, lambda db, username, item_id, data: add_todo(db, username, data), Todo),
+    ("todo", "update"): (TodoUpdate, apply_todo_update, Todo),
+    ("todo", "delete"): (None, lambda db, username, item_id, data: remove_todo(db, username, item_id), None),
+    ("calendar", "create"): (CalendarCreate, lambda db, username, item_id, data: add_calendar(db, username, data), Calendar),
+    ("calendar", "update"): (CalendarUpdate, apply_calendar_update, Calendar),
+    ("calendar", "delete"): (None, lambda db, username, item_id, data: remove_calendar(db, username, item_id), None),
+    ("template", "create"): (TemplateCreate, lambda db, username, item_id, data: add_template(db, username, data), Template),
+    ("template", "delete"): (None, lambda db, username, item_id, data: remove_template(db, username, item_id), None),
+}
+
+@app.post("/api/batch", response_model=BatchResponse)
+@session_endpoint
+def run_batch(batch: BatchRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Apply a list of create/update/delete operations in one all-or-nothing transaction"""
+    if len(batch.operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {MAX_BATCH_OPERATIONS} operations")
+    
+    results = []
+    try:
+        for index, operation in enumerate(batch.operations):
+            handler = BATCH_HANDLERS.get((operation.resource, operation.op))
+            if not handler:
+                raise HTTPException(status_code=400, detail=f"Unsupported operation: {operation.op} {operation.resource}")
+            payload_schema, apply, response_schema = handler
+            if operation.op != "create" and not operation.id:
+                raise HTTPException(status_code=400, detail=f"{operation.op} needs an id")
+            
+            try:
+                data = payload_schema.parse_obj(operation.data) if payload_schema else None
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=e.errors())
+            
+            row = apply(db, current_user.username, operation.id, data)
+            # Flush per operation so later operations see earlier ones and errors point at the right index
+            db.flush()
+            results.append(BatchResult(
+                index=index,
+                id=row.id if row is not None else operation.id,
+                data=response_schema.from_orm(row).dict() if response_schema else None
+            ))
+    except HTTPException as e:
         db.rollback()
+        raise HTTPException(status_code=e.status_code, detail={"index": index, "detail": e.detail})
+    
+    db.commit()
+    return BatchResponse(results=results)
+
+# ================= BACKGROUND JOBS =================
+
+@app.get("/api/jobs/{job_id}", response_model=Job)
+@session_endpoint
+def get_job(job_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Status of a background job started by one of the user's requests"""
+    job = db.query(JobModel).filter(JobModel.id == job_id, JobModel.user_id == current_user.username).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# ================= DATA MIGRATION ENDPOINT =================
+
+@app.post("/api/migrate", response_model=Job, status_code=202)
+@session_endpoint
+def migrate_data(data: MigrationData, response: Response, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Endpoint to migrate data from localStorage to database.
+
+    The upload is validated here and imported by the returned background job. Rows are
+    upserted by id, so existing rows that are not in the upload are kept and a repeated
+    upload is harmless. Any invalid record rejects the whole upload.
+    """
+    records = (
+        [("calendar", item) for item in data.calendars] +
+        [("template", item) for item in data.templates] +
+        [("todo", item) for item in data.todos]
+    )
+    try:
+        for record_type, item in records:
+            importer.record_values(record_type, item)
+            # Fixed now, so a resumed job doesn't give these records fresh ids
+            item["id"] = str(item.get("id") or generate_id())
+    except (ValueError, TypeError, KeyError) as e:
         raise HTTPException(status_code=400, detail=f"Migration failed: {str(e)}")
+    
+    job = jobs.enqueue(db, current_user.username, "migration", data.dict(), total=len(records))
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return job
+
+@app.post("/api/migrate/stream")
+async def migrate_stream(request: Request, import_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Import an NDJSON upload, one `{"type": "todo" | "calendar" | "template", ...}` record per line.
+
+    The body is read as it arrives and committed every few hundred lines, so memory stays
+    flat however large the export. Pass the returned `import_id` when retrying an
+    interrupted upload: lines committed by earlier attempts are skipped. Invalid lines are
+    reported per chunk and don't stop the import.
+    """
+    username = current_user.username
+    import_id = import_id or generate_id()
+    try:
+        committed = await run_in_session(importer.start_job, username, import_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    chunks = []
+    pending = []
+    line_number = 0
+    complete = True
+    try:
+        async for line in importer.ndjson_lines(request.stream()):
+            line_number += 1
+            if line_number <= committed or not line.strip():
+                continue
+            pending.append((line_number, line))
+            if len(pending) == importer.IMPORT_CHUNK_LINES:
+                chunks.append(await run_in_session(importer.import_chunk, username, import_id, pending))
+                pending = []
+        if pending:
+            chunks.append(await run_in_session(importer.import_chunk, username, import_id, pending))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SQLAlchemyError as e:
+        # The failed chunk was rolled back; retrying with the same import_id resumes there
+        chunks.append({"first_line": pending[0][0], "last_line": pending[-1][0], "error": str(getattr(e, "orig", None) or e)})
+        complete = False
+    
+    return {
+        "import_id": import_id,
+        "complete": complete,
+        "lines": line_number,
+        "skipped_lines": min(committed, line_number),
+        "chunks": chunks
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,219 @@
+import logging
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from threading import Lock
+from sqlalchemy import event
+from config import settings
+
+# Per-route request metrics and SQL accounting, rendered in the Prometheus text format.
+#
+# MetricsMiddleware times each request and gives it a RequestStats through a context
+# variable; the engine hooks add every statement's count and duration to it. Context
+# variables follow the request into the threadpool, so sync endpoints and streamed
+# bodies are counted too. Figures are per process.
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SLOW_QUERY_LOG_CHARS = 500
+UNMATCHED_ROUTE = "unmatched"  # 404s, so unknown paths can't multiply the series
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+_current_request = ContextVar("current_request", default=None)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+class Registry:
+    def __init__(self):
+        # Request figures are only touched on the event loop; query totals come from threads
+        self.in_flight = 0
+        self.writes_in_flight = 0  # Holding a slot of MAX_CONCURRENT_WRITES
+        self.shed = Counter()  # Requests turned away by admission control, by reason
+        self.durations = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # (method, route)
+        self.query_counts = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self.db_seconds = defaultdict(float)
+        self.responses = Counter()  # (method, route, status)
+        self.lock = Lock()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.slow_queries = 0
+        self.caches = {}  # Metric prefix -> a cache with stats(), e.g. auth_principal
+
+    def track_cache(self, name, cache):
+        self.caches[name] = cache
+
+    def observe_request(self, method, route, status, seconds, stats):
+        key = (method, route)
+        self.durations[key].observe(seconds)
+        self.query_counts[key].observe(stats.queries)
+        self.db_seconds[key] += stats.db_seconds
+        self.responses[(method, route, str(status))] += 1
+
+    def observe_shed(self, reason):
+        self.shed[reason] += 1
+
+    def observe_query(self, seconds):
+        with self.lock:
+            self.queries += 1
+            self.query_seconds += seconds
+        stats = _current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += seconds
+
+registry = Registry()
+
+# ================= SQL ACCOUNTING =================
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_started"].pop()
+    registry.observe_query(seconds)
+    if settings.SLOW_QUERY_MS and seconds * 1000 >= settings.SLOW_QUERY_MS:
+        with registry.lock:
+            registry.slow_queries += 1
+        # Parameters are left out: they can hold password hashes and user content
+        logger.warning("Slow query (%.1f ms): %s", seconds * 1000, " ".join(statement.split())[:SLOW_QUERY_LOG_CHARS])
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+# ================= REQUESTS =================
+
+class MetricsMiddleware:
+    """Plain ASGI middleware, so streamed responses are timed until their last chunk"""
+
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = {}
+
+    def route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if endpoint not in self.route_paths:
+            router = scope["app"].router
+            self.route_paths = {route.endpoint: route.path for route in router.routes if hasattr(route, "endpoint")}
+        return self.route_paths.get(endpoint, UNMATCHED_ROUTE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        registry.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - started
+            registry.in_flight -= 1
+            _current_request.reset(token)
+            registry.observe_request(scope["method"], self.route(scope), status, seconds, stats)
+
+# ================= PROMETHEUS =================
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def _histogram_lines(name, histograms, label_names):
+    lines = []
+    for key, histogram in sorted(histograms.items()):
+        labels = dict(zip(label_names, key))
+        cumulative = 0
+        for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+def render() -> str:
+    lines = []
+
+    def header(name, kind, description):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    header("http_requests_in_flight", "gauge", "Requests being handled")
+    lines.append(f"http_requests_in_flight {registry.in_flight}")
+
+    header("http_writes_in_flight", "gauge", "Authenticated writes holding a slot of MAX_CONCURRENT_WRITES")
+    lines.append(f"http_writes_in_flight {registry.writes_in_flight}")
+
+    header("http_requests_shed_total", "counter", "Requests turned away before running: read_rate, write_rate, write_capacity, password_capacity")
+    for reason, count in sorted(registry.shed.items()):
+        lines.append(f"http_requests_shed_total{_labels(reason=reason)} {count}")
+
+    header("http_request_duration_seconds", "histogram", "Time from request to the last byte of the response")
+    lines += _histogram_lines("http_request_duration_seconds", registry.durations, ("method", "route"))
+
+    header("http_responses_total", "counter", "Responses by status")
+    for (method, route, status), count in sorted(registry.responses.items()):
+        lines.append(f"http_responses_total{_labels(method=method, route=route, status=status)} {count}")
+
+    header("http_request_db_queries", "histogram", "SQL statements issued per request")
+    lines += _histogram_lines("http_request_db_queries", registry.query_counts, ("method", "route"))
+
+    header("http_request_db_seconds_total", "counter", "Time spent executing SQL statements for requests")
+    for (method, route), seconds in sorted(registry.db_seconds.items()):
+        lines.append(f"http_request_db_seconds_total{_labels(method=method, route=route)} {seconds}")
+
+    with registry.lock:
+        queries, query_seconds, slow_queries = registry.queries, registry.query_seconds, registry.slow_queries
+    header("db_queries_total", "counter", "SQL statements executed, inside requests or not")
+    lines.append(f"db_queries_total {queries}")
+    header("db_query_seconds_total", "counter", "Time spent executing SQL statements")
+    lines.append(f"db_query_seconds_total {query_seconds}")
+    header("db_slow_queries_total", "counter", "SQL statements slower than SLOW_QUERY_MS")
+    lines.append(f"db_slow_queries_total {slow_queries}")
+
+    for name, cache in sorted(registry.caches.items()):
+        stats = cache.stats()
+        header(f"{name}_cache_hits_total", "counter", "Lookups answered from the cache")
+        lines.append(f"{name}_cache_hits_total {stats['hits']}")
+        header(f"{name}_cache_misses_total", "counter", "Lookups not in the cache, or expired")
+        lines.append(f"{name}_cache_misses_total {stats['misses']}")
+        header(f"{name}_cache_entries", "gauge", "Entries in the cache")
+        lines.append(f"{name}_cache_entries {stats['size']}")
+    return "\n".join(lines) + "\n"
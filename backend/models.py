@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, Integer, DateTime, Text, ForeignKey
+from sqlalchemy import Column, String, Boolean, Integer, Date, DateTime, Text, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -19,8 +19,8 @@ class Todo(Base):
     user_id = Column(String, nullable=False, index=True)  # User isolation
     title = Column(String, nullable=False)
     description = Column(Text, nullable=True)
-    start_date = Column(String, nullable=True)  # Store as ISO date string
-    end_date = Column(String, nullable=True)    # Store as ISO date string
+    start_date = Column(Date, nullable=True)
+    end_date = Column(Date, nullable=True)
     estimated_time = Column(Integer, nullable=True)  # Minutes
     priority = Column(String, default="medium")  # low, medium, high
     calendar_id = Column(String, nullable=True)
@@ -30,6 +30,41 @@ class Todo(Base):
     is_recurring = Column(Boolean, default=False)
     recurring_pattern = Column(String, nullable=True)  # daily, weekly, monthly
     recurring_count = Column(Integer, nullable=True)
+    recurring_until = Column(Date, nullable=True)
+    recurring_exceptions = Column(Text, nullable=True)  # Comma-separated ISO dates skipped by the rule
+    version = Column(Integer, nullable=False, default=0)  # User's sync version at the last change
+    updated_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Serves date-window queries: user_id equality, then a range over the dates
+        Index("ix_todos_user_dates", "user_id", "start_date", "end_date"),
+        # Serves keyset pagination over (created_at, id)
+        Index("ix_todos_user_created", "user_id", "created_at", "id"),
+        Index("ix_todos_user_version", "user_id", "version"),
+    )
+
+class OccurrenceOverride(Base):
+    __tablename__ = "occurrence_overrides"
+    
+    # Per-occurrence edits of a recurring todo; unset fields fall back to the series
+    todo_id = Column(String, primary_key=True)
+    occurrence_date = Column(Date, primary_key=True)
+    user_id = Column(String, nullable=False, index=True)  # User isolation
+    title = Column(String, nullable=True)
+    description = Column(Text, nullable=True)
+    estimated_time = Column(Integer, nullable=True)
+    priority = Column(String, nullable=True)
+    is_completed = Column(Boolean, default=False)
+    completed_at = Column(DateTime, nullable=True)
+    # A moved occurrence's dates; both are set, or neither (it stays on occurrence_date)
+    start_date = Column(Date, nullable=True)
+    end_date = Column(Date, nullable=True)
+    calendar_id = Column(String, nullable=True)
+
+    __table_args__ = (
+        # Serves finding occurrences moved into a date window
+        Index("ix_occurrence_overrides_user_dates", "user_id", "start_date", "end_date"),
+    )
 
 class Calendar(Base):
     __tablename__ = "calendars"
@@ -39,6 +74,12 @@ class Calendar(Base):
     name = Column(String, nullable=False)
     color = Column(String, nullable=False)
     is_default = Column(Boolean, default=False)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_calendars_user_version", "user_id", "version"),
+    )
 
 class Template(Base):
     __tablename__ = "templates"
@@ -52,4 +93,100 @@ class Template(Base):
     end_date = Column(String, nullable=True)
     estimated_time = Column(Integer, nullable=True)
     priority = Column(String, default="medium")
-    calendar_id = Column(String, nullable=True) 
\ No newline at end of file
+    calendar_id = Column(String, nullable=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_templates_user_version", "user_id", "version"),
+    )
+
+class SyncVersion(Base):
+    __tablename__ = "sync_versions"
+    
+    # Per-user change counter; every write stamps the rows it touches with the next value
+    user_id = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    # Counter value at each collection's last change, used as its ETag
+    todos_version = Column(Integer, nullable=False, default=0)
+    calendars_version = Column(Integer, nullable=False, default=0)
+    templates_version = Column(Integer, nullable=False, default=0)
+    # Newest version whose tombstones were pruned; syncs from before it can't be deltas
+    pruned_version = Column(Integer, nullable=False, default=0)
+
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, nullable=False)
+    entity = Column(String, nullable=False)  # todo, calendar, template
+    entity_id = Column(String, nullable=False)
+    version = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_tombstones_user_version", "user_id", "version"),
+        # Serves pruning by age
+        Index("ix_tombstones_deleted_at", "deleted_at"),
+    )
+
+class DailyRollup(Base):
+    __tablename__ = "daily_rollups"
+    
+    # Per-user todo activity by UTC day and hour, kept current on every write.
+    # Creations count in the bucket of created_at, completions in that of completed_at.
+    user_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    hour = Column(Integer, primary_key=True)
+    calendar_id = Column(String, primary_key=True, default="")  # "" for todos without a calendar
+    created_count = Column(Integer, nullable=False, default=0)
+    completed_count = Column(Integer, nullable=False, default=0)
+    estimated_count = Column(Integer, nullable=False, default=0)  # Completed todos that had an estimate
+    estimated_minutes = Column(Integer, nullable=False, default=0)
+    lead_time_minutes = Column(Integer, nullable=False, default=0)  # Creation to completion, summed
+
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+    
+    # Progress of a streamed import, so a retried upload skips the lines already committed
+    id = Column(String, primary_key=True)
+    user_id = Column(String, nullable=False, index=True)
+    lines_committed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class Job(Base):
+    __tablename__ = "jobs"
+    
+    # Work run by the background pool; the row is the queue entry, the progress report
+    # and the resume point after a restart
+    id = Column(String, primary_key=True)
+    user_id = Column(String, nullable=False, index=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued", index=True)  # queued, running, succeeded, failed
+    payload = Column(Text)  # JSON
+    progress = Column(Integer, nullable=False, default=0)
+    total = Column(Integer)
+    result = Column(Text)  # JSON
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)  # Last progress of the running worker; stale means it died
+    finished_at = Column(DateTime)
+
+class AccountSetup(Base):
+    __tablename__ = "account_setup"
+    
+    # Committed with a new user's default data, so it is created exactly once, whatever the
+    # user has added by the time the setup job runs
+    user_id = Column(String, primary_key=True)
+    completed_at = Column(DateTime, default=datetime.utcnow)
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    
+    # Single row: the schema fingerprint the tables were last brought up to, so starting
+    # workers can skip the DDL and migrations when nothing changed
+    id = Column(Integer, primary_key=True)
+    version = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
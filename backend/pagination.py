@@ -0,0 +1,39 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from serialization import dumps
+
+# Keyset cursors point just past the last row of a page, ordered by (created_at, id).
+# They are opaque to clients: base64url-encoded JSON of that pair.
+
+def encode_cursor(created_at: datetime, row_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), str(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def stream_json_array(rows, serializer, close=None, rows_per_chunk=100):
+    """Yield a JSON array a few serialized rows at a time so the body is never held in memory"""
+    try:
+        yield b"["
+        chunk = []
+        first = True
+        for row in rows:
+            chunk.append(dumps(serializer.to_dict(row)))
+            if len(chunk) == rows_per_chunk:
+                yield (b"" if first else b",") + b",".join(chunk)
+                first = False
+                chunk = []
+        if chunk:
+            yield (b"" if first else b",") + b",".join(chunk)
+        yield b"]"
+    finally:
+        if close:
+            close()
@@ -0,0 +1,76 @@
+import math
+import time
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, Request, status
+from cache import TTLCache
+from config import settings
+import metrics
+
+# Admission control for authenticated requests: per-user token buckets, one for reads and
+# one for writes, and a global cap on writes in progress so a single client can't take
+# over the threadpool or queue up behind the SQLite writer. Requests are turned away
+# before their handler runs, so a rejected request changed nothing and can be retried
+# after its Retry-After. Everything here runs on the event loop, so needs no locks.
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.updated = time.monotonic()
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        # An idle bucket is full again after burst / rate seconds, so it can be forgotten then
+        self.buckets = TTLCache(maxsize=max_keys, ttl=burst / rate if rate > 0 else 0)
+
+    def acquire(self, key) -> float:
+        """Take a token from key's bucket; returns 0, or the seconds until one is available"""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        bucket = self.buckets.get(key) or TokenBucket(self.burst)
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        self.buckets.set(key, bucket)
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0
+        return (1 - bucket.tokens) / self.rate
+
+read_limiter = RateLimiter(settings.RATE_LIMIT_READS_PER_SECOND, settings.RATE_LIMIT_READ_BURST, settings.RATE_LIMIT_MAX_USERS)
+write_limiter = RateLimiter(settings.RATE_LIMIT_WRITES_PER_SECOND, settings.RATE_LIMIT_WRITE_BURST, settings.RATE_LIMIT_MAX_USERS)
+
+def shed(reason: str, status_code: int, detail: str, retry_after: float):
+    metrics.registry.observe_shed(reason)
+    raise HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+@asynccontextmanager
+async def admit(request: Request, username: str):
+    """Charge the request to the user's budget and, for writes, hold a write slot while it runs"""
+    if request.method in READ_METHODS:
+        wait = read_limiter.acquire(username)
+        if wait:
+            shed("read_rate", status.HTTP_429_TOO_MANY_REQUESTS, "Too many requests, please slow down", wait)
+        yield
+        return
+
+    # Checked first, so a write turned away for capacity doesn't cost the user a token
+    if settings.MAX_CONCURRENT_WRITES and metrics.registry.writes_in_flight >= settings.MAX_CONCURRENT_WRITES:
+        shed("write_capacity", status.HTTP_503_SERVICE_UNAVAILABLE, "Server busy, please retry", 1)
+    wait = write_limiter.acquire(username)
+    if wait:
+        shed("write_rate", status.HTTP_429_TOO_MANY_REQUESTS, "Too many changes, please slow down", wait)
+    metrics.registry.writes_in_flight += 1
+    try:
+        yield
+    finally:
+        metrics.registry.writes_in_flight -= 1
@@ -0,0 +1,72 @@
+import calendar
+from datetime import date, timedelta
+from typing import Iterable, Iterator, List, Optional
+
+# Supported recurrence frequencies
+PATTERNS = ("daily", "weekly", "monthly")
+
+def add_months(start: date, months: int) -> date:
+    """Shift by whole months, clamping the day to the length of the target month"""
+    month_index = start.month - 1 + months
+    year = start.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(start.day, calendar.monthrange(year, month)[1])
+    return date(year, month, day)
+
+def nth_occurrence(start: date, pattern: str, n: int) -> date:
+    if pattern == "daily":
+        return start + timedelta(days=n)
+    if pattern == "weekly":
+        return start + timedelta(weeks=n)
+    if pattern == "monthly":
+        return add_months(start, n)
+    raise ValueError(f"Unknown recurrence pattern: {pattern}")
+
+def _first_index(start: date, pattern: str, earliest: date) -> int:
+    # Lower bound on the index of the first occurrence on or after `earliest`
+    if earliest <= start:
+        return 0
+    if pattern == "daily":
+        return (earliest - start).days
+    if pattern == "weekly":
+        return (earliest - start).days // 7
+    # Clamped month-ends can only fall earlier, so start one month back
+    return max(0, (earliest.year - start.year) * 12 + earliest.month - start.month - 1)
+
+def occurrence_dates(
+    start: date,
+    pattern: str,
+    count: Optional[int] = None,
+    until: Optional[date] = None,
+    exceptions: Iterable[date] = (),
+    window_start: Optional[date] = None,
+    window_end: Optional[date] = None,
+    span: timedelta = timedelta(0),
+) -> Iterator[date]:
+    """Lazily yield start dates of occurrences that overlap [window_start, window_end].
+
+    `span` is the length of one occurrence (end_date - start_date), so an occurrence
+    starting before the window still counts if it runs into it. Occurrences before the
+    window are skipped arithmetically rather than generated.
+    """
+    if count is None and until is None and window_end is None:
+        raise ValueError("An unbounded recurrence needs a window end")
+
+    skipped = set(exceptions)
+    n = _first_index(start, pattern, window_start - span) if window_start else 0
+    while count is None or n < count:
+        current = nth_occurrence(start, pattern, n)
+        if (until and current > until) or (window_end and current > window_end):
+            return
+        if (not window_start or current + span >= window_start) and current not in skipped:
+            yield current
+        n += 1
+
+def parse_exceptions(value: Optional[str]) -> List[date]:
+    """Read the comma-separated ISO dates stored in Todo.recurring_exceptions"""
+    if not value:
+        return []
+    return [date.fromisoformat(item) for item in value.split(",") if item]
+
+def format_exceptions(dates: Iterable[date]) -> Optional[str]:
+    return ",".join(sorted(d.isoformat() for d in set(dates))) or None
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Move every user's rows to the database the current SHARDING settings put them in.
+
+Run from the backend/ directory with the server stopped, after turning sharding on or
+off or changing SHARD_COUNT, with the new settings in the environment:
+
+    SHARDING=hash SHARD_COUNT=32 python reshard.py --dry-run
+    SHARDING=hash SHARD_COUNT=32 python reshard.py
+
+The main database and every shard file in SHARD_DIRECTORY are searched. A user found
+somewhere other than their target has their rows copied there in one transaction and
+then deleted from the source, so an interrupted run can simply be started again.
+
+    python reshard.py --stats
+
+lists each database holding user data with its users and todos.
+"""
+
+import argparse
+import os
+import sys
+from sqlalchemy import func, select, union
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import settings
+from database import engine, init_db, shard_engines, user_data_engines
+from models import Base, Todo as TodoModel
+import shards
+
+COPY_BATCH_ROWS = 1000
+
+# Every table with per-user rows, parents before children
+USER_TABLES = [table for table in Base.metadata.sorted_tables if "user_id" in table.c and table.name != "users"]
+
+def target_engine(username: str):
+    return shard_engines.get(shards.shard_name(username)) if shards.SHARDING else engine
+
+def source_engines() -> list:
+    """The main database and every shard file, whichever setting created them"""
+    return [("main", engine)] + [(name, shard_engines.get(name)) for name in shards.shard_names()]
+
+def same_database(a, b) -> bool:
+    return os.path.realpath(a.url.database) == os.path.realpath(b.url.database)
+
+def users_in(source) -> list:
+    with source.connect() as conn:
+        return sorted(conn.execute(union(*[select(table.c.user_id) for table in USER_TABLES])).scalars())
+
+def copied_columns(table) -> list:
+    # Autoincrement keys (tombstones) are per database, so copies get new ones
+    return [column for column in table.c if not (column.primary_key and column.autoincrement is True)]
+
+def move_user(username: str, source, target) -> int:
+    """Copy the user's rows from source to target, then delete them from source; returns the rows moved"""
+    moved = 0
+    with source.connect() as src, target.begin() as dst:
+        for table in USER_TABLES:
+            # Left by an interrupted run; the source is still complete
+            dst.execute(table.delete().where(table.c.user_id == username))
+            columns = copied_columns(table)
+            result = src.execution_options(stream_results=True).execute(
+                select(*columns).where(table.c.user_id == username)
+            )
+            while True:
+                rows = result.fetchmany(COPY_BATCH_ROWS)
+                if not rows:
+                    break
+                dst.execute(table.insert(), [dict(row._mapping) for row in rows])
+                moved += len(rows)
+    with source.begin() as src:
+        for table in reversed(USER_TABLES):
+            src.execute(table.delete().where(table.c.user_id == username))
+    return moved
+
+def reshard(dry_run: bool):
+    users = moves = rows = 0
+    for name, source in source_engines():
+        for username in users_in(source):
+            users += 1
+            target = target_engine(username)
+            if same_database(source, target):
+                continue
+            moves += 1
+            destination = shards.shard_name(username) if shards.SHARDING else "main"
+            print(f"{username}: {name} -> {destination}")
+            if not dry_run:
+                rows += move_user(username, source, target)
+    action = "Would move" if dry_run else f"Moved {rows} rows of"
+    print(f"{action} {moves} of {users} users (SHARDING={settings.SHARDING})")
+
+def stats():
+    # The admin iterator: every database holding user data under the current settings
+    for name, shard in user_data_engines():
+        with shard.connect() as conn:
+            todos = conn.execute(select(func.count()).select_from(TodoModel.__table__)).scalar()
+        print(f"{name}: {len(users_in(shard))} users, {todos} todos")
+    if shards.SHARDING:
+        print(f"Engine cache: {shard_engines.stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="list the moves without making them")
+    parser.add_argument("--stats", action="store_true", help="list the databases holding user data and exit")
+    args = parser.parse_args()
+
+    init_db()
+    if args.stats:
+        stats()
+    else:
+        reshard(args.dry_run)
+
+if __name__ == "__main__":
+    main()
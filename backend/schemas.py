@@ -1,19 +1,33 @@
-from pydantic import BaseModel
-from typing import Optional, List
-from datetime import datetime
+import json
+from pydantic import BaseModel, validator
+from typing import Dict, Optional, List
+from datetime import date, datetime
+
+def parse_date(value):
+    """Coerce a frontend date value ("YYYY-MM-DD", a full ISO timestamp or "") to a date"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
 
 # Todo schemas
 class TodoBase(BaseModel):
     title: str
     description: Optional[str] = None
-    start_date: Optional[str] = None
-    end_date: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
     estimated_time: Optional[int] = None
     priority: str = "medium"
     calendar_id: Optional[str] = None
     is_recurring: Optional[bool] = False
     recurring_pattern: Optional[str] = None
     recurring_count: Optional[int] = None
+    recurring_until: Optional[date] = None
+
+    _normalize_dates = validator("start_date", "end_date", "recurring_until", pre=True, allow_reuse=True)(parse_date)
 
 class TodoCreate(TodoBase):
     pass
@@ -21,8 +35,8 @@ class TodoCreate(TodoBase):
 class TodoUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
-    start_date: Optional[str] = None
-    end_date: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
     estimated_time: Optional[int] = None
     priority: Optional[str] = None
     calendar_id: Optional[str] = None
@@ -30,16 +44,47 @@ class TodoUpdate(BaseModel):
     is_recurring: Optional[bool] = None
     recurring_pattern: Optional[str] = None
     recurring_count: Optional[int] = None
+    recurring_until: Optional[date] = None
+
+    _normalize_dates = validator("start_date", "end_date", "recurring_until", pre=True, allow_reuse=True)(parse_date)
 
 class Todo(TodoBase):
     id: str
     is_completed: bool
     created_at: datetime
     completed_at: Optional[datetime] = None
+    recurring_exceptions: List[date] = []
+    version: int = 0
+
+    @validator("recurring_exceptions", pre=True)
+    def split_exceptions(cls, value):
+        # Stored as comma-separated ISO dates
+        if isinstance(value, str):
+            return [item for item in value.split(",") if item]
+        return value or []
 
     class Config:
         orm_mode = True
 
+# Search hit: the todo plus its searched columns as HTML with <mark>ed matches
+class TodoSearchResult(Todo):
+    highlights: Dict[str, Optional[str]] = {}
+
+# One expanded occurrence of a recurring todo (plain todos in the window pass through unchanged)
+class TodoOccurrence(Todo):
+    series_id: Optional[str] = None
+    occurrence_date: Optional[date] = None
+
+class OccurrenceUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    estimated_time: Optional[int] = None
+    priority: Optional[str] = None
+    is_completed: Optional[bool] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    calendar_id: Optional[str] = None
+
 # Calendar schemas
 class CalendarBase(BaseModel):
     name: str
@@ -56,6 +101,7 @@ class CalendarUpdate(BaseModel):
 
 class Calendar(CalendarBase):
     id: str
+    version: int = 0
 
     class Config:
         orm_mode = True
@@ -76,12 +122,104 @@ class TemplateCreate(TemplateBase):
 
 class Template(TemplateBase):
     id: str
+    version: int = 0
 
     class Config:
         orm_mode = True
 
+class TemplateSearchResult(Template):
+    highlights: Dict[str, Optional[str]] = {}
+
+# Everything the client loads on startup, in one response
+class BootstrapResponse(BaseModel):
+    version: int  # Token for the first /api/sync
+    todos: List[Todo] = []
+    calendars: List[Calendar] = []
+    templates: List[Template] = []
+    occurrences: Optional[List[TodoOccurrence]] = None  # Only for a windowed bootstrap
+
+# Delta sync schema: rows changed since the client's version, plus ids deleted since then.
+# Clients apply `deleted` before the changed rows, since a deleted id can be reused.
+class SyncResponse(BaseModel):
+    version: int
+    todos: List[Todo] = []
+    calendars: List[Calendar] = []
+    templates: List[Template] = []
+    deleted: Dict[str, List[str]] = {}
+    reset: bool = False  # A full set replacing the client's data, as deletions since `since` were pruned
+
+# Batch schemas
+class BatchOperation(BaseModel):
+    resource: str  # todo, calendar, template
+    op: str  # create, update, delete
+    id: Optional[str] = None  # Required for update and delete
+    data: dict = {}
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+class BatchResult(BaseModel):
+    index: int
+    id: str
+    data: Optional[dict] = None  # The created or updated row; omitted for deletes
+
+class BatchResponse(BaseModel):
+    results: List[BatchResult]
+
+# Analytics schemas; days and hours are UTC, rates are completed / created
+class DailyActivity(BaseModel):
+    day: date
+    created: int
+    completed: int
+
+class AnalyticsSummary(BaseModel):
+    created: int
+    completed: int
+    completion_rate: Optional[float] = None
+    days: List[DailyActivity] = []
+
+class CalendarActivity(BaseModel):
+    calendar_id: Optional[str] = None
+    created: int
+    completed: int
+    completion_rate: Optional[float] = None
+
+class ActivityPattern(BaseModel):
+    completions_by_weekday: List[int]  # Monday first
+    completions_by_hour: List[int]
+
+class TimeEstimates(BaseModel):
+    completed: int
+    completed_with_estimate: int
+    estimated_minutes: int
+    average_estimated_minutes: Optional[float] = None
+    average_lead_time_minutes: Optional[float] = None  # Creation to completion
+
 # Data migration schema
 class MigrationData(BaseModel):
     todos: List[dict] = []
     calendars: List[dict] = []
-    templates: List[dict] = [] 
\ No newline at end of file
+    templates: List[dict] = [] 
+
+# Background job schema; `progress` and `total` count rows or records, depending on the kind
+class Job(BaseModel):
+    id: str
+    kind: str
+    status: str  # queued, running, succeeded, failed
+    progress: int = 0
+    total: Optional[int] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    @validator("result", pre=True)
+    def parse_result(cls, value):
+        # Stored as JSON text
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,185 @@
+import html
+import re
+from sqlalchemy import and_, column, func, literal_column, or_, table, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from models import Todo as TodoModel, Template as TemplateModel
+
+# Full-text search over todos and templates.
+#
+# SQLite: an external-content FTS5 table per model, keyed by the row's rowid and kept in
+# step by triggers, so ORM writes, bulk Core writes and raw SQL are all indexed. The
+# content lives only in the base table. VACUUM may renumber rowids of tables without an
+# INTEGER PRIMARY KEY, so run rebuild_search_index() after one.
+# PostgreSQL: a stored tsvector column generated from the same columns, with a GIN index.
+# Anything else (or SQLite built without FTS5) falls back to LIKE.
+
+# Model -> (index name, searched columns with their rank weights, most important first)
+SEARCH_INDEXES = {
+    TodoModel: ("todos_fts", (("title", 10.0), ("description", 1.0))),
+    TemplateModel: ("templates_fts", (("name", 10.0), ("title", 5.0), ("description", 1.0))),
+}
+POSTGRES_WEIGHTS = ("A", "B", "C", "D")
+SNIPPET_WORDS = 16
+
+# Highlight markers; text is HTML-escaped before they are turned into <mark> tags
+MARK_START = "\x02"
+MARK_END = "\x03"
+
+_backend = None
+
+def setup_search_indexes(engine):
+    """Create the search indexes and their triggers where missing, filling any new index"""
+    if engine.dialect.name == "sqlite":
+        try:
+            with engine.begin() as conn:
+                for model, (index_name, weighted_columns) in SEARCH_INDEXES.items():
+                    _setup_fts5(conn, model.__tablename__, index_name, [name for name, _ in weighted_columns])
+        except OperationalError:
+            # SQLite compiled without FTS5
+            return
+    elif engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            for model, (_, weighted_columns) in SEARCH_INDEXES.items():
+                _setup_tsvector(conn, model.__tablename__, [name for name, _ in weighted_columns])
+
+def _setup_fts5(conn, table: str, index_name: str, columns: list):
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": index_name}
+    ).first()
+    column_list = ", ".join(columns)
+    new_values = ", ".join(f"new.{name}" for name in columns)
+    old_values = ", ".join(f"old.{name}" for name in columns)
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index_name} USING fts5("
+        f"{column_list}, content='{table}', content_rowid='rowid', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {index_name}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {index_name}(rowid, {column_list}) VALUES (new.rowid, {new_values}); END"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {index_name}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {index_name}({index_name}, rowid, {column_list}) VALUES ('delete', old.rowid, {old_values}); END"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {index_name}_update AFTER UPDATE OF {column_list} ON {table} BEGIN "
+        f"INSERT INTO {index_name}({index_name}, rowid, {column_list}) VALUES ('delete', old.rowid, {old_values}); "
+        f"INSERT INTO {index_name}(rowid, {column_list}) VALUES (new.rowid, {new_values}); END"
+    ))
+    if not exists:
+        conn.execute(text(f"INSERT INTO {index_name}({index_name}) VALUES ('rebuild')"))
+
+def _setup_tsvector(conn, table: str, columns: list):
+    vector = " || ".join(
+        f"setweight(to_tsvector('simple', coalesce({name}, '')), '{weight}')"
+        for name, weight in zip(columns, POSTGRES_WEIGHTS)
+    )
+    conn.execute(text(
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS ({vector}) STORED"
+    ))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} USING GIN (search_vector)"))
+
+def rebuild_search_index(engine):
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        for index_name, _ in SEARCH_INDEXES.values():
+            conn.execute(text(f"INSERT INTO {index_name}({index_name}) VALUES ('rebuild')"))
+
+def search_backend(db: Session) -> str:
+    global _backend
+    if _backend is None:
+        dialect = db.get_bind().dialect.name
+        if dialect == "sqlite":
+            has_fts = db.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'todos_fts'")).first()
+            _backend = "fts5" if has_fts else "like"
+        elif dialect == "postgresql":
+            _backend = "postgresql"
+        else:
+            _backend = "like"
+    return _backend
+
+def query_terms(q: str) -> list:
+    # Only word characters reach the query syntax, so user input can't form operators
+    return re.findall(r"\w+", q)
+
+def render_highlight(value):
+    if value is None:
+        return None
+    return html.escape(value).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+def search(db: Session, model, columns: list, username: str, terms: list, limit: int) -> list:
+    """Best matches first, as (row of `columns`, {searched column: highlighted HTML}) pairs.
+
+    Every term must match a word in some searched column, as a prefix.
+    """
+    backend = search_backend(db)
+    if backend == "fts5":
+        return _search_fts5(db, model, columns, username, terms, limit)
+    if backend == "postgresql":
+        return _search_postgresql(db, model, columns, username, terms, limit)
+    return _search_like(db, model, columns, username, terms, limit)
+
+def _search_fts5(db, model, columns, username, terms, limit):
+    index_name, weighted_columns = SEARCH_INDEXES[model]
+    index = literal_column(index_name)
+    # The first column is short, so it is highlighted whole; the rest get a snippet around the match
+    highlights = [func.highlight(index, 0, MARK_START, MARK_END)]
+    highlights += [
+        func.snippet(index, position, MARK_START, MARK_END, "…", SNIPPET_WORDS)
+        for position in range(1, len(weighted_columns))
+    ]
+    match = " ".join(f'"{term}"*' for term in terms)
+    index_table = table(index_name, column("rowid"))
+    rows = db.query(*columns, *highlights).select_from(model).join(
+        index_table, index_table.c.rowid == literal_column(f"{model.__tablename__}.rowid")
+    ).filter(
+        index.op("MATCH")(match),
+        model.user_id == username
+    ).order_by(
+        func.bm25(index, *[weight for _, weight in weighted_columns])
+    ).limit(limit).all()
+    return _with_highlights(rows, len(columns), weighted_columns)
+
+def _search_postgresql(db, model, columns, username, terms, limit):
+    _, weighted_columns = SEARCH_INDEXES[model]
+    vector = literal_column(f"{model.__tablename__}.search_vector")
+    query = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+    options = f"StartSel={MARK_START}, StopSel={MARK_END}"
+    highlights = [func.ts_headline("simple", getattr(model, weighted_columns[0][0]), query, options + ", HighlightAll=true")]
+    highlights += [
+        func.ts_headline("simple", getattr(model, name), query, options + f", MaxWords={SNIPPET_WORDS}, MinWords=5")
+        for name, _ in weighted_columns[1:]
+    ]
+    rows = db.query(*columns, *highlights).filter(
+        vector.op("@@")(query),
+        model.user_id == username
+    ).order_by(func.ts_rank(vector, query).desc()).limit(limit).all()
+    return _with_highlights(rows, len(columns), weighted_columns)
+
+def _search_like(db, model, columns, username, terms, limit):
+    _, weighted_columns = SEARCH_INDEXES[model]
+    searched = [getattr(model, name) for name, _ in weighted_columns]
+    conditions = [or_(*[column.ilike(f"%{term}%") for column in searched]) for term in terms]
+    rows = db.query(*columns, *searched).filter(
+        model.user_id == username, and_(*conditions)
+    ).order_by(getattr(model, "created_at", model.id), model.id).limit(limit).all()
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    marked = [
+        tuple(row[:len(columns)]) + tuple(
+            pattern.sub(lambda found: MARK_START + found.group(0) + MARK_END, value) if value else value
+            for value in row[len(columns):]
+        )
+        for row in rows
+    ]
+    return _with_highlights(marked, len(columns), weighted_columns)
+
+def _with_highlights(rows, width: int, weighted_columns) -> list:
+    names = [name for name, _ in weighted_columns]
+    return [
+        (row[:width], {name: render_highlight(value) for name, value in zip(names, row[width:])})
+        for row in rows
+    ]
@@ -0,0 +1,140 @@
+import gzip
+import json
+from typing import Optional
+from fastapi import Request, Response
+from sqlalchemy import Date, DateTime
+
+try:
+    import orjson
+except ImportError:  # The stdlib encoder below produces the same bytes, only slower
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Clients asking for MessagePack get JSON instead
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # Only gzip is offered then
+    brotli = None
+
+# List endpoints select plain column tuples and encode them straight to JSON, instead of
+# loading ORM objects, validating each through its orm_mode schema and running
+# jsonable_encoder over the result. The bytes match what the response_model path produced.
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    # The settings FastAPI's JSONResponse uses
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def json_response(content, headers: dict = None) -> Response:
+    """Send already JSON-ready content, bypassing response_model validation"""
+    return Response(content=dumps(content), media_type="application/json", headers=headers)
+
+# ================= CONTENT NEGOTIATION =================
+
+# List responses can be sent as MessagePack (Accept: application/msgpack) and compressed
+# (Accept-Encoding: br or gzip); `?format=columnar` is handled by the endpoints, which
+# pass RowSerializer.to_columns output here instead of to_list.
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+COMPRESS_MIN_BYTES = 1024  # Smaller bodies aren't worth the CPU
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Close to gzip's speed at a better ratio; 11 is far slower
+
+def _quality(params: list) -> float:
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0
+    return 1
+
+def _accepted(header: str) -> set:
+    """Values of an Accept-style header, minus those refused with q=0"""
+    values = set()
+    for part in header.split(","):
+        value, *params = part.split(";")
+        if value.strip() and _quality(params) > 0:
+            values.add(value.strip().lower())
+    return values
+
+def response_media_type(request: Request) -> str:
+    if msgpack is not None and _accepted(request.headers.get("accept", "")) & set(MSGPACK_MEDIA_TYPES):
+        return MSGPACK_MEDIA_TYPES[0]
+    return "application/json"
+
+def response_encoding(request: Request) -> Optional[str]:
+    accepted = _accepted(request.headers.get("accept-encoding", ""))
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def negotiated_response(request: Request, content, headers: dict = None) -> Response:
+    """json_response, in MessagePack and compressed when the client accepts it"""
+    media_type = response_media_type(request)
+    body = msgpack.packb(content) if media_type != "application/json" else dumps(content)
+    headers = dict(headers or {}, Vary="Accept, Accept-Encoding")
+    encoding = response_encoding(request)
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        body = brotli.compress(body, quality=BROTLI_QUALITY) if encoding == "br" else gzip.compress(body, GZIP_LEVEL)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def dicts_to_columns(items: list, fields: list) -> dict:
+    """Columnar form of a list of dicts with the given keys"""
+    return {field: [item[field] for item in items] for field in fields}
+
+def isoformat(value):
+    return value.isoformat() if value is not None else None
+
+def split_list(value):
+    # Comma-separated column, as Todo.split_exceptions reads it
+    return [item for item in value.split(",") if item] if value else []
+
+class RowSerializer:
+    """Maps rows of a model's columns to the dicts its response schema serializes to.
+
+    Fields are emitted in schema order. Date and DateTime columns are ISO formatted;
+    `converters` handles fields whose schema reshapes the stored value.
+    """
+
+    def __init__(self, schema, model, converters: dict = None):
+        table = model.__table__
+        self.fields = list(schema.__fields__)
+        self.columns = [table.c[name] for name in self.fields]
+        converters = converters or {}
+        self.conversions = []
+        for index, column in enumerate(self.columns):
+            convert = converters.get(column.name)
+            if convert is None and isinstance(column.type, (Date, DateTime)):
+                convert = isoformat
+            if convert is not None:
+                self.conversions.append((index, column.name, convert))
+
+    def to_dict(self, row) -> dict:
+        item = dict(zip(self.fields, row))
+        for index, name, convert in self.conversions:
+            item[name] = convert(row[index])
+        return item
+
+    def to_list(self, rows) -> list:
+        return [self.to_dict(row) for row in rows]
+
+    def to_columns(self, rows) -> dict:
+        """Struct-of-arrays form of to_list: each field once, with a list of its values"""
+        rows = list(rows)
+        columns = {field: [row[index] for row in rows] for index, field in enumerate(self.fields)}
+        for _, name, convert in self.conversions:
+            columns[name] = [convert(value) for value in columns[name]]
+        return columns
+
+    def query(self, query):
+        """`query` narrowed to this serializer's columns, yielding tuples rather than ORM objects"""
+        return query.with_entities(*self.columns)
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from config import settings
+
+# Naming of the SQLite files user data is sharded across (see database.py), and the
+# bounded cache of their engines.
+
+SHARD_MODES = ("off", "user", "hash")
+SHARDING = settings.SHARDING != "off"
+
+def shard_name(username: str) -> str:
+    """The shard holding the user's rows under the current SHARDING and SHARD_COUNT"""
+    # A stable digest rather than hash(), which differs between processes
+    digest = hashlib.sha1(username.encode()).hexdigest()
+    if settings.SHARDING == "hash":
+        return f"bucket-{int(digest, 16) % settings.SHARD_COUNT:04d}"
+    return f"user-{digest[:20]}"
+
+def shard_path(name: str) -> str:
+    return os.path.join(settings.SHARD_DIRECTORY, f"{name}.db")
+
+def shard_names() -> list:
+    """Every shard file in SHARD_DIRECTORY, including those an earlier SHARDING setting created"""
+    if not os.path.isdir(settings.SHARD_DIRECTORY):
+        return []
+    return sorted(name[:-3] for name in os.listdir(settings.SHARD_DIRECTORY) if name.endswith(".db"))
+
+class EngineCache:
+    """Thread-safe LRU of engines by shard name, created on first use.
+
+    An evicted engine is disposed, which closes its idle connections; sessions still using
+    one of its connections finish normally and the connection is closed when they let go.
+    """
+
+    def __init__(self, maxsize: int, create):
+        self.maxsize = maxsize
+        self.create = create
+        self.opened = 0
+        self.evicted = 0
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        with self._lock:
+            engine = self._engines.get(name)
+            if engine is not None:
+                self._engines.move_to_end(name)
+                return engine
+        # Created outside the lock, so opening a new shard doesn't hold up requests for others
+        engine = self.create(name)
+        evicted = []
+        with self._lock:
+            if name in self._engines:
+                # Another thread opened it meanwhile
+                evicted.append(engine)
+                engine = self._engines[name]
+            else:
+                self._engines[name] = engine
+                self.opened += 1
+            while len(self._engines) > max(self.maxsize, 1):
+                evicted.append(self._engines.popitem(last=False)[1])
+                self.evicted += 1
+        for stale in evicted:
+            stale.dispose()
+        return engine
+
+    def clear(self):
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+        for engine in engines:
+            engine.dispose()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._engines), "opened": self.opened, "evicted": self.evicted}
@@ -0,0 +1,133 @@
+from datetime import datetime
+from typing import Iterable
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.orm import Session
+from models import (
+    Todo as TodoModel, Calendar as CalendarModel, Template as TemplateModel,
+    SyncVersion as SyncVersionModel, Tombstone as TombstoneModel
+)
+import changefeed
+
+# Rows of these models carry the user's sync version of their last change, and
+# leave a tombstone when deleted
+SYNCED_ENTITIES = {TodoModel: "todo", CalendarModel: "calendar", TemplateModel: "template"}
+
+# sync_versions column recording when each entity's collection last changed
+COLLECTION_COLUMNS = {"todo": "todos_version", "calendar": "calendars_version", "template": "templates_version"}
+
+def _upsert_increment(dialect_name: str, username: str, columns: Iterable[str]):
+    table = SyncVersionModel.__table__
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    # In the conflict branch table.c.version is the existing row's value
+    bumped = {name: table.c.version + 1 for name in ["version", *columns]}
+    return dialect_insert(table).values(user_id=username, **{name: 1 for name in bumped}).on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_=bumped
+    )
+
+def advance_version(session: Session, username: str, entities: Iterable[str] = ()):
+    """Atomically advance the user's sync version, marking the given entities' collections changed"""
+    table = SyncVersionModel.__table__
+    columns = [COLLECTION_COLUMNS[entity] for entity in set(entities)]
+    # Core statements on the connection, so this is safe to call while flushing
+    conn = session.connection()
+    statement = _upsert_increment(conn.dialect.name, username, columns)
+    if statement is not None:
+        conn.execute(statement)
+    else:
+        bumped = {name: table.c.version + 1 for name in ["version", *columns]}
+        if conn.execute(update(table).where(table.c.user_id == username).values(**bumped)).rowcount == 0:
+            conn.execute(insert(table).values(user_id=username, **{name: 1 for name in bumped}))
+
+def bump_version(session: Session, username: str, entities: Iterable[str] = ()) -> int:
+    """advance_version, returning the new version"""
+    advance_version(session, username, entities)
+    table = SyncVersionModel.__table__
+    return session.connection().execute(select(table.c.version).where(table.c.user_id == username)).scalar_one()
+
+def current_version(session: Session, username: str) -> int:
+    table = SyncVersionModel.__table__
+    version = session.execute(select(table.c.version).where(table.c.user_id == username)).scalar()
+    return version or 0
+
+def collection_version(session: Session, username: str, entity: str) -> int:
+    """Version at which the user's todos, calendars or templates last changed"""
+    table = SyncVersionModel.__table__
+    column = table.c[COLLECTION_COLUMNS[entity]]
+    version = session.execute(select(column).where(table.c.user_id == username)).scalar()
+    return version or 0
+
+def pruned_version(session: Session, username: str) -> int:
+    """Syncs from before this version would miss pruned deletions, so get everything instead"""
+    table = SyncVersionModel.__table__
+    version = session.execute(select(table.c.pruned_version).where(table.c.user_id == username)).scalar()
+    return version or 0
+
+def prune_tombstones(session: Session, before: datetime) -> int:
+    """Delete the tombstones of rows deleted before `before`, every user's; returns how many"""
+    tombstones = TombstoneModel.__table__
+    versions = SyncVersionModel.__table__
+    conn = session.connection()
+    # A user's versions only grow, so the newest pruned one is at least their previous floor
+    newest_pruned = select(func.max(tombstones.c.version)).where(
+        tombstones.c.user_id == versions.c.user_id,
+        tombstones.c.deleted_at < before
+    ).scalar_subquery()
+    conn.execute(update(versions).where(newest_pruned.isnot(None)).values(pruned_version=newest_pruned))
+    return conn.execute(delete(tombstones).where(tombstones.c.deleted_at < before)).rowcount
+
+def record_deletions(session: Session, username: str, entity: str, entity_ids: Iterable[str]):
+    """Leave tombstones for rows removed by a bulk query delete, which bypasses the flush hook"""
+    entity_ids = list(entity_ids)
+    if not entity_ids:
+        return
+    version = bump_version(session, username, [entity])
+    now = datetime.utcnow()
+    session.connection().execute(insert(TombstoneModel.__table__), [
+        {"user_id": username, "entity": entity, "entity_id": entity_id, "version": version, "deleted_at": now}
+        for entity_id in entity_ids
+    ])
+    for entity_id in entity_ids:
+        changefeed.record(session, username, entity, entity_id, "delete", version)
+
+def delete_with_tombstones(session: Session, username: str, model, query):
+    """Bulk-delete the rows matched by `query`, recording a tombstone for each"""
+    record_deletions(session, username, SYNCED_ENTITIES[model], [row_id for (row_id,) in query.with_entities(model.id)])
+    query.delete(synchronize_session=False)
+
+@event.listens_for(Session, "before_flush")
+def stamp_changes(session, flush_context, instances):
+    changed = [
+        obj for obj in list(session.new) + [obj for obj in session.dirty if session.is_modified(obj)]
+        if type(obj) in SYNCED_ENTITIES
+    ]
+    deleted = [obj for obj in session.deleted if type(obj) in SYNCED_ENTITIES]
+    if not changed and not deleted:
+        return
+
+    # One bump per user per flush covers every row it writes
+    entities_by_user = {}
+    for obj in changed + deleted:
+        entities_by_user.setdefault(obj.user_id, set()).add(SYNCED_ENTITIES[type(obj)])
+    versions = {username: bump_version(session, username, entities) for username, entities in entities_by_user.items()}
+    now = datetime.utcnow()
+
+    for obj in changed:
+        obj.version = versions[obj.user_id]
+        obj.updated_at = now
+        changefeed.record(session, obj.user_id, SYNCED_ENTITIES[type(obj)], obj.id, "upsert", obj.version)
+
+    for obj in deleted:
+        session.add(TombstoneModel(
+            user_id=obj.user_id,
+            entity=SYNCED_ENTITIES[type(obj)],
+            entity_id=obj.id,
+            version=versions[obj.user_id],
+            deleted_at=now
+        ))
+        changefeed.record(session, obj.user_id, SYNCED_ENTITIES[type(obj)], obj.id, "delete", versions[obj.user_id])
@@ -0,0 +1,177 @@
+import sqlite3
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy import Integer, bindparam, delete, insert, literal_column, select, text
+from sqlalchemy.orm import Session
+from models import Todo as TodoModel, OccurrenceOverride as OccurrenceOverrideModel, Tombstone as TombstoneModel
+from sync import SYNCED_ENTITIES, advance_version, current_version
+import analytics
+import changefeed
+
+# Single-row writes for the item endpoints: one UPDATE ... RETURNING or DELETE ... RETURNING
+# instead of loading the row, changing it through the ORM and reading it back after the
+# commit. The statements are written as text because SQLAlchemy 1.4 only compiles RETURNING
+# for PostgreSQL, while SQLite has supported it since 3.35; elsewhere the row is read back
+# with a SELECT. Like importer.py, these bypass the flush hooks, so sync versions,
+# tombstones, rollups and the change feed are maintained here.
+#
+# Each row's `version` is the user's sync version of its last change. Callers pass the
+# versions an If-Match header allows, and a row at any other version is left alone (412).
+
+# The user's sync version, as just advanced by advance_version
+USER_VERSION = "(SELECT version FROM sync_versions WHERE user_id = :user_id)"
+
+def supports_returning(conn) -> bool:
+    if conn.dialect.name == "postgresql":
+        return True
+    return conn.dialect.name == "sqlite" and sqlite3.sqlite_version_info >= (3, 35)
+
+def if_match_versions(header: Optional[str]) -> Optional[list]:
+    """Row versions an If-Match header accepts, or None when any will do"""
+    if header is None or header.strip() == "*":
+        return None
+    versions = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        # Weak tags never match in If-Match, and ours are all of the form "<version>"
+        if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+            versions.append(int(tag[1:-1]))
+    return versions
+
+def row_etag(version: int) -> str:
+    return f'"{version}"'
+
+def _match(table, username: str, row_id: str, versions: Optional[list]):
+    """WHERE clause and its binds for the user's row, at one of `versions` if given"""
+    sql = "id = :id AND user_id = :user_id"
+    binds = [bindparam("id", row_id, type_=table.c.id.type), bindparam("user_id", username, type_=table.c.user_id.type)]
+    if versions is not None:
+        sql += " AND version IN :versions"
+        binds.append(bindparam("versions", versions, expanding=True))
+    return sql, binds
+
+def _not_written(conn, table, username: str, row_id: str, versions: Optional[list], name: str) -> HTTPException:
+    """The error for a statement that matched no row: 404, or 412 if the row is there at another version"""
+    if versions is not None and conn.execute(
+        select(table.c.id).where(table.c.id == row_id, table.c.user_id == username)
+    ).first():
+        return HTTPException(status_code=412, detail=f"{name} has changed since it was read")
+    return HTTPException(status_code=404, detail=f"{name} not found")
+
+def check_row(session: Session, username: str, model, row_id: str, versions: Optional[list] = None, name: str = "Row"):
+    """Raise what a conditional write of the user's row would (404 or 412) without writing it"""
+    table = model.__table__
+    conn = session.connection()
+    where, binds = _match(table, username, row_id, versions)
+    if conn.execute(text(f"SELECT id FROM {table.name} WHERE {where}").bindparams(*binds)).first() is None:
+        raise _not_written(conn, table, username, row_id, versions, name)
+
+def update_row(
+    session: Session, username: str, model, row_id: str, changes: dict, columns: list,
+    versions: Optional[list] = None, expressions: dict = None, name: str = "Row"
+):
+    """Set `changes` on the user's row and return its `columns` afterwards, which must include version.
+
+    `expressions` are SQL assignments for columns whose new value depends on the old one;
+    they may use the :now bind, the time the change is stamped with.
+    """
+    advance_version(session, username, [SYNCED_ENTITIES[model]])
+    return _update(session, username, model, row_id, changes, columns, versions, expressions, name)
+
+def _update(session, username, model, row_id, changes, columns, versions, expressions, name):
+    """update_row once the user's version has been advanced"""
+    table = model.__table__
+    conn = session.connection()
+    assignments = [f"{column} = :set_{column}" for column in changes]
+    assignments += [f"{column} = {expression}" for column, expression in (expressions or {}).items()]
+    assignments += [f"version = {USER_VERSION}", "updated_at = :now"]
+    where, binds = _match(table, username, row_id, versions)
+    binds += [bindparam(f"set_{column}", value, type_=table.c[column].type) for column, value in changes.items()]
+    binds.append(bindparam("now", datetime.utcnow(), type_=table.c.updated_at.type))
+    sql = f"UPDATE {table.name} SET {', '.join(assignments)} WHERE {where}"
+
+    if supports_returning(conn):
+        returning = ", ".join(column.name for column in columns)
+        row = conn.execute(text(f"{sql} RETURNING {returning}").bindparams(*binds).columns(*columns)).first()
+    elif conn.execute(text(sql).bindparams(*binds)).rowcount:
+        row = conn.execute(select(*columns).where(table.c.id == row_id)).first()
+    else:
+        row = None
+    if row is None:
+        raise _not_written(conn, table, username, row_id, versions, name)
+    changefeed.record(session, username, SYNCED_ENTITIES[model], row_id, "upsert", row.version)
+    return row
+
+def delete_row(
+    session: Session, username: str, model, row_id: str, columns: list = (),
+    versions: Optional[list] = None, name: str = "Row"
+):
+    """Delete the user's row, leaving a tombstone; returns its `columns` as they were"""
+    table = model.__table__
+    entity = SYNCED_ENTITIES[model]
+    conn = session.connection()
+    advance_version(session, username, [entity])
+
+    where, binds = _match(table, username, row_id, versions)
+    sql = f"DELETE FROM {table.name} WHERE {where}"
+    if supports_returning(conn):
+        returning = ", ".join([column.name for column in columns] + [f"{USER_VERSION} AS sync_version"])
+        statement = text(f"{sql} RETURNING {returning}").bindparams(*binds).columns(*columns, literal_column("sync_version", Integer))
+        row = conn.execute(statement).first()
+        version = row.sync_version if row is not None else None
+    else:
+        row = conn.execute(select(table.c.id, *columns).where(table.c.id == row_id, table.c.user_id == username)).first()
+        if row is not None and not conn.execute(text(sql).bindparams(*binds)).rowcount:
+            row = None
+        version = current_version(session, username)
+    if row is None:
+        raise _not_written(conn, table, username, row_id, versions, name)
+
+    conn.execute(insert(TombstoneModel.__table__).values(
+        user_id=username, entity=entity, entity_id=row_id, version=version, deleted_at=datetime.utcnow()
+    ))
+    changefeed.record(session, username, entity, row_id, "delete", version)
+    return row
+
+# ================= TODOS =================
+
+TRACKED_COLUMNS = [TodoModel.__table__.c[field] for field in analytics.TRACKED_FIELDS]
+
+def update_todo(session: Session, username: str, todo_id: str, changes: dict, columns: list, versions: Optional[list] = None):
+    """update_row for todos, stamping completed_at as is_completed changes and keeping the rollups current"""
+    table = TodoModel.__table__
+    expressions = {}
+    if "is_completed" in changes:
+        # Completing keeps the first completion time; reopening clears it
+        expressions["completed_at"] = "CASE WHEN is_completed THEN completed_at ELSE :now END" if changes["is_completed"] else "NULL"
+
+    if not set(changes) & set(analytics.TRACKED_FIELDS):
+        # Rescheduling, renaming and the like leave the rollups alone
+        return update_row(session, username, TodoModel, todo_id, changes, columns, versions, expressions, "Todo")
+
+    # Read after the version bump has taken the write lock, so nothing changes in between
+    advance_version(session, username, ["todo"])
+    previous = session.connection().execute(
+        select(*TRACKED_COLUMNS).where(table.c.id == todo_id, table.c.user_id == username)
+    ).first()
+    if previous is None:
+        raise HTTPException(status_code=404, detail="Todo not found")
+    extra = [column for column in TRACKED_COLUMNS if column not in columns]
+    row = _update(session, username, TodoModel, todo_id, changes, list(columns) + extra, versions, expressions, "Todo")
+    analytics.record_change(session, previous._mapping, row._mapping)
+    return row
+
+def delete_todo(session: Session, username: str, todo_id: str, versions: Optional[list] = None):
+    row = delete_row(session, username, TodoModel, todo_id, TRACKED_COLUMNS + [TodoModel.__table__.c.is_recurring], versions, "Todo")
+    overrides = session.query(OccurrenceOverrideModel).filter(
+        OccurrenceOverrideModel.todo_id == todo_id,
+        OccurrenceOverrideModel.user_id == username
+    )
+    if row.is_recurring:
+        analytics.forget_occurrences(session, overrides, series=(row.calendar_id, row.estimated_time))
+    session.connection().execute(delete(OccurrenceOverrideModel.__table__).where(
+        OccurrenceOverrideModel.todo_id == todo_id,
+        OccurrenceOverrideModel.user_id == username
+    ))
+    analytics.record_change(session, previous=row._mapping)
@@ -23,6 +23,11 @@ try:
     ensure_admin_user()
     print("WSGI: Admin user and default data initialized!")
     
+    # Pick up background jobs an earlier process didn't finish, and prune old tombstones
+    from jobs import resume_jobs, schedule_tombstone_pruning
+    resume_jobs()
+    schedule_tombstone_pruning()
+    
 except Exception as e:
     print(f"WSGI: Error during initialization: {e}")
     import traceback
@@ -9,27 +9,24 @@ if project_home not in sys.path:
 # Set environment variables if needed
 os.environ.setdefault('DATABASE_URL', 'sqlite:///./good_vibes.db')
 
-# Import models first to register them
-import models  # This ensures all models are registered with SQLAlchemy
-
-# Import database functions
-from database import create_tables, engine
-from models import Base
-
-# Initialize database tables when WSGI starts
+# WSGI doesn't run FastAPI startup events, so initialize here. init_db only reads the
+# schema version when the tables are current, rather than reflecting every table.
 try:
-    print("WSGI: Initializing database tables...")
-    Base.metadata.create_all(bind=engine)
-    print("WSGI: Database tables created successfully!")
+    print("WSGI: Initializing database...")
+    from database import init_db
+    init_db()
+    
+    from auth import ensure_admin_user
+    ensure_admin_user()
     
-    # List created tables for debugging
-    from sqlalchemy import inspect
-    inspector = inspect(engine)
-    tables = inspector.get_table_names()
-    print(f"WSGI: Available tables: {tables}")
+    # Pick up background jobs an earlier process didn't finish, and prune old tombstones
+    from jobs import resume_jobs, schedule_tombstone_pruning
+    resume_jobs()
+    schedule_tombstone_pruning()
+    print("WSGI: Database ready!")
     
 except Exception as e:
-    print(f"WSGI: Error creating database tables: {e}")
+    print(f"WSGI: Error initializing database: {e}")
 
 # Import the FastAPI app
 from main import app
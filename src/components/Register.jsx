@@ -1,5 +1,6 @@
 import React, { useState } from 'react';
 import { register, login } from '../services/auth';
+import { apiClient } from '../services/api';
 
 const Register = ({ onRegisterSuccess, onSwitchToLogin }) => {
   const [formData, setFormData] = useState({
@@ -36,11 +37,15 @@ const Register = ({ onRegisterSuccess, onSwitchToLogin }) => {
 
     try {
       // Register the user
-      await register(formData.username, formData.password);
+      const { job_id } = await register(formData.username, formData.password);
       
       // Automatically log them in
       await login(formData.username, formData.password);
       
+      // Default calendars are created by a background job; wait for it so the first
+      // load shows them
+      await apiClient.waitForJob(job_id);
+      
       onRegisterSuccess();
     } catch (error) {
       setError(error.message || 'Registration failed');
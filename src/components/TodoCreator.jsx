@@ -2,6 +2,7 @@ import React, { useState } from 'react'
 import { useTodos } from '../contexts/TodoContext'
 import { X, Calendar, Repeat, Save, Sparkles } from 'lucide-react'
 import { format } from 'date-fns'
+import clsx from 'clsx'
 
 function TodoCreator({ onClose }) {
   const { addTodo, templates, addTemplate, calendars } = useTodos()
@@ -18,10 +19,16 @@ function TodoCreator({ onClose }) {
   })
   const [saveAsTemplate, setSaveAsTemplate] = useState(false)
   const [templateName, setTemplateName] = useState('')
+  const [recurringError, setRecurringError] = useState('')
 
   const handleSubmit = (e) => {
     e.preventDefault()
     if (!formData.title.trim()) return
+    // The API anchors a recurring rule on its start date
+    if (formData.isRecurring && !formData.startDate) {
+      setRecurringError('Recurring tasks need a start date to repeat from')
+      return
+    }
 
     const todoData = {
       ...formData,
@@ -39,42 +46,17 @@ function TodoCreator({ onClose }) {
       })
     }
 
-    if (formData.isRecurring && formData.recurringCount > 1) {
-      // Create multiple todos for recurring tasks
-      for (let i = 0; i < formData.recurringCount; i++) {
-        let adjustedTodoData = { ...todoData }
-        
-        if (formData.startDate && formData.endDate) {
-          // For recurring tasks, shift both start and end dates
-          const startDate = new Date(formData.startDate)
-          const endDate = new Date(formData.endDate)
-          
-          if (formData.recurringPattern === 'daily') {
-            startDate.setDate(startDate.getDate() + i)
-            endDate.setDate(endDate.getDate() + i)
-          } else if (formData.recurringPattern === 'weekly') {
-            startDate.setDate(startDate.getDate() + (i * 7))
-            endDate.setDate(endDate.getDate() + (i * 7))
-          } else if (formData.recurringPattern === 'monthly') {
-            startDate.setMonth(startDate.getMonth() + i)
-            endDate.setMonth(endDate.getMonth() + i)
-          }
-          
-          adjustedTodoData.startDate = startDate.toISOString().split('T')[0]
-          adjustedTodoData.endDate = endDate.toISOString().split('T')[0]
-        }
-        
-        adjustedTodoData.title = `${todoData.title}${i > 0 ? ` (${i + 1})` : ''}`
-        addTodo(adjustedTodoData)
-      }
-    } else {
-      addTodo(todoData)
-    }
+    // Recurring tasks are stored as a single rule and expanded into occurrences by the API
+    addTodo({
+      ...todoData,
+      isRecurring: formData.isRecurring && formData.recurringCount > 1
+    })
 
     onClose()
   }
 
   const handleChange = (field, value) => {
+    if (field === 'startDate' || field === 'isRecurring') setRecurringError('')
     setFormData(prev => ({
       ...prev,
       [field]: value
@@ -171,12 +153,16 @@ function TodoCreator({ onClose }) {
             <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
               {/* Start Date */}
               <div>
-                <label className="block text-sm text-gray-600 mb-1">Start Date</label>
+                <label className="block text-sm text-gray-600 mb-1">Start Date{formData.isRecurring && ' *'}</label>
                 <input
                   type="date"
                   value={formData.startDate}
                   onChange={(e) => handleChange('startDate', e.target.value)}
-                  className="w-full px-4 py-3 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent"
+                  required={formData.isRecurring}
+                  className={clsx(
+                    'w-full px-4 py-3 border rounded-lg focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent',
+                    recurringError ? 'border-red-400' : 'border-gray-300'
+                  )}
                 />
               </div>
               
@@ -281,6 +267,9 @@ function TodoCreator({ onClose }) {
                 </div>
               </div>
             )}
+            {recurringError && (
+              <p className="text-sm text-red-600 mt-3">{recurringError}</p>
+            )}
           </div>
 
           {/* Save as Template */}
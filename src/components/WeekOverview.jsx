@@ -6,7 +6,7 @@ import { Plus, Calendar, ChevronLeft, ChevronRight } from 'lucide-react'
 import clsx from 'clsx'
 
 function WeekOverview({ calendar = null, showHeader = true }) {
-  const { todos, addTodo, updateTodo, deleteTodo, calendars } = useTodos()
+  const { todos, addTodo, updateTodo, deleteTodo, calendars, ensureWindow } = useTodos()
   const [showQuickAdd, setShowQuickAdd] = useState(false)
   const [quickAddData, setQuickAddData] = useState({ 
     date: null, 
@@ -62,6 +62,11 @@ function WeekOverview({ calendar = null, showHeader = true }) {
     return new Date(day.getFullYear(), day.getMonth(), day.getDate())
   })
 
+  // Load the todos of the shown days if navigation went past what's loaded
+  useEffect(() => {
+    ensureWindow(format(weekDays[0], 'yyyy-MM-dd'), format(weekDays[6], 'yyyy-MM-dd'))
+  }, [centerDate, ensureWindow])
+
   // Navigation functions
   const goToPreviousWeek = () => {
     setCenterDate(prev => subDays(prev, 7))
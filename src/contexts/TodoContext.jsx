@@ -1,8 +1,32 @@
-import React, { createContext, useContext, useReducer, useEffect, useState, useCallback } from 'react'
+import React, { createContext, useContext, useReducer, useEffect, useState, useCallback, useRef } from 'react'
+import { addDays, format, parseISO, subDays } from 'date-fns'
 import apiClient from '../services/api'
 
 const TodoContext = createContext()
 
+// Todos (and recurring occurrences) are loaded for a window of days, starting this many
+// days either side of today and growing by as much again when a view asks for days outside it
+const WINDOW_CHUNK_DAYS = 28
+
+// Fields one occurrence of a recurring todo can change on its own; the rest belong to the series
+const OCCURRENCE_FIELDS = ['title', 'description', 'estimatedTime', 'priority', 'isCompleted', 'startDate', 'endDate', 'calendarId']
+
+const toDay = (date) => format(date, 'yyyy-MM-dd')
+
+const windowAround = (from, to) => ({
+  from: toDay(subDays(parseISO(from), WINDOW_CHUNK_DAYS)),
+  to: toDay(addDays(parseISO(to), WINDOW_CHUNK_DAYS))
+})
+
+// Replace changed items and drop deleted ones, along with the occurrences of changed or deleted series
+const mergeChanges = (items, changed, deletedIds = []) => {
+  const replaced = new Set([...changed.map(item => item.id), ...deletedIds])
+  return [
+    ...items.filter(item => !replaced.has(item.id) && !replaced.has(item.seriesId)),
+    ...changed
+  ]
+}
+
 const initialState = {
   todos: [],
   calendars: [],
@@ -36,6 +60,22 @@ const todoReducer = (state, action) => {
         error: null
       }
     
+    case 'ADD_WINDOW':
+      return {
+        ...state,
+        todos: mergeChanges(state.todos, action.payload)
+      }
+    
+    case 'APPLY_CHANGES': {
+      const { todos, calendars, templates, deleted = {} } = action.payload
+      return {
+        ...state,
+        todos: mergeChanges(state.todos, todos, deleted.todos),
+        calendars: mergeChanges(state.calendars, calendars, deleted.calendars),
+        templates: mergeChanges(state.templates, templates, deleted.templates)
+      }
+    }
+    
     case 'ADD_TODO':
       return {
         ...state,
@@ -98,6 +138,11 @@ export function TodoProvider({ children }) {
   const [state, dispatch] = useReducer(todoReducer, initialState)
   const [dataInitialized, setDataInitialized] = useState(false)
   const [currentUser, setCurrentUser] = useState(null)
+  // Sync version the loaded data reflects, for fetching only what changed since
+  const syncVersion = useRef(null)
+  // Days the loaded todos cover ({ from, to }), and the window fetches queued behind each other
+  const loadedWindow = useRef(null)
+  const windowLoads = useRef(Promise.resolve())
 
   // Helper function to convert API response fields to frontend format
   const transformApiTodo = (apiTodo) => ({
@@ -111,6 +156,9 @@ export function TodoProvider({ children }) {
     isRecurring: apiTodo.is_recurring,
     recurringPattern: apiTodo.recurring_pattern,
     recurringCount: apiTodo.recurring_count,
+    recurringUntil: apiTodo.recurring_until,
+    seriesId: apiTodo.series_id,
+    occurrenceDate: apiTodo.occurrence_date,
     estimatedTime: apiTodo.estimated_time
   })
 
@@ -125,6 +173,7 @@ export function TodoProvider({ children }) {
     is_recurring: frontendTodo.isRecurring,
     recurring_pattern: frontendTodo.recurringPattern,
     recurring_count: frontendTodo.recurringCount,
+    recurring_until: frontendTodo.recurringUntil,
     estimated_time: frontendTodo.estimatedTime
   })
 
@@ -132,20 +181,25 @@ export function TodoProvider({ children }) {
     try {
       dispatch({ type: 'SET_LOADING', payload: true })
       
-      const [todosResponse, calendarsResponse, templatesResponse] = await Promise.all([
-        apiClient.getTodos(),
-        apiClient.getCalendars(),
-        apiClient.getTemplates()
-      ])
+      const dataWindow = loadedWindow.current || windowAround(toDay(new Date()), toDay(new Date()))
+      const { todos: todosResponse, occurrences, calendars, templates, version } = await apiClient.bootstrap(dataWindow)
+      
+      // Replace each recurring series with its occurrences
+      const todos = [
+        ...todosResponse.filter(todo => !todo.is_recurring),
+        ...occurrences.filter(occurrence => occurrence.series_id)
+      ]
       
-      const transformedTodos = todosResponse.map(transformApiTodo)
+      const transformedTodos = todos.map(transformApiTodo)
+      syncVersion.current = version
+      loadedWindow.current = dataWindow
       
       dispatch({ 
         type: 'LOAD_ALL_DATA', 
         payload: { 
           todos: transformedTodos, 
-          calendars: calendarsResponse, 
-          templates: templatesResponse 
+          calendars, 
+          templates 
         } 
       })
     } catch (error) {
@@ -154,8 +208,41 @@ export function TodoProvider({ children }) {
     }
   }
 
+  // Make sure the todos of the days from..to ('YYYY-MM-DD') are loaded, fetching only the
+  // days between them and the loaded window; a jump far outside it reloads around the new days
+  const ensureWindow = useCallback((from, to) => {
+    windowLoads.current = windowLoads.current.then(async () => {
+      const loaded = loadedWindow.current
+      if (!loaded || (from >= loaded.from && to <= loaded.to)) return
+      
+      const wanted = windowAround(from, to)
+      if (wanted.to < loaded.from || wanted.from > loaded.to) {
+        loadedWindow.current = wanted
+        await loadAllData()
+        return
+      }
+      
+      const ranges = []
+      if (wanted.from < loaded.from) ranges.push({ from: wanted.from, to: toDay(subDays(parseISO(loaded.from), 1)) })
+      if (wanted.to > loaded.to) ranges.push({ from: toDay(addDays(parseISO(loaded.to), 1)), to: wanted.to })
+      for (const range of ranges) {
+        const todos = await apiClient.getOccurrences(range)
+        dispatch({ type: 'ADD_WINDOW', payload: todos.map(transformApiTodo) })
+      }
+      loadedWindow.current = {
+        from: wanted.from < loaded.from ? wanted.from : loaded.from,
+        to: wanted.to > loaded.to ? wanted.to : loaded.to
+      }
+    }).catch(error => {
+      console.error('Failed to load todos:', error)
+      dispatch({ type: 'SET_ERROR', payload: 'Failed to load todos' })
+    })
+    return windowLoads.current
+  }, [])
+
   // Function to reset context state (called when user logs out)
   const resetData = useCallback(() => {
+    loadedWindow.current = null
     dispatch({ type: 'LOAD_ALL_DATA', payload: { todos: [], calendars: [], templates: [] } })
     setDataInitialized(false)
     setCurrentUser(null)
@@ -180,6 +267,51 @@ export function TodoProvider({ children }) {
     }
   }, [currentUser, dataInitialized])
 
+  // Fetch and apply what other tabs and devices changed since the loaded version
+  const applyRemoteChanges = async () => {
+    const delta = await apiClient.sync(syncVersion.current)
+    // Reload everything when the server couldn't send a delta (deletions since our version
+    // were pruned), or when series changed: they're shown as occurrences only a full load expands
+    if (delta.reset || delta.todos.some(todo => todo.is_recurring)) {
+      await loadAllData()
+      return
+    }
+    syncVersion.current = delta.version
+    dispatch({
+      type: 'APPLY_CHANGES',
+      payload: {
+        todos: delta.todos.map(transformApiTodo),
+        calendars: delta.calendars,
+        templates: delta.templates,
+        deleted: delta.deleted
+      }
+    })
+  }
+
+  // Follow the change feed while data is loaded, instead of refetching everything
+  useEffect(() => {
+    if (!dataInitialized) return
+    let applying = Promise.resolve()
+    // Versions this client wrote itself are applied already; count them as synced as long
+    // as they follow on from the synced version, so nothing in between is skipped
+    const isApplied = version => {
+      while (apiClient.ownVersions.has(syncVersion.current + 1)) {
+        syncVersion.current += 1
+      }
+      apiClient.ownVersions.forEach(own => own <= syncVersion.current && apiClient.ownVersions.delete(own))
+      return version <= syncVersion.current
+    }
+    const unsubscribe = apiClient.subscribeToChanges(syncVersion.current, message => {
+      if (isApplied(message.version)) return
+      // One sync at a time; each fetches everything since the version the last one reached.
+      // Checked again once queued, as the write's own response may have arrived meanwhile
+      applying = applying
+        .then(() => !isApplied(message.version) && applyRemoteChanges())
+        .catch(error => console.error('Failed to apply changes:', error))
+    })
+    return unsubscribe
+  }, [dataInitialized, currentUser])
+
   // Todo operations
   const addTodo = async (todo) => {
     try {
@@ -195,7 +327,12 @@ export function TodoProvider({ children }) {
       const createdTodo = await apiClient.createTodo(apiTodo)
       const transformedTodo = transformApiTodo(createdTodo)
       
-      dispatch({ type: 'ADD_TODO', payload: transformedTodo })
+      if (createdTodo.is_recurring) {
+        // Pick up the expanded occurrences rather than the series row
+        await loadAllData()
+      } else {
+        dispatch({ type: 'ADD_TODO', payload: transformedTodo })
+      }
       return transformedTodo
     } catch (error) {
       console.error('Failed to create todo:', error)
@@ -204,10 +341,45 @@ export function TodoProvider({ children }) {
     }
   }
 
+  // Occurrence fields are saved for this occurrence only; others change the whole series,
+  // which the user is asked to confirm first
+  const updateOccurrence = async (occurrence, updates) => {
+    const occurrenceUpdates = {}
+    const seriesUpdates = {}
+    for (const [field, value] of Object.entries(updates)) {
+      if (OCCURRENCE_FIELDS.includes(field)) {
+        occurrenceUpdates[field] = value
+      } else {
+        seriesUpdates[field] = value
+      }
+    }
+    const changesSeries = Object.keys(seriesUpdates).length > 0
+    if (changesSeries && !window.confirm('This changes every occurrence of the recurring task, not just this one. Continue?')) {
+      return occurrence
+    }
+    
+    let updatedOccurrence = occurrence
+    if (Object.keys(occurrenceUpdates).length > 0) {
+      updatedOccurrence = transformApiTodo(await apiClient.updateOccurrence(
+        occurrence.seriesId, occurrence.occurrenceDate, transformToApiTodo(occurrenceUpdates)
+      ))
+      dispatch({ type: 'UPDATE_TODO', payload: updatedOccurrence })
+    }
+    if (changesSeries) {
+      await apiClient.updateTodo(occurrence.seriesId, transformToApiTodo(seriesUpdates))
+      // Re-expand the series into its occurrences
+      await loadAllData()
+    }
+    return updatedOccurrence
+  }
+
   const updateTodo = async (id, updates) => {
     try {
-      const apiUpdates = transformToApiTodo(updates)
-      const updatedTodo = await apiClient.updateTodo(id, apiUpdates)
+      const existingTodo = state.todos.find(todo => todo.id === id)
+      if (existingTodo?.seriesId) {
+        return await updateOccurrence(existingTodo, updates)
+      }
+      const updatedTodo = await apiClient.updateTodo(id, transformToApiTodo(updates))
       const transformedTodo = transformApiTodo(updatedTodo)
       
       dispatch({ type: 'UPDATE_TODO', payload: transformedTodo })
@@ -221,7 +393,12 @@ export function TodoProvider({ children }) {
 
   const deleteTodo = async (id) => {
     try {
-      await apiClient.deleteTodo(id)
+      const existingTodo = state.todos.find(todo => todo.id === id)
+      if (existingTodo?.seriesId) {
+        await apiClient.deleteOccurrence(existingTodo.seriesId, existingTodo.occurrenceDate)
+      } else {
+        await apiClient.deleteTodo(id)
+      }
       dispatch({ type: 'DELETE_TODO', payload: id })
     } catch (error) {
       console.error('Failed to delete todo:', error)
@@ -340,6 +517,7 @@ export function TodoProvider({ children }) {
     deleteTemplate,
     createTodoFromTemplate,
     loadAllData,
+    ensureWindow,
     initializeData,
     resetData,
     migrateFromLocalStorage
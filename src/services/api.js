@@ -2,17 +2,41 @@ import authService from './auth'
 
 import { API_BASE_URL } from '../config/api'
 
+// Requests turned away for rate limits or load (429/503 with Retry-After) never ran,
+// so they are safe to send again once the server says to
+const MAX_RETRIES = 3
+
+// Large lists are fetched with ?format=columnar ({ field: [values...] }, each field named
+// once); this turns them back into the usual array of objects
+const fromColumns = (columns) => {
+  const fields = Object.keys(columns)
+  const length = fields.length ? columns[fields[0]].length : 0
+  return Array.from({ length }, (_, i) => Object.fromEntries(fields.map(field => [field, columns[field][i]])))
+}
+
 class ApiClient {
+  // Sync versions committed by this client's own writes (the X-Sync-Version header), whose
+  // change events it has nothing to fetch for
+  ownVersions = new Set()
+
   async request(endpoint, options = {}) {
     const url = `${API_BASE_URL}${endpoint}`
     
     // Use the auth service for authenticated requests
     try {
-      const response = await authService.makeAuthenticatedRequest(url, options)
+      let response = await authService.makeAuthenticatedRequest(url, options)
+      for (let attempt = 0; attempt < MAX_RETRIES; attempt++) {
+        const retryAfter = response.headers.get('Retry-After')
+        if (!(response.status === 429 || response.status === 503) || !retryAfter) break
+        await new Promise(resolve => setTimeout(resolve, Number(retryAfter) * 1000))
+        response = await authService.makeAuthenticatedRequest(url, options)
+      }
       
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`)
       }
+      const versions = response.headers.get('X-Sync-Version')
+      if (versions) versions.split(',').forEach(version => this.ownVersions.add(Number(version)))
       
       // Handle empty responses
       const text = await response.text()
@@ -23,9 +47,29 @@ class ApiClient {
     }
   }
 
+  // Todos, calendars and templates in one round trip
+  // Pass { from, to } to only fetch todos overlapping that window, plus its recurring occurrences
+  async bootstrap({ from, to } = {}) {
+    const params = new URLSearchParams({ format: 'columnar' })
+    if (from) params.set('from', from)
+    if (to) params.set('to', to)
+    const data = await this.request(`/bootstrap?${params}`)
+    return {
+      ...data,
+      todos: fromColumns(data.todos),
+      calendars: fromColumns(data.calendars),
+      templates: fromColumns(data.templates),
+      occurrences: data.occurrences ? fromColumns(data.occurrences) : [],
+    }
+  }
+
   // Todo endpoints
-  async getTodos() {
-    return this.request('/todos')
+  // Pass { from, to } as 'YYYY-MM-DD' strings to only fetch todos overlapping that window
+  async getTodos({ from, to } = {}) {
+    const params = new URLSearchParams({ format: 'columnar' })
+    if (from) params.set('from', from)
+    if (to) params.set('to', to)
+    return fromColumns(await this.request(`/todos?${params}`))
   }
 
   async createTodo(todo) {
@@ -48,6 +92,33 @@ class ApiClient {
     })
   }
 
+  // Recurring todo occurrences, expanded server-side for a date window
+  async getOccurrences({ from, to }) {
+    return fromColumns(await this.request(`/occurrences?from=${from}&to=${to}&format=columnar`))
+  }
+
+  // Search: best matches first, each with `highlights` (HTML with <mark>ed matches)
+  async searchTodos(q, limit = 20) {
+    return this.request(`/todos/search?q=${encodeURIComponent(q)}&limit=${limit}`)
+  }
+
+  async searchTemplates(q, limit = 20) {
+    return this.request(`/templates/search?q=${encodeURIComponent(q)}&limit=${limit}`)
+  }
+
+  async updateOccurrence(seriesId, occurrenceDate, updates) {
+    return this.request(`/todos/${seriesId}/occurrences/${occurrenceDate}`, {
+      method: 'PUT',
+      body: updates,
+    })
+  }
+
+  async deleteOccurrence(seriesId, occurrenceDate) {
+    return this.request(`/todos/${seriesId}/occurrences/${occurrenceDate}`, {
+      method: 'DELETE',
+    })
+  }
+
   // Calendar endpoints
   async getCalendars() {
     return this.request('/calendars')
@@ -91,12 +162,74 @@ class ApiClient {
     })
   }
 
-  // Data migration
+  // Delta sync: rows changed and ids deleted since a previous sync's version (everything if omitted)
+  async sync(since) {
+    return this.request(since ? `/sync?since=${since}` : '/sync')
+  }
+
+  // Change feed: calls onChange({ version, changes } | { version, resync }) as other tabs and
+  // devices write. Pass the version the loaded data reflects, so changes made since arrive
+  // as a resync. Returns a function that closes the feed.
+  subscribeToChanges(since, onChange) {
+    let source = null
+    let closed = false
+    let lastVersion = since
+    const handle = event => {
+      const message = JSON.parse(event.data)
+      lastVersion = message.version
+      onChange(message)
+    }
+    const open = async () => {
+      // EventSource can't send headers, so it gets a short-lived stream-only ticket rather
+      // than the token, which would end up in server and proxy logs
+      const { ticket } = await this.request('/stream/ticket', { method: 'POST' })
+      if (closed) return
+      const params = new URLSearchParams({ ticket })
+      if (lastVersion) params.set('since', lastVersion)
+      source = new EventSource(`${API_BASE_URL}/stream?${params}`)
+      source.addEventListener('change', handle)
+      source.addEventListener('resync', handle)
+      source.onerror = () => {
+        // Dropped connections are retried by EventSource itself, but an error response
+        // (401 once the ticket expires) closes it for good: get a new ticket and reconnect.
+        // If the session itself expired, the ticket request logs out.
+        if (source.readyState !== EventSource.CLOSED || closed) return
+        setTimeout(() => open().catch(error => console.error('Change feed reconnect failed:', error)), 1000)
+      }
+    }
+    open().catch(error => console.error('Change feed failed to start:', error))
+    return () => {
+      closed = true
+      if (source) source.close()
+    }
+  }
+
+  // Batch: [{ resource: 'todo' | 'calendar' | 'template', op: 'create' | 'update' | 'delete', id, data }]
+  // All operations are applied in one transaction, or none are
+  async batch(operations) {
+    return this.request('/batch', {
+      method: 'POST',
+      body: { operations },
+    })
+  }
+
+  // Background jobs: poll until the job has succeeded or failed
+  async waitForJob(jobId, intervalMs = 500) {
+    for (;;) {
+      const job = await this.request(`/jobs/${jobId}`)
+      if (job.status === 'succeeded') return job
+      if (job.status === 'failed') throw new Error(job.error || 'Background job failed')
+      await new Promise(resolve => setTimeout(resolve, intervalMs))
+    }
+  }
+
+  // Data migration; resolves with the counts once the import job has finished
   async migrateData(data) {
-    return this.request('/migrate', {
+    const job = await this.request('/migrate', {
       method: 'POST',
       body: data,
     })
+    return (await this.waitForJob(job.id)).result
   }
 }
 